@@ -7,6 +7,7 @@ from pydantic import BaseModel, EmailStr, Field, field_validator
 from sqlmodel import Session, select
 from app.database import get_session
 from app.models import User
+from app.utils.response_cache import bump_data_version
 from .utils.auth_utils import create_uuid_session, get_password_hash, verify_password
 from app.response_message import DetailMessage, UpdateSuccessResponse, UserMeResponse, LogoutResponse, RegisterSuccessResponse, LoginSuccessResponse
 
@@ -200,6 +201,8 @@ async def update_account(
 
     try:
         session.add(user)
+        # Le nom d'affichage fait partie des réponses mises en cache (profil, dashboard)
+        if payload.username: bump_data_version(session, user.id)
         session.commit()
         return UpdateSuccessResponse(
             status="success",
@@ -1,5 +1,7 @@
 from fastapi import APIRouter
 from .overview import router as overview_router
+from .search import router as search_router
 
 router = APIRouter(prefix="/data", tags=["Overview"])
-router.include_router(overview_router, prefix="/overview")
\ No newline at end of file
+router.include_router(overview_router, prefix="/overview")
+router.include_router(search_router, prefix="/search")
\ No newline at end of file
@@ -1,15 +1,108 @@
 from .utils.metadata import get_date_metadata
-from app.database import get_session
-from app.models import TrackHistory, Track, Artist, Album
+from .utils.cursor import encode_cursor, keyset_filter
+from app.database import get_async_session
+from app.utils.search import contains
+from app.utils.date_range import period_filters
+from app.utils.leaderboard import leaderboards_ready
+from app.models import TRACK_LEADERBOARD_SORTS, TrackHistory, Track, Artist, Album, TrackLeaderboard, UserTrackDaily
 from typing import Optional, List
 from fastapi import APIRouter, Depends
-from sqlalchemy import Date, Float, cast, func, select, text
-from sqlmodel import Session
-from app.response_message import TrackStatsResponse, TrackMetadataResponse, DetailMessage
-from fastapi_cache.decorator import cache
+from sqlalchemy import Float, asc, cast, desc, func, select, text
+from sqlmodel.ext.asyncio.session import AsyncSession
+from app.response_message import TrackStatsResponse, TrackStatsPageResponse, TrackMetadataResponse, DetailMessage
+from app.utils.cache_backend import cache
 
 router = APIRouter()
 
+def build_tracks_query(
+    track: Optional[str], artist: Optional[str], album: Optional[str],
+    streams_min: Optional[int], streams_max: Optional[int],
+    minutes_min: Optional[float], minutes_max: Optional[float],
+    rating_min: Optional[float], rating_max: Optional[float],
+    engagement_min: Optional[float], engagement_max: Optional[float],
+    date_min: Optional[str], date_max: Optional[str], sort: str, snapshot: bool = False
+):
+    """
+    Requête classée des morceaux (tous utilisateurs confondus), filtres et tri calculés par Postgres.
+    Sans filtre de dates et avec `snapshot` (voir `leaderboards_ready`), elle est lue dans track_leaderboard
+    (index (valeur de tri, spotify_id) : une page coûte la même chose quelle que soit sa profondeur) ;
+    sinon elle est agrégée à la volée sur user_track_daily. Retourne la requête, sa colonne de tri
+    et la colonne d'identifiant qui départage les égalités.
+    """
+    if not date_min and not date_max and snapshot:
+        columns = {
+            "spotify_id": TrackLeaderboard.spotify_id, "title": TrackLeaderboard.title,
+            "artist": TrackLeaderboard.artist_name, "album": TrackLeaderboard.album_name,
+            "cover": TrackLeaderboard.image_url, "duration_ms": TrackLeaderboard.duration_ms,
+            "play_count": TrackLeaderboard.play_count, "total_minutes": TrackLeaderboard.total_minutes,
+            "engagement": TrackLeaderboard.engagement, "rating": TrackLeaderboard.rating
+        }
+        # Morceaux pas encore enrichis : absents, comme avec la jointure sur album / artiste
+        query = select(*(col.label(key) for key, col in columns.items()))
+        query = query.where(TrackLeaderboard.artist_name.isnot(None), TrackLeaderboard.album_name.isnot(None))
+    else:
+        # 1. Agrégation par morceau sur l'agrégat quotidien (filtre de dates au jour près)
+        stats = select(
+            UserTrackDaily.spotify_id,
+            func.sum(UserTrackDaily.streams).label("play_count"),
+            func.sum(UserTrackDaily.ms_played).label("sum_played"),
+            func.sum(UserTrackDaily.potential_ms).label("sum_duration")
+        )
+        stats = stats.where(*period_filters(UserTrackDaily.day, date_min, date_max)).group_by(UserTrackDaily.spotify_id).subquery()
+
+        # 2. Indicateurs (mêmes formules que l'ancien calcul Python, engagement plafonné à 1)
+        play_count = stats.c.play_count
+        total_minutes = cast(stats.c.sum_played, Float) / 60000
+        engagement = func.least(func.coalesce(cast(stats.c.sum_played, Float) / func.nullif(cast(stats.c.sum_duration, Float), 0), 0.0), 1.0)
+        rating = (engagement * total_minutes / (20.0 * play_count) + total_minutes / 40.0) / 8.0
+        columns = {
+            "spotify_id": Track.spotify_id, "title": Track.title,
+            "artist": Artist.name, "album": Album.name, "cover": Album.image_url, "duration_ms": Track.duration_ms,
+            "play_count": play_count, "total_minutes": total_minutes, "engagement": engagement, "rating": rating
+        }
+        query = (select(*(col.label(key) for key, col in columns.items()))
+            .select_from(Track)
+            .join(stats, stats.c.spotify_id == Track.spotify_id)
+            .join(Album, Track.album_id == Album.spotify_id)
+            .join(Artist, Track.artist_id == Artist.spotify_id)
+        )
+
+    # Tri "name" : titre du morceau (colonne indexée `title` du snapshot)
+    sort_key = "title" if sort == "name" else sort
+    sort_col = columns[sort_key] if sort_key in TRACK_LEADERBOARD_SORTS else columns["spotify_id"]
+    query = query.add_columns(sort_col.label("sort_value"))
+    if track: query = query.where(contains(columns["title"], track))
+    if artist: query = query.where(contains(columns["artist"], artist))
+    if album: query = query.where(contains(columns["album"], album))
+    if streams_min is not None: query = query.where(columns["play_count"] >= streams_min)
+    if streams_max is not None: query = query.where(columns["play_count"] <= streams_max)
+    if minutes_min is not None: query = query.where(columns["total_minutes"] >= minutes_min)
+    if minutes_max is not None: query = query.where(columns["total_minutes"] <= minutes_max)
+    if engagement_min is not None: query = query.where(columns["engagement"] >= engagement_min / 100)
+    if engagement_max is not None: query = query.where(columns["engagement"] <= engagement_max / 100)
+    if rating_min: query = query.where(columns["rating"] > rating_min)
+    if rating_max: query = query.where(columns["rating"] < rating_max)
+    return query, sort_col, columns["spotify_id"]
+
+def format_track_row(row) -> dict:
+    return {
+        "spotify_id": row.spotify_id,
+        "title": row.title,
+        "artist": row.artist,
+        "album": row.album,
+        "cover": row.cover,
+        "duration_ms": row.duration_ms,
+        "play_count": row.play_count,
+        "total_minutes": round(row.total_minutes),
+        "engagement": round(row.engagement * 100, 2),
+        "rating": round(row.rating, 2) or 0
+    }
+
+def order_tracks(query, sort_col, id_col, direction: str):
+    # Le spotify_id départage les égalités : ordre total, indispensable à la pagination par curseur
+    order_func = desc if direction == "desc" else asc
+    return query.order_by(order_func(sort_col), order_func(id_col))
+
 @router.get(
     "",
     summary="Récupérer les statistiques des musiques",
@@ -22,7 +115,7 @@ router = APIRouter()
 @cache(expire=300)
 async def get_all_musics(
     *,
-    db: Session = Depends(get_session),
+    db: AsyncSession = Depends(get_async_session),
     offset: int = 0,
     limit: int = 50,
     sort: str = "play_count",
@@ -50,69 +143,71 @@ async def get_all_musics(
 
     **Filtrage technique :**
     - Utilise des **JOINS** triples (Track -> Album -> Artist -> History) pour permettre un filtrage croisé (ex: toutes les musiques de tel artiste dans tel album).
-    - Les agrégations SQL sont effectuées avant le calcul du rating final en Python.
+    - Rating, filtres, tri et pagination (`ORDER BY ... LIMIT`) sont exécutés par Postgres.
+    - **Classement précalculé** : Sans filtre de dates, les morceaux sont lus dans le classement global
+      maintenu en tâche de fond (track_leaderboard) ; avec un filtre de dates, agrégation à la volée.
+    - Pour parcourir de grandes listes, préférer `/page` (pagination par curseur).
     """
-    play_count = func.count(TrackHistory.id).label("play_count")
-    total_minutes = (cast(func.sum(TrackHistory.ms_played), Float) / 60000).label("total_minutes")
-    sum_played = func.sum(TrackHistory.ms_played)
-    sum_duration = func.sum(Track.duration_ms)
-    engagement_sql = (cast(sum_played, Float) / func.nullif(cast(sum_duration, Float), 0)).label("engagement")
-
-    query = (select(
-            Track,
-            Artist.name.label("artist"),
-            Album.name.label("album"),
-            Album.image_url.label("cover"),
-            play_count,
-            total_minutes,
-            engagement_sql
-        )
-        .join(Album, Track.album_id == Album.spotify_id)
-        .join(Artist, Track.artist_id == Artist.spotify_id)
-        .join(TrackHistory, Track.spotify_id == TrackHistory.spotify_id)
+    query, sort_col, id_col = build_tracks_query(
+        track, artist, album, streams_min, streams_max, minutes_min, minutes_max,
+        rating_min, rating_max, engagement_min, engagement_max, date_min, date_max, sort,
+        snapshot=await db.run_sync(leaderboards_ready)
     )
-    if track: query = query.where(Track.title.ilike(f"%{track}%"))
-    if artist: query = query.where(Artist.name.ilike(f"%{artist}%"))
-    if album: query = query.where(Album.name.ilike(f"%{album}%"))
-    if date_min: query = query.where(cast(TrackHistory.played_at, Date) >= date_min)
-    if date_max: query = query.where(cast(TrackHistory.played_at, Date) <= f"{date_max} 23:59:59")
-    query = query.group_by(
-        Track.spotify_id,
-        Artist.name,
-        Album.name,
-        Album.image_url
+    results = (await db.execute(order_tracks(query, sort_col, id_col, direction).offset(offset).limit(limit))).all()
+    return [format_track_row(row) for row in results]
+
+@router.get(
+    "/page",
+    summary="Parcourir les statistiques des musiques par curseur",
+    response_model=TrackStatsPageResponse,
+    responses={
+        200: {"description": "Page de morceaux et curseur de la page suivante"},
+        400: {"model": DetailMessage, "description": "Curseur ou paramètres de filtrage invalides"}
+    }
+)
+@cache(expire=300)
+async def get_musics_page(
+    *,
+    db: AsyncSession = Depends(get_async_session),
+    cursor: Optional[str] = None,
+    limit: int = 50,
+    sort: str = "play_count",
+    direction: str = "desc",
+    track: Optional[str] = None,
+    artist: Optional[str] = None,
+    album: Optional[str] = None,
+    streams_min: Optional[int] = None,
+    streams_max: Optional[int] = None,
+    minutes_min: Optional[float] = None,
+    minutes_max: Optional[float] = None,
+    rating_min: Optional[float] = None,
+    rating_max: Optional[float] = None,
+    engagement_min: Optional[float] = None,
+    engagement_max: Optional[float] = None,
+    date_min: Optional[str] = None,
+    date_max: Optional[str] = None,
+):
+    """
+    Même classement que la liste des morceaux, paginé par curseur `(valeur de tri, spotify_id)`.
+
+    Le premier appel se fait sans `cursor` ; chaque réponse fournit `next_cursor` à renvoyer
+    (avec les mêmes filtres et le même tri) pour obtenir la page suivante.
+    """
+    query, sort_col, id_col = build_tracks_query(
+        track, artist, album, streams_min, streams_max, minutes_min, minutes_max,
+        rating_min, rating_max, engagement_min, engagement_max, date_min, date_max, sort,
+        snapshot=await db.run_sync(leaderboards_ready)
     )
-    if streams_min is not None: query = query.having(play_count >= streams_min)
-    if streams_max is not None: query = query.having(play_count <= streams_max)
-    if minutes_min is not None: query = query.having(total_minutes >= minutes_min)
-    if minutes_max is not None: query = query.having(total_minutes <= minutes_max)
-    if engagement_min is not None: query = query.having(engagement_sql >= engagement_min / 100)
-    if engagement_max is not None: query = query.having(engagement_sql <= engagement_max / 100)
-    results = db.exec(query).all()
-
-    all_musics = []
-    for row in results:
-        track_obj, artist_name, album_name, cover_url, count, mins, eng = row
-        eng = min(eng or 0.0, 1.0)
-        rating = (eng * mins / (20.0 * count) + mins / 40.0) / 8.0
-        if rating_min and rating <= rating_min: continue
-        if rating_max and rating >= rating_max: continue
-
-        all_musics.append({
-            "spotify_id": track_obj.spotify_id,
-            "title": track_obj.title,
-            "artist": artist_name,
-            "album": album_name,
-            "cover": cover_url,        
-            "duration_ms": track_obj.duration_ms,
-            "play_count": count,
-            "total_minutes": round(mins),
-            "engagement": round(eng * 100, 2),
-            "rating": round(rating,2) or 0
-        })
-    if sort in ["name", "play_count", "total_minutes", "engagement", "rating"]:
-        all_musics.sort(key=lambda x: x["title" if sort == "name" else sort], reverse=(direction == "desc"))
-    return all_musics[offset : offset + limit]
+    if cursor: query = query.where(keyset_filter(sort_col, id_col, cursor, direction))
+    results = (await db.execute(order_tracks(query, sort_col, id_col, direction).limit(limit + 1))).all()
+
+    page = results[:limit]
+    next_cursor = None
+    if len(results) > limit:
+        last = page[-1]
+        value = last.sort_value if isinstance(last.sort_value, str) else float(last.sort_value)
+        next_cursor = encode_cursor(value, last.spotify_id)
+    return {"items": [format_track_row(row) for row in page], "next_cursor": next_cursor}
 
 @router.get(
     "/metadata",
@@ -126,7 +221,7 @@ async def get_all_musics(
     }
 )
 @cache(expire=300)
-async def get_musics_metadata(db: Session = Depends(get_session)):
+async def get_musics_metadata(db: AsyncSession = Depends(get_async_session)):
     """
     Analyse l'historique d'écoute pour extraire les valeurs plafonds de chaque morceau.
     
@@ -141,7 +236,7 @@ async def get_musics_metadata(db: Session = Depends(get_session)):
     """
     # 1. On récupère les stats de la track la plus écoutée pour calculer le rating max théorique
     # On ajoute la durée de la track (Track.duration_ms) pour l'engagement
-    stats = db.exec(
+    stats = (await db.execute(
         select(
             func.count(TrackHistory.id).label("max_streams"),
             func.sum(TrackHistory.ms_played).label("max_ms"),
@@ -151,9 +246,9 @@ async def get_musics_metadata(db: Session = Depends(get_session)):
         .group_by(TrackHistory.spotify_id)
         .order_by(text("max_streams DESC"))
         .limit(1)
-    ).first()
+    )).first()
 
-    date_min, date_max = get_date_metadata(db)
+    date_min, date_max = await db.run_sync(get_date_metadata)
     if not stats: return {"max_streams": 100, "max_minutes": 100, "max_rating": 10, "date_min": date_min, "date-max": date_max}
 
     count = stats[0]
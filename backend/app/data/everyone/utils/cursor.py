@@ -0,0 +1,23 @@
+import base64
+import json
+from fastapi import HTTPException
+from sqlalchemy import tuple_
+
+# Pagination par curseur (keyset) : le curseur encode la clé de tri (valeur, spotify_id) du dernier
+# élément de la page, la page suivante reprend strictement après elle. Le coût d'une page profonde
+# est ainsi celui de la première (pas d'OFFSET à parcourir).
+
+def encode_cursor(value, spotify_id: str) -> str:
+    return base64.urlsafe_b64encode(json.dumps([value, spotify_id]).encode()).decode()
+
+def decode_cursor(cursor: str):
+    try:
+        value, spotify_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return value, str(spotify_id)
+    except (ValueError, TypeError): raise HTTPException(status_code=400, detail="Curseur de pagination invalide")
+
+def keyset_filter(sort_col, id_col, cursor: str, direction: str):
+    """Condition `(tri, id)` strictement après le curseur, dans le sens du tri."""
+    value, spotify_id = decode_cursor(cursor)
+    key = tuple_(sort_col, id_col)
+    return key < tuple_(value, spotify_id) if direction == "desc" else key > tuple_(value, spotify_id)
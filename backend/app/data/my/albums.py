@@ -1,13 +1,14 @@
-from app.database import get_session
-from app.models import TrackHistory, Track, Artist, Album
+from app.database import get_async_session
+from app.models import Artist, Album, UserTrackDaily
 from typing import Optional, List
 from fastapi import APIRouter, Depends
-from sqlalchemy import Date, Float, cast, func
-from sqlmodel import Session
+from sqlmodel.ext.asyncio.session import AsyncSession
 from app.response_message import AlbumStatsResponse, AlbumMetadataResponse
 from app.auth.utils.auth_utils import get_current_user_id
 from .utils.metadata import get_entity_stats, get_generic_metadata
 from app.utils.rating import get_formulas
+from app.utils.search import contains
+from app.utils.date_range import period_filters
 
 router = APIRouter()
 
@@ -15,7 +16,7 @@ router = APIRouter()
 async def get_user_albums(
     *,
     user_id: int = Depends(get_current_user_id),
-    db: Session = Depends(get_session),
+    db: AsyncSession = Depends(get_async_session),
     offset: int = 0,
     limit: int = 50,
     sort: str = "play_count",
@@ -42,25 +43,17 @@ async def get_user_albums(
     - **Tri Hiérarchique** : En cas d'égalité sur le critère principal, un tri secondaire (ex: minutes ou ID) est appliqué pour une pagination stable.
     - **Sécurité** : Filtrage automatique par `current_user_id` extrait de la session.
     """
-    # 1. Définition de la formule de rating spécifique Album
-    raw_ms = cast(func.sum(TrackHistory.ms_played), Float)
-    raw_dur = func.nullif(cast(func.sum(Track.duration_ms), Float), 0)
-    cnt = func.count(TrackHistory.id)
-
-    m = raw_ms / 60000.0
-    e = raw_ms / raw_dur
-    
-    # f_album = (e * m / (7.0 * func.nullif(cnt, 0)) + (e * m / 3200.0)) * 1.75 * e
-    f_album = (func.log(func.nullif(m, 0)) + func.log(func.nullif(cnt, 0))) * e / 3.75
+    # 1. Définition de la formule de rating spécifique Album (calculée sur l'agrégat quotidien)
+    _, f_album, _ = get_formulas()
     
     # 2. Clauses WHERE spécifiques
     search_filters = []
-    if artist: search_filters.append(Artist.name.ilike(f"%{artist}%"))
-    if album: search_filters.append(Album.name.ilike(f"%{album}%"))
-    if date_min: search_filters.append(cast(TrackHistory.played_at, Date) >= date_min)
+    if artist: search_filters.append(contains(Artist.name, artist))
+    if album: search_filters.append(contains(Album.name, album))
+    search_filters += period_filters(UserTrackDaily.day, date_min, date_max)
 
     # 3. Appel du moteur
-    results = get_entity_stats(db, user_id, Album, Album.spotify_id, f_album, locals(), search_filters)
+    results = await db.run_sync(get_entity_stats, user_id, Album, Album.spotify_id, f_album, locals(), search_filters)
 
     # 4. Formatage final
     return [{
@@ -75,7 +68,7 @@ async def get_user_albums(
     } for r in results]
 
 @router.get('/metadata', response_model=AlbumMetadataResponse)
-async def get_user_albums_metadata(db: Session = Depends(get_session),user_id: int = Depends(get_current_user_id)):
+async def get_user_albums_metadata(db: AsyncSession = Depends(get_async_session),user_id: int = Depends(get_current_user_id)):
     """
     Calcule les limites supérieures pour les filtres de recherche d'albums.
     
@@ -88,4 +81,4 @@ async def get_user_albums_metadata(db: Session = Depends(get_session),user_id: i
     Si l'utilisateur n'a aucune donnée, les dates sont fixées par défaut (1890-01-01 à [date du jour]) pour éviter les plantages du sélecteur de date.
     """
     _, f_album, _ = get_formulas()
-    return get_generic_metadata(db, user_id, Track.album_id, f_album)
\ No newline at end of file
+    return await db.run_sync(get_generic_metadata, user_id, UserTrackDaily.album_id, f_album)
\ No newline at end of file
@@ -1,13 +1,14 @@
 from fastapi import APIRouter, Depends
-from sqlalchemy import Float, cast
-from sqlmodel import Session, func
+from sqlmodel.ext.asyncio.session import AsyncSession
 from typing import Optional, List
-from app.database import get_session
-from app.models import Artist, Track, TrackHistory
+from app.database import get_async_session
+from app.models import Artist, UserTrackDaily
 from app.response_message import ArtistStatsResponse, ArtistMetadataResponse
 from app.auth.utils.auth_utils import get_current_user_id
 from .utils.metadata import get_entity_stats, get_generic_metadata
 from app.utils.rating import get_formulas
+from app.utils.search import contains
+from app.utils.date_range import period_filters
 
 router = APIRouter()
 
@@ -15,7 +16,7 @@ router = APIRouter()
 async def get_artists(
     *,
     user_id: int = Depends(get_current_user_id),
-    db: Session = Depends(get_session),
+    db: AsyncSession = Depends(get_async_session),
     offset: int = 0,
     limit: int = 50,
     sort: str = "play_count",
@@ -46,26 +47,18 @@ async def get_artists(
     - Filtrage par `user_id` obligatoire.
     - Pagination exécutée côté base de données (`offset`, `limit`).
     """
-    # 1. Définition de la formule de rating spécifique ARTISTE
-    raw_ms = cast(func.sum(TrackHistory.ms_played), Float)
-    raw_dur = func.nullif(cast(func.sum(Track.duration_ms), Float), 0)
-    cnt = func.count(TrackHistory.id)
-    
-    m = raw_ms / 60000.0
-    e = raw_ms / raw_dur
-    
-    f_artist = (func.log(func.nullif(m, 0)) + func.log(func.nullif(cnt, 0))) * e / 3.75
+    # 1. Définition de la formule de rating spécifique ARTISTE (calculée sur l'agrégat quotidien)
+    _, _, f_artist = get_formulas()
 
     # 2. Clauses WHERE (Filtre sur le nom de l'artiste et les dates)
     search_filters = []
-    if artist: search_filters.append(Artist.name.ilike(f"%{artist}%"))
-    if date_min: search_filters.append(TrackHistory.played_at >= date_min)
-    if date_max: search_filters.append(TrackHistory.played_at <= f"{date_max} 23:59:59")
+    if artist: search_filters.append(contains(Artist.name, artist))
+    search_filters += period_filters(UserTrackDaily.day, date_min, date_max)
 
     # 3. Appel du moteur générique
     # Ici, le base_model est Artist et on groupe par Artist.spotify_id
-    results = get_entity_stats(
-        db=db,
+    results = await db.run_sync(
+        get_entity_stats,
         user_id=user_id,
         base_model=Artist,
         group_col=Artist.spotify_id,
@@ -85,6 +78,6 @@ async def get_artists(
     } for r in results]
 
 @router.get('/metadata', response_model=ArtistMetadataResponse)
-async def get_artists_meta(db: Session = Depends(get_session), u_id: int = Depends(get_current_user_id)):
+async def get_artists_meta(db: AsyncSession = Depends(get_async_session), u_id: int = Depends(get_current_user_id)):
     _, _, f_artist = get_formulas()
-    return get_generic_metadata(db, u_id, Track.artist_id, f_artist)
\ No newline at end of file
+    return await db.run_sync(get_generic_metadata, u_id, UserTrackDaily.artist_id, f_artist)
\ No newline at end of file
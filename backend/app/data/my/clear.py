@@ -3,6 +3,10 @@ from sqlmodel import Session, delete
 from app.database import get_session
 from app.models import User, TrackHistory
 from app.auth.utils.auth_utils import get_current_user_id
+from app.utils.first_listen import clear_first_listens
+from app.utils.response_cache import bump_data_version
+from app.utils.rollup import clear_rollup
+from app.utils.user_summary import clear_user_summary
 
 router = APIRouter()
 
@@ -18,6 +22,10 @@ async def clear_user_data(db: Session = Depends(get_session),user_id: int = Depe
         # Supprimer l'historique d'écoute
         statement = delete(TrackHistory).where(TrackHistory.user_id == user_id)
         db.exec(statement)
+        clear_rollup(db, user_id)
+        clear_first_listens(db, user_id)
+        bump_data_version(db, user_id)
+        clear_user_summary(db, user_id)
 
         # Réinitialiser les champs du profil
         user.perms = {
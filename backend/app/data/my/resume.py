@@ -1,14 +1,16 @@
 from calendar import monthrange
 from typing import Optional
 from fastapi import APIRouter, Cookie, Depends, HTTPException
-from sqlalchemy import Integer, cast, func, desc, select
+from sqlalchemy import Integer, cast, func, desc
 from sqlalchemy.orm import Session
+from sqlmodel.ext.asyncio.session import AsyncSession
 from datetime import datetime, timedelta
 from app.auth.utils.auth_utils import get_current_user_id
-from app.database import get_session
-from app.models import Album, Artist, Track, TrackHistory
+from app.database import get_async_session
+from app.models import Album, Artist, Track, UserTrackDaily
 from app.response_message import ResumeDataResponse
 from app.utils.rating import get_formulas
+from app.utils.date_range import period_filters
 from app.profile.profile_data import get_user_simple_profile
 
 router = APIRouter()
@@ -19,16 +21,20 @@ async def get_resume_data(
     offset: int = 0,
     sort: str = "streams",
     user_id: int = Depends(get_current_user_id),
-    db: Session = Depends(get_session),
+    db: AsyncSession = Depends(get_async_session),
     session_id: Optional[str] = Cookie(None)
 ):
+    # Les requêtes du résumé s'exécutent sur la connexion asyncpg, sans bloquer la boucle d'événements
+    return await db.run_sync(build_resume, user_id, range, offset, sort, session_id)
+
+def build_resume(db: Session, user_id: int, range: str, offset: int, sort: str, session_id: Optional[str]):
     start_date, end_date = get_range_dates(range,offset)
     f_track, f_album, f_artist = get_formulas()
 
     # On définit quel critère utiliser pour le desc()
     sort_mapping = {
-        "streams": func.count(TrackHistory.id),
-        "minutes": func.sum(TrackHistory.ms_played)
+        "streams": func.sum(UserTrackDaily.streams),
+        "minutes": func.sum(UserTrackDaily.ms_played)
     }
     artist_sort = f_artist if sort == "rating" else sort_mapping.get(sort)
     album_sort = f_track if sort == "rating" else sort_mapping.get(sort)
@@ -88,10 +94,14 @@ def get_range_dates(range,offset):
     
     return start_date, end_date
 
+def day_range(start, end):
+    # Les périodes commencent toutes à minuit : on filtre directement sur les jours de l'agrégat, fin exclue
+    return period_filters(UserTrackDaily.day, start, end, end_inclusive=False)
+
 def get_top_entities(db, user_id, range, start, end, rating_f, sort_column, model, id_field, limit=5):
-    # 1. On détermine le nom de la clé étrangère dans TrackHistory
+    # 1. On détermine le nom de la clé étrangère dans l'agrégat quotidien
     fk_name = "spotify_id" if model == Track else f"{model.__name__.lower()}_id"
-    fk_column = getattr(TrackHistory, fk_name)
+    fk_column = getattr(UserTrackDaily, fk_name)
 
     img_column = model.image_url if hasattr(model, 'image_url') else Album.image_url
     name_column = model.name if hasattr(model, 'name') else Track.title
@@ -100,37 +110,36 @@ def get_top_entities(db, user_id, range, start, end, rating_f, sort_column, mode
         db.query(
             name_column.label("name"), 
             img_column.label("image"),
-            func.count(TrackHistory.id).label("streams"),
-            func.sum(cast(TrackHistory.ms_played / 60000, Integer)).label("minutes"),
+            func.sum(UserTrackDaily.streams).label("streams"),
+            cast(func.sum(UserTrackDaily.ms_played) / 60000, Integer).label("minutes"),
             rating_f.label("rating")
         )
     )
 
     # 3. JOINTURES
-    query = query.join(TrackHistory, id_field == fk_column)
+    query = query.join(UserTrackDaily, id_field == fk_column)
     if model == Track: query = query.join(Album, Album.spotify_id == Track.album_id)
-    else: query = query.join(Track, Track.spotify_id == TrackHistory.spotify_id)
 
     # 4. FILTRES
-    query = query.filter(TrackHistory.user_id == user_id)
-    if range != "lifetime" and start and end: query = query.filter(TrackHistory.played_at >= start, TrackHistory.played_at < end)
+    query = query.filter(UserTrackDaily.user_id == user_id)
+    if range != "lifetime" and start and end: query = query.filter(*day_range(start, end))
     return query.group_by(id_field, name_column, img_column).order_by(desc(sort_column)).limit(limit).all()
 
 def get_distinct_entities(db,user_id,range,start_date,end_date):
     stats_query = db.query(
-        func.count(func.distinct(TrackHistory.spotify_id)).label("nb_tracks"),
-        func.count(func.distinct(TrackHistory.album_id)).label("nb_albums"),
-        func.count(func.distinct(TrackHistory.artist_id)).label("nb_artists")
-    ).filter(TrackHistory.user_id == user_id)
+        func.count(func.distinct(UserTrackDaily.spotify_id)).label("nb_tracks"),
+        func.count(func.distinct(UserTrackDaily.album_id)).label("nb_albums"),
+        func.count(func.distinct(UserTrackDaily.artist_id)).label("nb_artists")
+    ).filter(UserTrackDaily.user_id == user_id)
     
-    if range != "lifetime": stats_query = stats_query.filter(TrackHistory.played_at >= start_date, TrackHistory.played_at < end_date)
+    if range != "lifetime": stats_query = stats_query.filter(*day_range(start_date, end_date))
     return stats_query.first()
 
 def get_global_stats(db,user_id,range,start_date,end_date):
     stats_query = db.query(
-        func.sum(TrackHistory.ms_played).label("total_ms"),
-        func.count(TrackHistory.id).label("total_streams")
-    ).filter(TrackHistory.user_id == user_id)
+        func.sum(UserTrackDaily.ms_played).label("total_ms"),
+        func.sum(UserTrackDaily.streams).label("total_streams")
+    ).filter(UserTrackDaily.user_id == user_id)
     
-    if range != "lifetime": stats_query = stats_query.filter(TrackHistory.played_at >= start_date, TrackHistory.played_at < end_date)
+    if range != "lifetime": stats_query = stats_query.filter(*day_range(start_date, end_date))
     return stats_query.first()
\ No newline at end of file
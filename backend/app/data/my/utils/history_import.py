@@ -0,0 +1,110 @@
+from typing import Iterable, Set, Tuple
+from sqlalchemy import text
+from sqlmodel import Session
+from app.utils.bulk_copy import copy_rows
+from app.utils.first_listen import record_first_listens
+from app.utils.history_parser import MIN_MS_PLAYED
+from app.utils.response_cache import bump_data_version
+from app.utils.rollup import refresh_rollup_days
+from app.utils.user_summary import add_hour_streams
+
+# Table temporaire (propre à la connexion) dans laquelle chaque lot d'import est déposé
+# avant d'être fusionné dans trackhistory par des requêtes ensemblistes.
+STAGING_DDL = """
+CREATE TEMP TABLE IF NOT EXISTS import_staging (
+    seq integer NOT NULL,
+    played_at_ms bigint NOT NULL,
+    -- L'horodatage arrive en millisecondes epoch (format compact du parseur) et est converti côté base
+    played_at timestamp GENERATED ALWAYS AS (timestamp '1970-01-01' + played_at_ms * interval '1 millisecond') STORED,
+    spotify_id varchar NOT NULL,
+    ms_played integer NOT NULL,
+    title varchar
+) ON COMMIT DELETE ROWS
+"""
+
+STAGING_COLUMNS = ("seq", "played_at_ms", "spotify_id", "ms_played", "title")
+
+def stage_history_rows(db: Session, rows: Iterable[Tuple]):
+    """Dépose des lignes `STAGING_COLUMNS` (cf. `ParsedHistory.rows`) dans la table de staging via COPY."""
+    db.execute(text(STAGING_DDL))
+    copy_rows(db, "import_staging", STAGING_COLUMNS, rows)
+
+def merge_staged_history(db: Session, user_id: int) -> Tuple[int, Set[str]]:
+    """
+    Fusionne le contenu de `import_staging` dans l'historique de l'utilisateur, entièrement côté Postgres.
+    Les partitions des années du lot sont créées au préalable (`ensure_history_partitions`, avant la transaction).
+
+    - Les doublons internes au lot sont éliminés : la première écoute valide (au moins MIN_MS_PLAYED) fait foi,
+      une écoute plus courte n'est retenue que si la même (date, piste) n'a aucune écoute valide dans le lot.
+    - Les écoutes plus courtes retenues suppriment l'entrée existante correspondante (ex: issue de l'API).
+    - Les écoutes existantes voient leur `ms_played` mis à jour (l'API enregistre 0).
+    - Les nouvelles écoutes sont insérées via `ON CONFLICT DO NOTHING` sur `(user_id, played_at, spotify_id)`.
+    - Les jours touchés sont recalculés dans l'agrégat `user_track_daily`, l'histogramme horaire
+      du résumé utilisateur reçoit les écoutes ajoutées / supprimées, la version des données
+      de l'utilisateur (cache du dashboard et du profil) est incrémentée.
+
+    Retourne le nombre d'écoutes ajoutées et les IDs des pistes créées (à enrichir par le worker).
+    """
+    params = {"user_id": user_id, "min_ms": MIN_MS_PLAYED}
+    # Une écoute trop courte s'efface devant une écoute valide de la même clé, sinon la première de sa catégorie reste
+    db.execute(text("""
+        DELETE FROM import_staging a USING import_staging b
+        WHERE a.played_at = b.played_at AND a.spotify_id = b.spotify_id AND a.seq <> b.seq
+          AND (a.ms_played < :min_ms AND b.ms_played >= :min_ms
+               OR (a.ms_played >= :min_ms) = (b.ms_played >= :min_ms) AND a.seq > b.seq)
+    """), params)
+    # Pistes inconnues, créées avec un titre temporaire
+    new_track_ids = set(db.execute(text("""
+        INSERT INTO track (spotify_id, title)
+        SELECT DISTINCT ON (spotify_id) spotify_id, COALESCE(title, 'Chargement...')
+        FROM import_staging
+        WHERE ms_played >= :min_ms
+        ORDER BY spotify_id, seq
+        ON CONFLICT (spotify_id) DO NOTHING
+        RETURNING spotify_id
+    """), params).scalars().all())
+
+    # Les écritures renvoient leur répartition horaire pour l'histogramme du résumé utilisateur
+    removed = db.execute(text("""
+        WITH deleted AS (
+            DELETE FROM trackhistory h USING import_staging s
+            WHERE h.user_id = :user_id AND h.played_at = s.played_at AND h.spotify_id = s.spotify_id
+              AND s.ms_played < :min_ms
+            RETURNING h.played_at
+        )
+        SELECT extract(hour FROM played_at)::int, count(*) FROM deleted GROUP BY 1
+    """), params).all()
+
+    db.execute(text("""
+        UPDATE trackhistory h SET ms_played = s.ms_played
+        FROM import_staging s
+        WHERE h.user_id = :user_id AND h.played_at = s.played_at AND h.spotify_id = s.spotify_id
+          AND s.ms_played >= :min_ms AND h.ms_played <> s.ms_played
+    """), params)
+
+    # Les liens artiste/album sont repris de la piste quand ses métadonnées sont déjà connues
+    inserted = db.execute(text("""
+        WITH inserted AS (
+            INSERT INTO trackhistory (user_id, played_at, spotify_id, ms_played, artist_id, album_id)
+            SELECT :user_id, s.played_at, s.spotify_id, s.ms_played, t.artist_id, t.album_id
+            FROM import_staging s
+            JOIN track t ON t.spotify_id = s.spotify_id
+            WHERE s.ms_played >= :min_ms
+            ON CONFLICT (user_id, played_at, spotify_id) DO NOTHING
+            RETURNING played_at
+        )
+        SELECT extract(hour FROM played_at)::int, count(*) FROM inserted GROUP BY 1
+    """), params).all()
+    added = sum(count for _, count in inserted)
+
+    deltas = dict(inserted)
+    for hour, count in removed: deltas[hour] = deltas.get(hour, 0) - count
+    add_hour_streams(db, user_id, deltas)
+
+    days = db.execute(text("SELECT DISTINCT played_at::date FROM import_staging")).scalars().all()
+    refresh_rollup_days(db, user_id, days)
+    record_first_listens(db, user_id, days)
+    bump_data_version(db, user_id)
+
+    db.execute(text("TRUNCATE import_staging"))
+    return added, new_track_ids
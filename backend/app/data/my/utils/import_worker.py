@@ -0,0 +1,247 @@
+import asyncio
+import os
+import socket
+import tempfile
+import uuid
+from datetime import datetime, timedelta
+from typing import List, Optional
+from sqlalchemy import func, or_, update
+from sqlmodel import Session, select
+from app.database import engine
+from app.models import ImportJob
+from app.spotify.utils.SpotifyWorker import spotify_worker
+from app.utils.history_parser import ParsedHistory, get_parser_pool, parse_history_file
+from app.utils.partitions import ensure_history_partitions
+from app.utils.progress_manager import set_progress
+from app.utils.response_cache import bump_data_version
+from app.utils.user_summary import refresh_user_summary
+from .history_import import merge_staged_history, stage_history_rows
+
+# Dossier où les fichiers uploadés sont déposés en attendant d'être traités
+SPOOL_DIR = os.getenv("IMPORT_SPOOL_DIR", os.path.join(tempfile.gettempdir(), "mystats_imports"))
+BATCH_SIZE = 5000
+# Nombre de fichiers parsés en avance par le pool pendant la fusion du fichier courant
+PARSE_AHEAD = max(2, os.cpu_count() or 1)
+# Bail d'un job "running" : renouvelé toutes les LEASE_RENEW_INTERVAL s par son processus,
+# le job peut être repris par un autre processus une fois le bail expiré
+LEASE_DURATION = timedelta(seconds=120)
+LEASE_RENEW_INTERVAL = 30
+POLL_INTERVAL = 30
+# Moteur de normalisation des fichiers : "python" (boucle par entrée) ou "numpy" (colonnes vectorisées)
+IMPORT_ENGINE = os.getenv("IMPORT_ENGINE", "python")
+
+def get_file_parser():
+    if IMPORT_ENGINE == "numpy":
+        from app.utils.history_vectorized import parse_history_file_vectorized
+        return parse_history_file_vectorized
+    return parse_history_file
+
+def job_progress(job: ImportJob) -> int:
+    if job.status in ("done", "failed"): return 100
+    if not job.total_bytes: return 0
+    return min(99, int(job.processed_bytes * 100 / job.total_bytes))
+
+def job_to_response(job: ImportJob, message: Optional[str] = None) -> dict:
+    return {
+        "id": job.id,
+        "status": job.status,
+        "progress": job_progress(job),
+        "entries": job.entries,
+        "added": job.added,
+        "error": job.error,
+        "message": message,
+        "created_at": job.created_at,
+        "updated_at": job.updated_at
+    }
+
+class LeaseLost(Exception):
+    """Le job a été repris par un autre processus (bail expiré) : ce processus abandonne son lot."""
+
+class ImportWorker:
+    """
+    Consomme les `ImportJob` en attente, lot par lot.
+    Plusieurs processus peuvent tourner en parallèle : un job n'est traité que par celui
+    qui a réussi à le réclamer (UPDATE conditionnel sur son statut). Le propriétaire renouvelle
+    son bail pendant le traitement et chaque point de reprise vérifie qu'il le détient toujours.
+    """
+    _instance = None
+
+    def __new__(cls):
+        if cls._instance is None:
+            cls._instance = super(ImportWorker, cls).__new__(cls)
+            cls._instance.task = None
+            cls._instance._wakeup = None
+            cls._instance.worker_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        return cls._instance
+
+    def start(self):
+        if self.task is None or self.task.done():
+            self._wakeup = asyncio.Event()
+            self.task = asyncio.create_task(self._run())
+
+    def notify(self):
+        if self._wakeup is not None: self._wakeup.set()
+
+    async def _run(self):
+        while True:
+            try:
+                job_id = await asyncio.to_thread(self._claim_next_job)
+                if job_id:
+                    await self._process_job(job_id)
+                    continue
+            except Exception as e: print(f"❌ Erreur Worker d'import inattendue: {e}")
+            self._wakeup.clear()
+            try: await asyncio.wait_for(self._wakeup.wait(), timeout=POLL_INTERVAL)
+            except asyncio.TimeoutError: pass
+
+    def _claim_next_job(self) -> Optional[str]:
+        with Session(engine) as db:
+            now = datetime.utcnow()
+            # Jobs d'avant les baux : abandonnés si leur point de reprise n'a pas bougé depuis LEASE_DURATION
+            lease_end = func.coalesce(ImportJob.lease_until, ImportJob.updated_at + LEASE_DURATION)
+            claimable = or_(
+                ImportJob.status == "pending",
+                (ImportJob.status == "running") & (lease_end < now)
+            )
+            for job_id in db.exec(select(ImportJob.id).where(claimable).order_by(ImportJob.created_at)).all():
+                claimed = db.exec(
+                    update(ImportJob)
+                    .where(ImportJob.id == job_id, claimable)
+                    .values(status="running", worker_id=self.worker_id, lease_until=now + LEASE_DURATION, updated_at=now)
+                ).rowcount
+                db.commit()
+                if claimed: return job_id
+        return None
+
+    def _renew_lease(self, job_id: str) -> bool:
+        with Session(engine) as db:
+            renewed = db.exec(
+                update(ImportJob)
+                .where(ImportJob.id == job_id, ImportJob.worker_id == self.worker_id, ImportJob.status == "running")
+                .values(lease_until=datetime.utcnow() + LEASE_DURATION)
+            ).rowcount
+            db.commit()
+        return bool(renewed)
+
+    async def _heartbeat(self, job_id: str):
+        while True:
+            await asyncio.sleep(LEASE_RENEW_INTERVAL)
+            try:
+                if not await asyncio.to_thread(self._renew_lease, job_id): return
+            except Exception as e: print(f"⚠️ Renouvellement du bail de l'import {job_id} impossible : {e}")
+
+    def _checkpoint(self, db: Session, job: ImportJob, **values):
+        """
+        Met à jour le job dans la transaction courante (celle du lot) si ce processus en détient toujours
+        le bail ; sinon le lot est annulé par l'appelant (LeaseLost).
+        """
+        now = datetime.utcnow()
+        values.update(updated_at=now, lease_until=now + LEASE_DURATION)
+        updated = db.exec(
+            update(ImportJob)
+            .where(ImportJob.id == job.id, ImportJob.worker_id == self.worker_id)
+            .values(**values)
+        ).rowcount
+        if not updated: raise LeaseLost(job.id)
+        for name, value in values.items(): setattr(job, name, value)
+
+    async def _process_job(self, job_id: str):
+        heartbeat = asyncio.create_task(self._heartbeat(job_id))
+        with Session(engine) as db:
+            job = db.get(ImportJob, job_id)
+            # Copie locale : toutes les écritures du job passent par `_checkpoint` (conditionnées au bail)
+            db.expunge(job)
+            print(f"📥 Import {job.id} : reprise au fichier {job.file_index}, ligne {job.entry_index}")
+            try:
+                # Le parsing (JSON, dates, URIs) est réparti sur le pool de processus, un fichier par tâche,
+                # avec au plus PARSE_AHEAD fichiers d'avance ; la fusion en base s'exécute dans un thread.
+                loop = asyncio.get_running_loop()
+                pending_files = list(range(job.file_index, len(job.files)))
+                parsing = {}
+                parser = get_file_parser()
+                def schedule():
+                    while pending_files and len(parsing) < PARSE_AHEAD:
+                        index = pending_files.pop(0)
+                        parsing[index] = loop.run_in_executor(get_parser_pool(), parser, job.files[index])
+                schedule()
+
+                done_bytes = sum(file_size(p) for p in job.files[:job.file_index])
+                for file_index in range(job.file_index, len(job.files)):
+                    parsed = await parsing.pop(file_index)
+                    schedule()
+                    if parsed.error: print(f"⚠️ Fichier {job.files[file_index]} tronqué après {len(parsed)} lignes : {parsed.error}")
+                    size = file_size(job.files[file_index])
+
+                    for start in range(job.entry_index, len(parsed), BATCH_SIZE):
+                        stop = min(start + BATCH_SIZE, len(parsed))
+                        await self._commit_batch(db, job, parsed, start, stop, file_index, done_bytes + size * stop // len(parsed))
+                    # Fichier terminé : le point de reprise passe au suivant
+                    done_bytes += size
+                    await self._commit_batch(db, job, parsed, 0, 0, file_index + 1, done_bytes, file_entries=parsed.entries)
+
+                await asyncio.to_thread(self._finish_job, db, job)
+                print(f"✅ Import {job.id} terminé : {job.added} écoutes ajoutées sur {job.entries} entrées")
+                if job.added: await spotify_worker.should_repair_history()
+                remove_spooled_files(job.files)
+            except LeaseLost:
+                # Un autre processus a repris le job (et ses fichiers) : on s'arrête sans y toucher
+                db.rollback()
+                print(f"⚠️ Import {job.id} repris par un autre processus, abandon du lot en cours")
+            except Exception as e:
+                db.rollback()
+                try:
+                    self._checkpoint(db, job, status="failed", error=str(e))
+                    db.commit()
+                    # Un job en échec n'est pas repris : ses fichiers en attente sont supprimés
+                    remove_spooled_files(job.files)
+                except LeaseLost: db.rollback()
+                print(f"❌ Import {job.id} en échec : {e}")
+            finally:
+                heartbeat.cancel()
+                set_progress(job.user_id, 100)
+
+    def _finish_job(self, db: Session, job: ImportJob):
+        self._checkpoint(db, job, status="done")
+        refresh_user_summary(db, job.user_id)
+        bump_data_version(db, job.user_id)
+        db.commit()
+
+    async def _commit_batch(self, db: Session, job: ImportJob, parsed: ParsedHistory, start: int, stop: int, file_index: int, processed_bytes: int, file_entries: int = 0):
+        """
+        Insère les lignes `[start, stop)` d'un fichier parsé et avance le point de reprise du job
+        dans la même transaction (`entry_index` = prochaine ligne à traiter).
+        `file_entries` (entrées du fichier, valides ou non) est compté au point de reprise de fin de fichier.
+        COPY, fusion et agrégats sont synchrones : exécutés hors de la boucle d'événements.
+        """
+        await asyncio.to_thread(self._write_batch, db, job, parsed, start, stop, file_index, processed_bytes, file_entries)
+        set_progress(job.user_id, job_progress(job))
+
+    def _write_batch(self, db: Session, job: ImportJob, parsed: ParsedHistory, start: int, stop: int, file_index: int, processed_bytes: int, file_entries: int):
+        added, new_track_ids = 0, set()
+        if stop > start:
+            # Partitions manquantes : transaction courte, avant celle du lot
+            ensure_history_partitions(db, parsed.years(start, stop))
+            stage_history_rows(db, parsed.rows(start, stop))
+            added, new_track_ids = merge_staged_history(db, job.user_id)
+        # Pistes créées à enrichir : mises en file dans la même transaction que le lot
+        spotify_worker.add_tracks(db, new_track_ids)
+        self._checkpoint(
+            db, job, added=job.added + added, entries=job.entries + file_entries,
+            file_index=file_index, entry_index=stop, processed_bytes=processed_bytes
+        )
+        db.commit()
+
+def file_size(path: str) -> int:
+    try: return os.path.getsize(path)
+    except OSError: return 0
+
+def spool_path(job_id: str, index: int) -> str:
+    os.makedirs(SPOOL_DIR, exist_ok=True)
+    return os.path.join(SPOOL_DIR, f"{job_id}_{index}.json")
+
+def remove_spooled_files(paths: List[str]):
+    for path in paths:
+        try: os.remove(path)
+        except OSError: pass
+
+import_worker = ImportWorker()
@@ -1,21 +1,20 @@
 import datetime
 from fastapi import Depends
 from sqlalchemy import Float, Numeric, asc, case, cast, desc, func, select
+from sqlalchemy.orm import selectinload
 from sqlmodel import Session
 from app.database import get_session
-from app.models import Album, Artist, Track, TrackHistory
+from app.models import Album, Artist, Track, UserTrackDaily
 
 def get_generic_metadata(db: Session, user_id: int, group_col, rating_expression):
     """
     Calcule les métadonnées max (streams, minutes, rating) et les bornes temporelles
-    en fonction de la colonne de regroupement fournie.
+    en fonction de la colonne de regroupement fournie (colonne de UserTrackDaily).
     """
-    # Mesures de base communes
-    raw_ms = cast(func.sum(TrackHistory.ms_played), Float)
-    raw_duration = func.nullif(cast(func.sum(Track.duration_ms), Float), 0)
-    cnt = func.count(TrackHistory.id)
+    # Mesures de base communes, lues dans l'agrégat quotidien
+    raw_ms = cast(func.sum(UserTrackDaily.ms_played), Float)
+    cnt = func.sum(UserTrackDaily.streams)
     mins_calc = raw_ms / 60000.0
-    eng_calc = raw_ms / raw_duration
 
     # Sous-requête
     stats_subq = (
@@ -23,11 +22,10 @@ def get_generic_metadata(db: Session, user_id: int, group_col, rating_expression
             cnt.label("c"),
             mins_calc.label("m"),
             rating_expression.label("r"),
-            func.min(func.min(func.date(TrackHistory.played_at))).over().label("d_min"),
-            func.max(func.max(func.date(TrackHistory.played_at))).over().label("d_max")
+            func.min(func.min(UserTrackDaily.day)).over().label("d_min"),
+            func.max(func.max(UserTrackDaily.day)).over().label("d_max")
         )
-        .join(Track, Track.spotify_id == TrackHistory.spotify_id)
-        .where(TrackHistory.user_id == user_id)
+        .where(UserTrackDaily.user_id == user_id)
         .group_by(group_col)
     ).subquery()
 
@@ -47,39 +45,45 @@ def get_generic_metadata(db: Session, user_id: int, group_col, rating_expression
     return {
         "max_streams": max_c or 0,
         "max_minutes": round(max_m or 0),
-        "max_rating": round((max_r or 0) + 0.05, 2),
+        "max_rating": round(float(max_r or 0) + 0.05, 2),
         "date_min": str(d_min) if d_min else "1890-01-01",
         "date_max": str(d_max) if d_max else "2026-12-31"
     }
 
 def get_entity_stats(db, user_id, base_model, group_col, rating_formula, filters, search_filters):
-    raw_ms = cast(func.sum(TrackHistory.ms_played), Float)
-    raw_duration = func.nullif(cast(func.sum(Track.duration_ms), Float), 0)
+    raw_ms = cast(func.sum(UserTrackDaily.ms_played), Float)
+    raw_duration = func.nullif(cast(func.sum(UserTrackDaily.potential_ms), Float), 0)
     
     # On définit les expressions avec leurs labels
-    cnt_expr = func.count(TrackHistory.id).label("play_count")
+    cnt_expr = func.sum(UserTrackDaily.streams).label("play_count")
     mins_expr = func.round(cast(raw_ms / 60000.0, Numeric)).label("total_minutes")
     eng_expr = func.round(cast((raw_ms / raw_duration) * 100, Numeric), 2).label("engagement")
     
     rating_expr = case(
-        (func.count(TrackHistory.id) > 5, func.round(cast(rating_formula, Numeric), 2)), 
+        (func.sum(UserTrackDaily.streams) > 5, func.round(cast(rating_formula, Numeric), 2)), 
         else_=0.0
     ).label("rating")
 
     query = select(base_model, cnt_expr, mins_expr, eng_expr, rating_expr)
-    # 2. On gère les jointures selon le modèle
-    if base_model == Track: query = query.join(TrackHistory, TrackHistory.spotify_id == Track.spotify_id)
+    # 2. On gère les jointures selon le modèle (l'agrégat porte déjà artist_id / album_id)
+    # Les jointures externes servent aux filtres de recherche sur les noms d'artiste / album
+    if base_model == Track:
+        query = query.join(UserTrackDaily, UserTrackDaily.spotify_id == Track.spotify_id)
+        query = query.outerjoin(Album, Album.spotify_id == Track.album_id)
+        query = query.outerjoin(Artist, Artist.spotify_id == Track.artist_id)
+        # Relations chargées avec la page : la réponse est formatée hors de la session (AsyncSession)
+        query = query.options(selectinload(Track.artist), selectinload(Track.album))
         
     elif base_model == Album:
-        query = query.join(Track, Track.album_id == Album.spotify_id)
-        query = query.join(TrackHistory, TrackHistory.spotify_id == Track.spotify_id)
+        query = query.join(UserTrackDaily, UserTrackDaily.album_id == Album.spotify_id)
+        query = query.outerjoin(Artist, Artist.spotify_id == Album.artist_id)
+        query = query.options(selectinload(Album.artist))
         
     elif base_model == Artist:
-        query = query.join(Track, Track.artist_id == Artist.spotify_id)
-        query = query.join(TrackHistory, TrackHistory.spotify_id == Track.spotify_id)
+        query = query.join(UserTrackDaily, UserTrackDaily.artist_id == Artist.spotify_id)
 
     # 3. On applique le filtre de sécurité
-    query = query.where(TrackHistory.user_id == user_id)
+    query = query.where(UserTrackDaily.user_id == user_id)
 
     # Application des filtres de recherche (title, artist, dates)
     for f in search_filters: query = query.where(f)
@@ -105,14 +109,14 @@ def get_entity_stats(db, user_id, base_model, group_col, rating_formula, filters
     return db.exec(query.offset(filters['offset']).limit(filters['limit'])).all()
 
 def get_date_metadata(db: Session = Depends(get_session), current_user_id: str = ""):
-    # Bornes temporelles basées sur l'HISTORIQUE d'écoute (played_at)
-    # On récupère le tout premier et le tout dernier stream de l'utilisateur
+    # Bornes temporelles basées sur l'HISTORIQUE d'écoute (jours de l'agrégat quotidien)
+    # On récupère le premier et le dernier jour d'écoute de l'utilisateur
     history_dates = db.exec(
         select(
-            func.min(TrackHistory.played_at).label("first_listen"),
-            func.max(TrackHistory.played_at).label("last_listen")
+            func.min(UserTrackDaily.day).label("first_listen"),
+            func.max(UserTrackDaily.day).label("last_listen")
         )
-        .where(TrackHistory.user_id == current_user_id)
+        .where(UserTrackDaily.user_id == current_user_id)
     ).first()
 
     if not history_dates: return {"date_min": "1890-01-01", "date-max": datetime.datetime.now().strftime("%Y-%m-%d")}
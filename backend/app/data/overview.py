@@ -4,7 +4,7 @@ from sqlmodel import Session
 from app.database import get_session
 from app.models import User, TrackHistory, Track, Album, Artist
 from app.response_message import GlobalStatsResponse
-from fastapi_cache.decorator import cache
+from app.utils.cache_backend import cache
 
 router = APIRouter()
 
@@ -0,0 +1,41 @@
+from typing import List
+from fastapi import APIRouter, Depends, HTTPException, Query
+from sqlmodel.ext.asyncio.session import AsyncSession
+from app.database import get_async_session
+from app.response_message import DetailMessage, SearchResultResponse
+from app.utils.search import SEARCH_TYPES, search_catalog
+from app.utils.cache_backend import cache
+
+router = APIRouter()
+
+@router.get(
+    "",
+    summary="Autocomplétion sur les pistes, albums et artistes",
+    response_model=List[SearchResultResponse],
+    responses={
+        200: {"description": "Entités dont le nom commence par / ressemble au terme, les plus pertinentes d'abord"},
+        400: {"model": DetailMessage, "description": "Type d'entité inconnu"}
+    }
+)
+@cache(expire=300)
+async def search(
+    q: str = Query(..., min_length=1, max_length=100),
+    types: str = "track,album,artist",
+    limit: int = Query(10, ge=1, le=50),
+    db: AsyncSession = Depends(get_async_session)
+):
+    """
+    Recherche les entités du catalogue dont le nom correspond au terme saisi.
+
+    **Classement :**
+    - Les noms qui **commencent** par le terme passent en premier.
+    - Viennent ensuite les noms qui le **contiennent** ou lui **ressemblent** (similarité trigramme,
+      tolérante aux fautes de frappe), du plus proche au plus éloigné.
+
+    **Performance :** Servie par les index GIN `pg_trgm` sur track.title, album.name et artist.name
+    (sans l'extension, la recherche se limite aux noms contenant le terme).
+    """
+    kinds = [t.strip() for t in types.split(",") if t.strip()]
+    unknown = [t for t in kinds if t not in SEARCH_TYPES]
+    if unknown or not kinds: raise HTTPException(status_code=400, detail=f"Types de recherche inconnus : {', '.join(unknown) or types}")
+    return await db.run_sync(search_catalog, q, kinds, limit)
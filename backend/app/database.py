@@ -1,19 +1,115 @@
 from dotenv import load_dotenv
-from sqlmodel import SQLModel, Session, create_engine
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import create_async_engine
+from sqlmodel import SQLModel, Session, create_engine, text
+from sqlmodel.ext.asyncio.session import AsyncSession
 import os
 
 # On importe les modèles pour que SQLModel sache qu'ils existent
 from app.models import User, Track, TrackHistory 
+from app.utils.enrichment_queue import ENRICHMENT_BACKFILL
+from app.utils.first_listen import FIRST_LISTEN_BACKFILL
+from app.utils.history_links import LINK_HISTORY_FUNCTION, UNLINKED_INDEX
+from app.utils.partitions import HISTORY_PARTITION_FUNCTION, maintain_history_partitions
+from app.utils.rollup import ROLLUP_BACKFILL
+from app.utils.search import TRIGRAM_EXTENSION, TRIGRAM_INDEXES
 
 load_dotenv()
 DATABASE_URL = os.getenv("DATABASE_URL")
 
-engine = create_engine(DATABASE_URL, echo=True, pool_recycle=300, pool_pre_ping=True)
+# Le log de chaque requête SQL est coûteux sur les imports massifs : désactivé par défaut
+SQL_ECHO = os.getenv("SQL_ECHO", "false").lower() == "true"
+
+engine = create_engine(DATABASE_URL, echo=SQL_ECHO, pool_recycle=300, pool_pre_ping=True)
+
+def to_async_url(url: str):
+    """Même base via le pilote asyncpg (sslmode, propre à libpq, devient ssl)."""
+    url = make_url(url).set(drivername="postgresql+asyncpg")
+    if "sslmode" in url.query:
+        query = dict(url.query)
+        query["ssl"] = query.pop("sslmode")
+        url = url.set(query=query)
+    return url
+
+# Moteur asynchrone des endpoints de lecture : les requêtes n'y bloquent pas la boucle d'événements
+async_engine = create_async_engine(
+    os.getenv("ASYNC_DATABASE_URL") or to_async_url(DATABASE_URL),
+    echo=SQL_ECHO, pool_recycle=300, pool_pre_ping=True,
+    pool_size=int(os.getenv("ASYNC_POOL_SIZE", 10)), max_overflow=int(os.getenv("ASYNC_POOL_OVERFLOW", 10))
+)
 
 def create_db_and_tables():
     # SQLModel regarde maintenant dans son registre et y trouve User, Track, etc.
     SQLModel.metadata.create_all(engine)
+    run_schema_upgrades()
+
+# create_all ne modifie pas les tables existantes : ces instructions idempotentes
+# mettent à niveau les bases créées avec une version antérieure des modèles.
+SCHEMA_UPGRADES = [
+    # Contrainte d'unicité de l'historique (on supprime d'abord les doublons éventuels, une seule fois)
+    """
+    DO $$ BEGIN
+        IF to_regclass('uq_trackhistory_user_played_track') IS NULL THEN
+            DELETE FROM trackhistory a USING trackhistory b
+            WHERE a.user_id = b.user_id AND a.played_at = b.played_at AND a.spotify_id = b.spotify_id AND a.id > b.id;
+            ALTER TABLE trackhistory ADD CONSTRAINT uq_trackhistory_user_played_track UNIQUE (user_id, played_at, spotify_id);
+        END IF;
+    END $$;
+    """,
+    # Bail des jobs d'import (processus propriétaire et échéance)
+    "ALTER TABLE importjob ADD COLUMN IF NOT EXISTS worker_id varchar, ADD COLUMN IF NOT EXISTS lease_until timestamp",
+    # Version des données affichées (clé du cache des réponses par utilisateur)
+    'ALTER TABLE "user" ADD COLUMN IF NOT EXISTS data_version integer NOT NULL DEFAULT 0',
+    # Agrégat quotidien user_track_daily, puis premières écoutes qui en sont déduites
+    ROLLUP_BACKFILL,
+    FIRST_LISTEN_BACKFILL,
+    # Classement des morceaux ajouté après ceux des albums / artistes : reconstruction complète au prochain passage
+    """
+    DO $$ BEGIN
+        IF NOT EXISTS (SELECT 1 FROM track_leaderboard) AND EXISTS (SELECT 1 FROM user_track_daily) THEN
+            DELETE FROM leaderboard_state;
+        END IF;
+    END $$;
+    """,
+    # Index de propagation des métadonnées vers l'agrégat et les résumés (bases créées avant son ajout)
+    "CREATE INDEX IF NOT EXISTS ix_user_track_daily_spotify_id ON user_track_daily (spotify_id)",
+    # Lectures par période : historique par utilisateur (index couvrant) et agrégat par jour
+    """
+    CREATE INDEX IF NOT EXISTS ix_trackhistory_user_played_covering
+    ON trackhistory (user_id, played_at) INCLUDE (ms_played, spotify_id, artist_id, album_id)
+    """,
+    "CREATE INDEX IF NOT EXISTS ix_user_track_daily_day ON user_track_daily (day)",
+    # Liens artiste / album des écoutes : index partiel des écoutes sans lien et fonction de réparation par piste
+    UNLINKED_INDEX,
+    LINK_HISTORY_FUNCTION,
+    # Recherche textuelle : extension pg_trgm (si disponible) et index GIN trigrammes des noms
+    TRIGRAM_EXTENSION,
+    TRIGRAM_INDEXES,
+    # Création à la demande des partitions annuelles de trackhistory
+    HISTORY_PARTITION_FUNCTION,
+    # File d'enrichissement persistante : reprise des entités jamais enrichies
+    ENRICHMENT_BACKFILL,
+    # Nombre de créneaux (jour, heure) estimé correctement : l'agrégation du dashboard reste en mémoire (hachage)
+    """
+    CREATE STATISTICS IF NOT EXISTS trackhistory_day_hour_stats (ndistinct)
+    ON (played_at::date), ((extract(hour FROM played_at + interval '1 hour'))::integer) FROM trackhistory
+    """,
+]
+
+def run_schema_upgrades():
+    with Session(engine) as session:
+        for statement in SCHEMA_UPGRADES: session.execute(text(statement))
+        maintain_history_partitions(session)
+        session.commit()
 
 def get_session():
     with Session(engine) as session:
+        yield session
+
+async def get_async_session():
+    """
+    Session asyncpg. Les helpers synchrones existants (et le chargement paresseux des relations)
+    s'utilisent via `await session.run_sync(fn, ...)`, exécutés sur la même connexion asynchrone.
+    """
+    async with AsyncSession(async_engine, expire_on_commit=False) as session:
         yield session
\ No newline at end of file
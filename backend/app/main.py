@@ -4,8 +4,7 @@ from fastapi.exceptions import RequestValidationError
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import JSONResponse
 from fastapi_cache import FastAPICache
-from fastapi_cache.backends.inmemory import InMemoryBackend
-from app.database import create_db_and_tables
+from app.database import async_engine, create_db_and_tables
 from app.auth import router as auth_router
 from app.data.my import router as my_data_router
 from app.data.everyone import router as all_data_router
@@ -14,12 +13,32 @@ from app.spotify import router as status_router
 from app.profile import router as profile_router
 from app.data import router as overview_router
 from app.utils.progress_manager import router as utils_router
+from app.utils.cache_backend import CACHE_ENABLED, cache_key_builder, create_cache_backend
+from app.data.my.utils.import_worker import import_worker
+from app.spotify.utils.auto_sync import auto_sync_worker
+from app.spotify.utils.SpotifyWorker import spotify_worker
+from app.utils.leaderboard import leaderboard_worker
+from app.utils.summary_worker import summary_worker
+from app.utils.history_parser import shutdown_parser_pool
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     create_db_and_tables()
-    FastAPICache.init(InMemoryBackend())
+    # Cache partagé (Redis) ou local selon CACHE_BACKEND_URL
+    FastAPICache.init(create_cache_backend(), key_builder=cache_key_builder, enable=CACHE_ENABLED)
+    # Reprend les imports en attente ou interrompus par un redémarrage
+    import_worker.start()
+    # Classements globaux albums / artistes précalculés en tâche de fond
+    leaderboard_worker.start()
+    # Résumés de profil périmés recalculés hors des requêtes
+    summary_worker.start()
+    # Enrichissement Spotify depuis la file persistante (un seul processus leader)
+    spotify_worker.start()
+    # Synchronisation périodique de l'historique récent des comptes liés
+    auto_sync_worker.start()
     yield
+    shutdown_parser_pool()
+    await async_engine.dispose()
 
 app = FastAPI(title="MyStats Spotify API",lifespan=lifespan)
 
@@ -1,5 +1,6 @@
-from datetime import datetime
+from datetime import date, datetime
 from typing import Optional, List, Dict
+from sqlalchemy import BigInteger, Computed, Float, Index, UniqueConstraint, text
 from sqlmodel import Field, Relationship, SQLModel, JSON, Column, Text
 
 class User(SQLModel, table=True):
@@ -34,6 +35,8 @@ class User(SQLModel, table=True):
     access_token: Optional[str] = Field(default=None)
     expires_at: Optional[datetime] = Field(default=None)
     last_spotify_sync: Optional[str] = Field(default=None)
+    # Incrémenté à chaque changement de ce qu'affichent le dashboard et le profil (cf. app.utils.response_cache)
+    data_version: int = Field(default=0, sa_column_kwargs={"server_default": "0"})
 
     history: List["TrackHistory"] = Relationship(
         back_populates="user", 
@@ -75,8 +78,23 @@ class Track(SQLModel, table=True):
     history: List["TrackHistory"] = Relationship(back_populates="track")
 
 class TrackHistory(SQLModel, table=True):
-    id: Optional[int] = Field(default=None, primary_key=True)
-    played_at: datetime = Field(index=True)
+    # Une écoute est identifiée par (utilisateur, horodatage, morceau) : sert de cible aux INSERT ... ON CONFLICT
+    __table_args__ = (
+        UniqueConstraint("user_id", "played_at", "spotify_id", name="uq_trackhistory_user_played_track"),
+        # Lectures par utilisateur et période (dashboard, historique récent) servies par le seul index
+        Index(
+            "ix_trackhistory_user_played_covering", "user_id", "played_at",
+            postgresql_include=["ms_played", "spotify_id", "artist_id", "album_id"]
+        ),
+        # Écoutes pas encore reliées à leur artiste / album, par piste (cf. app.utils.history_links)
+        Index("ix_trackhistory_unlinked", "spotify_id", postgresql_where=text("artist_id IS NULL OR album_id IS NULL")),
+        # Partitionnement par année d'écoute (partitions gérées par app.utils.partitions)
+        {"postgresql_partition_by": "RANGE (played_at)"},
+    )
+
+    # La clé de partitionnement doit faire partie de la clé primaire
+    id: Optional[int] = Field(default=None, primary_key=True, sa_column_kwargs={"autoincrement": True})
+    played_at: datetime = Field(index=True, primary_key=True)
     ms_played: int
     
     user_id: int = Field(foreign_key="user.id", ondelete="CASCADE")
@@ -87,4 +105,208 @@ class TrackHistory(SQLModel, table=True):
     user: User = Relationship(back_populates="history")
     track: Track = Relationship(back_populates="history")
     album: Optional["Album"] = Relationship(back_populates="history")
-    artist: Optional["Artist"] = Relationship(back_populates="history")
\ No newline at end of file
+    artist: Optional["Artist"] = Relationship(back_populates="history")
+
+class ImportJob(SQLModel, table=True):
+    """
+    Import d'historique JSON traité en arrière-plan.
+    Le point de reprise (`file_index`, `entry_index`) est validé dans la même transaction
+    que chaque lot inséré : un worker redémarré reprend exactement après le dernier lot commité.
+    """
+    id: str = Field(primary_key=True)
+    user_id: int = Field(foreign_key="user.id", ondelete="CASCADE", index=True)
+    status: str = Field(default="pending", index=True) # pending | running | done | failed
+    files: List[str] = Field(default=[], sa_column=Column(JSON))
+    # Bail du processus qui traite le job : renouvelé en continu, vérifié à chaque point de reprise
+    worker_id: Optional[str] = None
+    lease_until: Optional[datetime] = None
+
+    total_bytes: int = 0
+    processed_bytes: int = 0
+    file_index: int = 0
+    entry_index: int = 0
+    entries: int = 0
+    added: int = 0
+    error: Optional[str] = Field(default=None, sa_column=Column(Text))
+
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+    updated_at: datetime = Field(default_factory=datetime.utcnow)
+
+class EnrichmentItem(SQLModel, table=True):
+    """
+    File persistante d'enrichissement Spotify : une ligne par entité (ajouts idempotents), conservée
+    une fois traitée pour qu'un même ID ne soit demandé qu'une fois. Consommée par le seul worker
+    détenteur du verrou consultatif (cf. app.utils.enrichment_queue).
+    """
+    __tablename__ = "enrichment_queue"
+    __table_args__ = (
+        # Prochains éléments à réclamer : seules les lignes en attente sont indexées
+        Index("ix_enrichment_queue_pending", "entity_type", "created_at", postgresql_where=text("status = 'pending'")),
+    )
+
+    # "track" | "artist"
+    entity_type: str = Field(primary_key=True)
+    entity_id: str = Field(primary_key=True)
+    status: str = Field(default="pending") # pending | claimed | done | failed
+    attempts: int = 0
+    error: Optional[str] = Field(default=None, sa_column=Column(Text))
+
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+    updated_at: datetime = Field(default_factory=datetime.utcnow)
+
+class UserTrackDaily(SQLModel, table=True):
+    """
+    Agrégat quotidien de l'historique (une ligne par utilisateur, jour et morceau).
+    Toutes les statistiques (tops, totaux, ratings) sont calculées à partir de cette table
+    plutôt qu'en ré-agrégeant TrackHistory ; elle est maintenue par app.utils.rollup.
+    """
+    __tablename__ = "user_track_daily"
+
+    user_id: int = Field(foreign_key="user.id", ondelete="CASCADE", primary_key=True)
+    # Index seul sur le jour : filtres de période des classements tous utilisateurs confondus
+    day: date = Field(primary_key=True, index=True)
+    spotify_id: str = Field(foreign_key="track.spotify_id", primary_key=True, index=True)
+    artist_id: Optional[str] = Field(default=None, index=True)
+    album_id: Optional[str] = Field(default=None, index=True)
+
+    streams: int = 0
+    ms_played: int = 0
+    # Durée cumulée des morceaux écoutés (streams * duration_ms) : base du calcul d'engagement
+    potential_ms: int = 0
+
+class FirstListen(SQLModel, table=True):
+    """
+    Jour de première écoute de chaque morceau, album et artiste d'un utilisateur.
+    Courbes de découverte et "nouveautés de la période" : simple parcours d'index par jour.
+    Maintenue par app.utils.first_listen à partir de user_track_daily.
+    """
+    __tablename__ = "first_listen"
+    __table_args__ = (
+        Index("ix_first_listen_user_day", "user_id", "first_day", postgresql_include=["entity_type"]),
+    )
+
+    user_id: int = Field(foreign_key="user.id", ondelete="CASCADE", primary_key=True)
+    # "track" | "album" | "artist"
+    entity_type: str = Field(primary_key=True)
+    entity_id: str = Field(primary_key=True)
+    first_day: date
+
+class UserSummary(SQLModel, table=True):
+    """
+    Statistiques "vie entière" d'un utilisateur, lues telles quelles par la page de profil.
+    Maintenu par app.utils.user_summary : l'histogramme horaire est incrémenté à chaque écriture
+    dans l'historique, les totaux reçoivent les variations de user_track_daily (app.utils.rollup),
+    les tops et compteurs distincts sont recalculés en tâche de fond (app.utils.summary_worker).
+    """
+    __tablename__ = "user_summary"
+
+    user_id: int = Field(foreign_key="user.id", ondelete="CASCADE", primary_key=True)
+    total_ms: int = Field(default=0, sa_column=Column(BigInteger, nullable=False, default=0))
+    total_streams: int = 0
+    distinct_tracks: int = 0
+    distinct_albums: int = 0
+    distinct_artists: int = 0
+    # Nombre d'écoutes par heure de la journée (24 valeurs)
+    hour_streams: List[int] = Field(default=[0] * 24, sa_column=Column(JSON))
+    # {"tracks" | "albums" | "artists": {"rating" | "count": [{"id", "count", "minutes", "engagement", "rating"}, ...]}}
+    tops: Dict[str, Dict[str, List[dict]]] = Field(default={}, sa_column=Column(JSON))
+
+    # Les métadonnées (durées, liens artiste/album) ont changé depuis le dernier calcul des tops
+    stale: bool = False
+    updated_at: datetime = Field(default_factory=datetime.utcnow)
+
+# --- CLASSEMENTS GLOBAUX (snapshot maintenu par app.utils.leaderboard) ---
+# Les indicateurs dérivés sont des colonnes générées par Postgres à partir des agrégats,
+# indexées pour servir chaque tri directement (mêmes formules que les routes data/all).
+LEADERBOARD_MINUTES = "(ms_played::float8 / 60000)"
+LEADERBOARD_ENGAGEMENT = "LEAST(COALESCE(ms_played::float8 / NULLIF(potential_ms, 0), 0), 1)"
+ALBUM_RATING = (
+    "CASE WHEN {cnt} > 5 THEN ({eng} * {mins} / (7.0 * {cnt}) + {eng} * {mins} / 3200.0) * 1.75 * {eng} ELSE 0 END"
+)
+ARTIST_RATING = (
+    "CASE WHEN {cnt} > 1 THEN ({eng} / (7.0 * {cnt}) + COALESCE(ln(NULLIF({mins}, 0)), 0) / 25.0) * 4 + {cnt} * {eng} / 10000.0 ELSE 0 END"
+)
+
+class AlbumLeaderboard(SQLModel, table=True):
+    __tablename__ = "album_leaderboard"
+
+    spotify_id: str = Field(primary_key=True)
+    # Recopié depuis album / artist (vide tant que l'entité n'est pas encore enrichie)
+    name: Optional[str] = Field(default=None, index=True)
+    artist_name: Optional[str] = Field(default=None, index=True)
+    image_url: Optional[str] = None
+
+    play_count: int = Field(default=0, index=True)
+    ms_played: int = Field(default=0, sa_column=Column(BigInteger, nullable=False, default=0))
+    potential_ms: int = Field(default=0, sa_column=Column(BigInteger, nullable=False, default=0))
+    total_minutes: Optional[float] = Field(default=None, sa_column=Column(Float, Computed(LEADERBOARD_MINUTES), index=True))
+    engagement: Optional[float] = Field(default=None, sa_column=Column(Float, Computed(LEADERBOARD_ENGAGEMENT), index=True))
+    rating: Optional[float] = Field(default=None, sa_column=Column(Float, Computed(ALBUM_RATING.format(
+        cnt="play_count", eng=LEADERBOARD_ENGAGEMENT, mins=LEADERBOARD_MINUTES
+    )), index=True))
+
+class ArtistLeaderboard(SQLModel, table=True):
+    __tablename__ = "artist_leaderboard"
+
+    spotify_id: str = Field(primary_key=True)
+    # Recopié depuis album / artist (vide tant que l'entité n'est pas encore enrichie)
+    name: Optional[str] = Field(default=None, index=True)
+    image_url: Optional[str] = None
+
+    play_count: int = Field(default=0, index=True)
+    ms_played: int = Field(default=0, sa_column=Column(BigInteger, nullable=False, default=0))
+    potential_ms: int = Field(default=0, sa_column=Column(BigInteger, nullable=False, default=0))
+    total_minutes: Optional[float] = Field(default=None, sa_column=Column(Float, Computed(LEADERBOARD_MINUTES), index=True))
+    engagement: Optional[float] = Field(default=None, sa_column=Column(Float, Computed(LEADERBOARD_ENGAGEMENT), index=True))
+    rating: Optional[float] = Field(default=None, sa_column=Column(Float, Computed(ARTIST_RATING.format(
+        cnt="play_count", eng=LEADERBOARD_ENGAGEMENT, mins=LEADERBOARD_MINUTES
+    )), index=True))
+
+# Même formule que le classement des morceaux calculé à la volée (app.data.everyone.tracks)
+TRACK_RATING = "CASE WHEN {cnt} > 0 THEN ({eng} * {mins} / (20.0 * {cnt}) + {mins} / 40.0) / 8.0 ELSE 0 END"
+# Tris servis par le snapshot des morceaux : index (valeur de tri, spotify_id) pour la pagination par curseur
+TRACK_LEADERBOARD_SORTS = ("title", "play_count", "total_minutes", "engagement", "rating")
+
+class TrackLeaderboard(SQLModel, table=True):
+    __tablename__ = "track_leaderboard"
+    __table_args__ = tuple(
+        Index(f"ix_track_leaderboard_{column}_id", column, "spotify_id") for column in TRACK_LEADERBOARD_SORTS
+    )
+
+    spotify_id: str = Field(primary_key=True)
+    # Recopié depuis track / album / artist (vide tant que la piste n'est pas encore enrichie)
+    title: Optional[str] = None
+    artist_name: Optional[str] = None
+    album_name: Optional[str] = None
+    image_url: Optional[str] = None
+    duration_ms: Optional[int] = None
+
+    play_count: int = 0
+    ms_played: int = Field(default=0, sa_column=Column(BigInteger, nullable=False, default=0))
+    potential_ms: int = Field(default=0, sa_column=Column(BigInteger, nullable=False, default=0))
+    total_minutes: Optional[float] = Field(default=None, sa_column=Column(Float, Computed(LEADERBOARD_MINUTES)))
+    engagement: Optional[float] = Field(default=None, sa_column=Column(Float, Computed(LEADERBOARD_ENGAGEMENT)))
+    rating: Optional[float] = Field(default=None, sa_column=Column(Float, Computed(TRACK_RATING.format(
+        cnt="play_count", eng=LEADERBOARD_ENGAGEMENT, mins=LEADERBOARD_MINUTES
+    ))))
+
+class LeaderboardDelta(SQLModel, table=True):
+    """
+    Journal des variations de l'agrégat quotidien par album / artiste / piste, écrit dans la transaction
+    qui modifie user_track_daily et consommé par le constructeur des classements.
+    """
+    __tablename__ = "leaderboard_delta"
+
+    id: Optional[int] = Field(default=None, primary_key=True)
+    kind: str  # album | artist | track
+    spotify_id: str
+    play_count: int = 0
+    ms_played: int = Field(default=0, sa_column=Column(BigInteger, nullable=False, default=0))
+    potential_ms: int = Field(default=0, sa_column=Column(BigInteger, nullable=False, default=0))
+
+class LeaderboardState(SQLModel, table=True):
+    __tablename__ = "leaderboard_state"
+
+    id: int = Field(default=1, primary_key=True)
+    last_run: Optional[datetime] = None
+    last_full_build: Optional[datetime] = None
@@ -0,0 +1,110 @@
+from types import SimpleNamespace
+from sqlalchemy import Date, Integer, Interval, cast, extract, func, literal_column, select, tuple_
+from sqlmodel import Session
+from app.models import Track, TrackHistory
+
+# Agrégation du dashboard en un seul parcours de l'historique :
+# 1. `plays` : une passe sur trackhistory (jointe à track pour la durée, l'album et l'artiste), groupée par
+#    GROUPING SETS ((jour, heure), (morceau), (album), (artiste)) ;
+# 2. les lignes (jour, heure) sont regroupées par heure, jour de semaine, mois, année, jour et au total
+#    (second GROUPING SETS, sur quelques milliers de lignes) ;
+# 3. les entités distinctes sont comptées sur les lignes (morceau), (album) et (artiste).
+# Remplace les trois passes (totaux, données temporelles, évolution quotidienne) et leurs cumuls en Python.
+# Comme ces passes : les répartitions temporelles comptent toutes les écoutes, les totaux (temps, écoutes,
+# entités distinctes, jours, complétion moyenne par écoute) seulement celles des morceaux de durée connue.
+
+WEEK_DAYS = ["Lun", "Mar", "Mer", "Jeu", "Ven", "Sam", "Dim"]
+MONTHS = ["Jan", "Fév", "Mar", "Avr", "Mai", "Juin", "Juil", "Août", "Sep", "Oct", "Nov", "Déc"]
+
+# grouping(heure, jour de semaine, mois, année, jour) : bit à 1 pour chaque colonne agrégée
+LEVELS = {0b01111: "hour", 0b10111: "weekday", 0b11011: "month", 0b11101: "year", 0b11110: "day", 0b11111: "total"}
+# grouping(morceau, album, artiste) des lignes de `plays`
+PLAY_SLOTS, PLAY_TRACKS, PLAY_ALBUMS, PLAY_ARTISTS = 0b111, 0b011, 0b101, 0b110
+
+def period_stats_query(filters):
+    # L'heure est décalée d'une heure (fuseau affiché), les jours / mois / années ne le sont pas
+    day = cast(TrackHistory.played_at, Date).label("play_day")
+    # (mêmes expressions que la statistique étendue trackhistory_day_hour_stats de SCHEMA_UPGRADES)
+    hour = cast(extract("hour", TrackHistory.played_at + literal_column("interval '1 hour'", Interval)), Integer).label("play_hour")
+    known = Track.duration_ms > 0
+    plays = (
+        select(
+            func.grouping(TrackHistory.spotify_id, Track.album_id, Track.artist_id).label("slot"),
+            day, hour, TrackHistory.spotify_id, Track.album_id, Track.artist_id,
+            func.sum(TrackHistory.ms_played).label("ms"),
+            func.count().label("streams"),
+            # Morceaux dont la durée est connue (pas encore enrichis sinon) : base des totaux
+            func.sum(TrackHistory.ms_played).filter(known).label("known_ms"),
+            func.count().filter(known).label("known_streams"),
+            # Complétion de chaque écoute (temps écouté / durée), moyennée au total
+            func.sum(TrackHistory.ms_played * 1.0 / Track.duration_ms).filter(known).label("completion_sum")
+        )
+        .join(Track, Track.spotify_id == TrackHistory.spotify_id)
+        .where(*filters)
+        .group_by(func.grouping_sets(
+            tuple_(literal_column("play_day"), literal_column("play_hour")),
+            TrackHistory.spotify_id, Track.album_id, Track.artist_id
+        ))
+        .cte("plays")
+    )
+
+    def distinct(column, slot):
+        return select(func.count(column)).where(plays.c.slot == slot, plays.c.known_streams > 0).scalar_subquery()
+
+    weekday = cast(extract("isodow", plays.c.play_day), Integer)
+    month = cast(extract("month", plays.c.play_day), Integer)
+    year = cast(extract("year", plays.c.play_day), Integer)
+    keys = (plays.c.play_hour, weekday, month, year, plays.c.play_day)
+    return (
+        select(
+            func.grouping(*keys).label("level"),
+            plays.c.play_hour.label("hour"), weekday.label("weekday"), month.label("month"), year.label("year"), plays.c.play_day.label("day"),
+            func.sum(plays.c.ms).label("ms"),
+            # Minutes arrondies par créneau (jour, heure) puis additionnées, comme les graphiques l'ont toujours fait
+            func.sum(func.round(plays.c.ms / 60000.0)).label("minutes"),
+            func.sum(plays.c.streams).label("streams"),
+            func.sum(plays.c.known_ms).label("known_ms"),
+            func.sum(plays.c.known_streams).label("known_streams"),
+            func.sum(plays.c.completion_sum).label("completion_sum"),
+            distinct(plays.c.spotify_id, PLAY_TRACKS).label("unique_tracks"),
+            distinct(plays.c.album_id, PLAY_ALBUMS).label("unique_albums"),
+            distinct(plays.c.artist_id, PLAY_ARTISTS).label("unique_artists")
+        )
+        .where(plays.c.slot == PLAY_SLOTS)
+        .group_by(func.grouping_sets(*keys, tuple_()))
+    )
+
+def fetch_period_stats(session: Session, filters):
+    """
+    Totaux et répartitions temporelles (heure, jour de semaine, mois, année, jour) de la période,
+    en une requête. Retourne un objet : totals, clock, weekly, monthly, annual, days.
+    """
+    clock = [{"hour": f"{i}h", "value": 0, "streams": 0} for i in range(24)]
+    weekly = [{"day": d, "value": 0, "streams": 0} for d in WEEK_DAYS]
+    monthly = [{"month": m, "value": 0, "streams": 0} for m in MONTHS]
+    annual, days = [], []
+    days_count = 0
+    totals = SimpleNamespace(total_ms=0, total_streams=0, unique_tracks=0, unique_albums=0, unique_artists=0, days_count=0, completion=None)
+
+    for r in session.exec(period_stats_query(filters)).all():
+        level = LEVELS.get(r.level)
+        point = {"value": int(r.minutes or 0), "streams": int(r.streams or 0)}
+        if level == "hour": clock[r.hour].update(point)
+        elif level == "weekday": weekly[r.weekday - 1].update(point)
+        elif level == "month": monthly[r.month - 1].update(point)
+        elif level == "year": annual.append({"year": str(r.year), **point})
+        elif level == "day":
+            days.append((r.day, int(r.ms), int(r.streams)))
+            if r.known_streams: days_count += 1
+        elif level == "total" and r.known_streams:
+            totals = SimpleNamespace(
+                total_ms=int(r.known_ms), total_streams=int(r.known_streams),
+                unique_tracks=r.unique_tracks, unique_albums=r.unique_albums, unique_artists=r.unique_artists,
+                days_count=0, completion=float(r.completion_sum) * 100.0 / int(r.known_streams)
+            )
+
+    totals.days_count = days_count
+    return SimpleNamespace(
+        totals=totals, clock=clock, weekly=weekly, monthly=monthly,
+        annual=sorted(annual, key=lambda x: x["year"]), days=sorted(days)
+    )
@@ -1,10 +1,15 @@
+import time
 from datetime import datetime
 from typing import Literal, Optional
-from fastapi import APIRouter, Cookie, Depends, HTTPException, Query
-import sqlalchemy
+from fastapi import APIRouter, Cookie, Depends, HTTPException, Query, Request
 from sqlmodel import Session, col, select, func, desc
-from app.database import get_session
-from app.models import TrackHistory, Track, Album, Artist, User
+from sqlmodel.ext.asyncio.session import AsyncSession
+from app.database import get_async_session
+from app.models import TrackHistory, Track, Album, Artist, User, UserTrackDaily, FirstListen
+from app.utils.date_range import as_day, period_filters
+from app.utils.parallel_queries import run_sections, server_timing
+from app.utils.response_cache import cached_response, response_key
+from .aggregation import fetch_period_stats
 
 router = APIRouter()
 
@@ -16,12 +21,13 @@ router = APIRouter()
         404: {"description": "Utilisateur non trouvé"}
     }
 )
-def get_dashboard_data(
+async def get_dashboard_data(
     slug: str, 
+    request: Request,
     start_date: Optional[datetime] = Query(None), 
     end_date: Optional[datetime] = Query(None),
     session_id: Optional[str] = Cookie(None),
-    session: Session = Depends(get_session)
+    session: AsyncSession = Depends(get_async_session)
 ):
     """
     Génère une vue analytique profonde du comportement d'écoute.
@@ -29,12 +35,22 @@ def get_dashboard_data(
     **Fonctionnalités Clés :**
     - **Contrôle d'Accès** : Gère la visibilité publique/privée via les `perms` de l'utilisateur.
     - **Normalisation Temporelle** : Ajustement automatique (Timezone +1h) pour le graphique de l'horloge.
-    - **Analyse de Découverte** : Calcule l'évolution du catalogue (quand un artiste/album a été vu pour la première fois).
+    - **Analyse de Découverte** : Calcule l'évolution du catalogue (quand un artiste/album a été vu pour la première fois),
+      à partir des premières écoutes pré-calculées (`first_listen`) : seules les nouveautés de la période sont comptées.
     - **Dualité des Tops** : Retourne les favoris selon deux métriques : le temps passé (`ms_played`) et la fréquence (`count`).
 
     **Indicateurs de Performance :**
     - **Ratio de complétion** : Pourcentage moyen d'écoute des morceaux (écoute intégrale vs zapping).
     - **Intensité** : Moyennes quotidiennes de temps et de streams.
+
+    **Exécution :**
+    Les sections (totaux, temporel, tops, découvertes, évolution) sont indépendantes : elles s'exécutent
+    en parallèle, chacune sur sa connexion. L'en-tête `Server-Timing` donne la durée de chaque section.
+
+    **Cache :**
+    La réponse est mise en cache par (utilisateur, période, version des données) et porte un `ETag` :
+    tant que l'historique ou le profil n'ont pas changé, une nouvelle visite reçoit un 304 ou la réponse
+    en cache, sans requête sur l'historique.
     """
     # # 1. Stats Globales
     # res = session.exec(
@@ -186,14 +202,49 @@ def get_dashboard_data(
     #     })
 
     # Auth & Filtres
-    target_user, is_owner = get_target_user_and_check_perms(slug, session_id, session)
-    filters = [TrackHistory.user_id == target_user.id]
-    if start_date: filters.append(TrackHistory.played_at >= start_date)
-    if end_date: filters.append(TrackHistory.played_at <= end_date)
-
-    # Collecte des données via les services
-    res = fetch_global_stats(session, filters)
-    clock, weekly, monthly, day_map, annual_dict = process_temporal_data(session, filters)
+    start = time.perf_counter()
+    target_user, is_owner = await session.run_sync(lambda s: get_target_user_and_check_perms(slug, session_id, s))
+    # La connexion de la requête est rendue au pool avant que les sections n'en prennent d'autres
+    await session.close()
+    auth_ms = (time.perf_counter() - start) * 1000
+
+    # Collecte des données via les services, sections en parallèle (seulement si absent du cache)
+    timings = {}
+    async def compute():
+        payload, section_timings = await compute_dashboard(target_user.id, start_date, end_date)
+        timings.update(section_timings)
+        return payload
+
+    # Contenu identique pour tous les visiteurs autorisés : une seule entrée par version
+    params = {"start_date": as_day(start_date), "end_date": as_day(end_date)}
+    key = response_key("dashboard", target_user.id, target_user.data_version, False, params)
+    response = await cached_response(request, key, compute)
+    response.headers["Server-Timing"] = server_timing({"auth": auth_ms, **timings, "total": (time.perf_counter() - start) * 1000})
+    return response
+
+async def compute_dashboard(user_id: int, start_date: Optional[datetime], end_date: Optional[datetime]):
+    """Calcule le dashboard (sans cache) : retourne la réponse et la durée de chaque section."""
+    results, timings = await run_sections(dashboard_sections(user_id, start_date, end_date))
+    return build_dashboard(results), timings
+
+def dashboard_sections(user_id: int, start_date: Optional[datetime], end_date: Optional[datetime]):
+    """Requêtes indépendantes du dashboard : {nom de section: fn(session)}."""
+    # Bornes au jour près, fin incluse, identiques pour l'historique brut et l'agrégat quotidien
+    filters = [TrackHistory.user_id == user_id, *period_filters(TrackHistory.played_at, start_date, end_date)]
+    # Les tops sont lus dans user_track_daily, les découvertes dans first_listen, à la granularité du jour
+    daily_filters = get_daily_filters(user_id, start_date, end_date)
+    # Totaux, répartitions temporelles et évolution quotidienne : un seul parcours de l'historique
+    sections = {"periods": lambda s: fetch_period_stats(s, filters)}
+    for target in TOP_TARGETS:
+        for metric in TOP_METRICS:
+            sections[f"top_{target}_{metric}"] = lambda s, t=target, m=metric: get_top_stat(s, daily_filters, t, m)
+    sections["discoveries"] = lambda s: fetch_discovery_evolution(s, user_id, start_date, end_date)
+    return sections
+
+def build_dashboard(results: dict):
+    """Assemble la réponse du dashboard à partir des résultats des sections."""
+    periods = results["periods"]
+    res, clock, weekly, monthly = periods.totals, periods.clock, periods.weekly, periods.monthly
 
     # Calcul des "Peaks" (Pics d'activité)
     days_names = ["Lundi", "Mardi", "Mercredi", "Jeudi", "Vendredi", "Samedi", "Dimanche"]
@@ -210,12 +261,11 @@ def get_dashboard_data(
     # Finalisation de CumulativeData (Calcul du running total)
     cumulative_data = []
     running_ms, running_streams = 0, 0
-    for d_str in sorted(day_map.keys()):
-        d = day_map[d_str]
-        running_ms += d["ms"]
-        running_streams += d["streams"]
+    for day, ms, streams in periods.days:
+        running_ms += ms
+        running_streams += streams
         cumulative_data.append({
-            "date": d_str,
+            "date": day.isoformat(),
             "minutes": round(running_ms / 60000, 1),
             "streams": running_streams
         })
@@ -235,13 +285,13 @@ def get_dashboard_data(
         "clockData": clock,
         "weeklyData": weekly,
         "monthlyData": monthly,
-        "annualData": sorted(annual_dict.values(), key=lambda x: x['year']),
+        "annualData": periods.annual,
         "cumulativeData": cumulative_data,
-        "topTrack": get_top_item(session,filters,'track'),
-        "topAlbum": get_top_item(session,filters,'album'),
-        "topArtist": get_top_item(session,filters,'artist'),
-        "entityEvolution": fetch_discovery_evolution(session, target_user.id, filters),
-        "streamsEvolution": get_streams_evolution(target_user.id,start_date,end_date,session)
+        "topTrack": [format_top_item(results[f"top_track_{m}"], 'track') for m in TOP_METRICS],
+        "topAlbum": [format_top_item(results[f"top_album_{m}"], 'album') for m in TOP_METRICS],
+        "topArtist": [format_top_item(results[f"top_artist_{m}"], 'artist') for m in TOP_METRICS],
+        "entityEvolution": results["discoveries"],
+        "streamsEvolution": [{"date": day.isoformat(), "streams": streams, "minutes": round(ms / 60000, 1)} for day, ms, streams in periods.days]
     }
 
 def get_target_user_and_check_perms(slug: str, session_id: str, session: Session):
@@ -258,179 +308,58 @@ def get_target_user_and_check_perms(slug: str, session_id: str, session: Session
         
     return target_user, is_owner
 
-def fetch_global_stats(session, filters):
-    return session.exec(
-        select(
-            func.coalesce(func.sum(TrackHistory.ms_played), 0).label("total_ms"),
-            func.count(TrackHistory.id).label("total_streams"),
-            func.count(func.distinct(TrackHistory.spotify_id)).label("unique_tracks"),
-            func.count(func.distinct(Track.album_id)).label("unique_albums"),
-            func.count(func.distinct(Track.artist_id)).label("unique_artists"),
-            func.count(func.distinct(func.date(TrackHistory.played_at))).label("days_count"),
-            func.avg((col(TrackHistory.ms_played) * 1.0 / col(Track.duration_ms)) * 100).label("completion")
-        )
-        .join(Track, Track.spotify_id == TrackHistory.spotify_id)
-        .where(*filters)
-        .where(Track.duration_ms > 0)
-    ).first()
-
-def process_temporal_data(session, filters):
-    raw_time_data = session.exec(
-        select(
-            func.date(TrackHistory.played_at).label("date"),
-            func.extract('hour', TrackHistory.played_at + func.cast('1 hours', sqlalchemy.Interval)).label("hour"),
-            func.sum(TrackHistory.ms_played).label("ms"),
-            func.count(TrackHistory.id).label("streams")
-        )
-        .where(*filters).group_by("date", "hour").order_by("date")
-    ).all()
-
-    # Initialisation des structures (Clock, Weekly, Monthly)
-    clock = [{"hour": f"{i}h", "value": 0, "streams": 0} for i in range(24)]
-    weekly = [{"day": d, "value": 0, "streams": 0} for d in ["Lun", "Mar", "Mer", "Jeu", "Ven", "Sam", "Dim"]]
-    monthly = [{"month": m, "value": 0, "streams": 0} for m in ["Jan", "Fév", "Mar", "Avr", "Mai", "Juin", "Juil", "Août", "Sep", "Oct", "Nov", "Déc"]]
-    
-    current_day_map = {}
-    annual_dict = {}
+def get_daily_filters(user_id: int, start_date: Optional[datetime], end_date: Optional[datetime]):
+    return [UserTrackDaily.user_id == user_id, *period_filters(UserTrackDaily.day, start_date, end_date)]
 
-    for r in raw_time_data:
-        h_int, d_idx, m_idx = int(r.hour), (int(r.date.strftime("%w")) + 6) % 7, r.date.month - 1
-        mins = round(r.ms / 60000)
-        
-        clock[h_int]["value"] += mins
-        clock[h_int]["streams"] += r.streams
-        weekly[d_idx]["value"] += mins
-        weekly[d_idx]["streams"] += r.streams
-        monthly[m_idx]["value"] += mins
-        monthly[m_idx]["streams"] += r.streams
-
-        # Cumul par jour pour cumulativeData
-        day_str = r.date.isoformat()
-        if day_str not in current_day_map:
-            current_day_map[day_str] = {"ms": 0, "streams": 0, "obj": r.date}
-        current_day_map[day_str]["ms"] += r.ms
-        current_day_map[day_str]["streams"] += r.streams
-
-        # Annuel
-        year = r.date.year
-        if year not in annual_dict: annual_dict[year] = {"year": str(year), "value": 0, "streams": 0}
-        annual_dict[year]["value"] += mins
-        annual_dict[year]["streams"] += r.streams
-
-    return clock, weekly, monthly, current_day_map, annual_dict
-
-def fetch_discovery_evolution(session, user_id, filters):
+def fetch_discovery_evolution(session, user_id, start_date, end_date):
     """
-    Calcule l'évolution du catalogue : compte quand chaque entité 
-    a été écoutée pour la toute première fois.
+    Calcule l'évolution du catalogue : nombre cumulé de morceaux, albums et artistes
+    écoutés pour la toute première fois, jour par jour sur la période (table first_listen).
     """
-    def get_discovery_query(id_col, join_track=False):
-        # Sous-requête : Trouve la date de PREMIÈRE écoute (fs = first sight) pour chaque ID
-        stmt = select(id_col.label("id"), func.min(TrackHistory.played_at).label("fs"))
-        if join_track: 
-            stmt = stmt.join(Track, Track.spotify_id == TrackHistory.spotify_id)
-        
-        subq = stmt.where(TrackHistory.user_id == user_id, *filters).group_by(id_col).subquery()
-        
-        # Requête principale : Compte combien d'entités ont été "découvertes" par jour
-        return session.exec(
-            select(func.date(subq.c.fs).label("d"), func.count(subq.c.id).label("c"))
-            .group_by("d").order_by("d")
-        ).all()
-
-    # 1. Récupération des données brutes pour les 3 catégories
-    daily_tracks = get_discovery_query(TrackHistory.spotify_id)
-    daily_albums = get_discovery_query(Track.album_id, join_track=True)
-    daily_artists = get_discovery_query(Track.artist_id, join_track=True)
-
-    # 2. Fusion des dates uniques pour créer un axe temporel commun
-    all_dates = sorted(list(set(
-        [r.d for r in daily_tracks] + 
-        [r.d for r in daily_albums] + 
-        [r.d for r in daily_artists]
-    )))
-
-    # 3. Initialisation du dictionnaire de travail
-    entity_evolution = {
-        d.isoformat(): {"date": d.isoformat(), "tracks": 0, "albums": 0, "artists": 0} 
-        for d in all_dates
-    }
-
-    # 4. Remplissage avec les découvertes du jour (valeurs incrémentales)
-    for r in daily_tracks: entity_evolution[r.d.isoformat()]["tracks"] = r.c
-    for r in daily_albums: entity_evolution[r.d.isoformat()]["albums"] = r.c
-    for r in daily_artists: entity_evolution[r.d.isoformat()]["artists"] = r.c
-
-    # 5. Calcul du cumul (Running Total) pour le graphique
-    discovery_sorted_list = []
-    last_t, last_al, last_ar = 0, 0, 0
-
-    for d_str in sorted(entity_evolution.keys()):
-        entry = entity_evolution[d_str]
-        
-        # On cumule les découvertes du jour avec le total précédent
-        last_t += entry["tracks"]
-        last_al += entry["albums"]
-        last_ar += entry["artists"]
-        
-        discovery_sorted_list.append({
-            "date": d_str,
-            "tracks": last_t,
-            "albums": last_al,
-            "artists": last_ar
-        })
+    day = FirstListen.first_day
+    # Découvertes du jour, cumulées par une somme glissante côté Postgres
+    def discovered(kind): return func.sum(func.count().filter(FirstListen.entity_type == kind)).over(order_by=day)
+    rows = session.exec(
+        select(day, discovered("track"), discovered("album"), discovered("artist"))
+        .where(FirstListen.user_id == user_id, *period_filters(day, start_date, end_date))
+        .group_by(day).order_by(day)
+    ).all()
+    return [{"date": d.isoformat(), "tracks": int(t), "albums": int(al), "artists": int(ar)} for d, t, al, ar in rows]
 
-    return discovery_sorted_list
+TOP_TARGETS = ('track', 'album', 'artist')
+TOP_METRICS = ('ms', 'count')
 
 def get_top_item(session, filters, target: Literal['track', 'album', 'artist']):
-    def get_top_stat(target: Literal['track', 'album', 'artist'], metric: Literal['ms', 'count']):
-        agg_col = func.sum(TrackHistory.ms_played) if metric == 'ms' else func.count(TrackHistory.id)
-        label = "total_ms" if metric == 'ms' else "total_count"
-        group_id = {'track': TrackHistory.spotify_id, 'album': TrackHistory.album_id, 'artist': TrackHistory.artist_id}[target]
-
-        subq = (
-            select(group_id.label("sid"), agg_col.label(label))
-            .where(*filters).group_by(group_id)
-            .order_by(desc(label)).limit(1).subquery()
-        )
-
-        if target == 'track':
-            columns = [Track.title, Artist.name.label("artist_name"), Album.name.label("album_name"), Album.image_url]
-            joins = lambda s: s.join(Track, Track.spotify_id == subq.c.sid).join(Album, Track.album_id == Album.spotify_id).join(Artist, Album.artist_id == Artist.spotify_id)
-        elif target == 'album':
-            columns = [Album.name.label("album_name"), Artist.name.label("artist_name"), Album.image_url]
-            joins = lambda s: s.join(Album, Album.spotify_id == subq.c.sid).join(Artist, Album.artist_id == Artist.spotify_id)
-        else: # artist
-            columns = [Artist.name.label("artist_name"), Artist.image_url]
-            joins = lambda s: s.join(Artist, Artist.spotify_id == subq.c.sid)
-
-        return session.exec(joins(select(*columns, getattr(subq.c, label)))).first()
-
-    def format_item(res, type_item: Literal['track', 'album', 'artist']):
-        if not res: return None
-        return {
-            "name": res.title if type_item == 'track' else (res.album_name if type_item == 'album' else res.artist_name),
-            "artist": res.artist_name if type_item != 'artist' else None,
-            "album": res.album_name if type_item == 'track' else None,
-            "image": res.image_url
-        }
-    
-    return [format_item(get_top_stat(target, 'ms'),target),format_item(get_top_stat(target, 'count'),target)]
-
-def get_streams_evolution(user_id:int, start_date:Optional[datetime] = Query(None),end_date:Optional[datetime] = Query(None),session:Session = Depends(get_session)):
-    filters = [TrackHistory.user_id == user_id]
-    if start_date is not None: filters.append(TrackHistory.played_at >= start_date)
-    if end_date is not None: filters.append(TrackHistory.played_at <= end_date)
-    
-    results = session.exec(
-        select(
-            func.date(TrackHistory.played_at).label("day"),
-            func.count(TrackHistory.id).label("streams"),
-            func.sum(TrackHistory.ms_played).label("ms")
-        )
-        .where(*filters)
-        .group_by("day")
-        .order_by("day")
-    ).all()
-
-    return [{"date": r.day.isoformat(), "streams": r.streams, "minutes": round(r.ms/60000, 1)} for r in results]
\ No newline at end of file
+    return [format_top_item(get_top_stat(session, filters, target, metric), target) for metric in TOP_METRICS]
+
+def get_top_stat(session, filters, target: Literal['track', 'album', 'artist'], metric: Literal['ms', 'count']):
+    agg_col = func.sum(UserTrackDaily.ms_played) if metric == 'ms' else func.sum(UserTrackDaily.streams)
+    label = "total_ms" if metric == 'ms' else "total_count"
+    group_id = {'track': UserTrackDaily.spotify_id, 'album': UserTrackDaily.album_id, 'artist': UserTrackDaily.artist_id}[target]
+
+    subq = (
+        select(group_id.label("sid"), agg_col.label(label))
+        .where(*filters).group_by(group_id)
+        .order_by(desc(label)).limit(1).subquery()
+    )
+
+    if target == 'track':
+        columns = [Track.title, Artist.name.label("artist_name"), Album.name.label("album_name"), Album.image_url]
+        joins = lambda s: s.join(Track, Track.spotify_id == subq.c.sid).join(Album, Track.album_id == Album.spotify_id).join(Artist, Album.artist_id == Artist.spotify_id)
+    elif target == 'album':
+        columns = [Album.name.label("album_name"), Artist.name.label("artist_name"), Album.image_url]
+        joins = lambda s: s.join(Album, Album.spotify_id == subq.c.sid).join(Artist, Album.artist_id == Artist.spotify_id)
+    else: # artist
+        columns = [Artist.name.label("artist_name"), Artist.image_url]
+        joins = lambda s: s.join(Artist, Artist.spotify_id == subq.c.sid)
+
+    return session.exec(joins(select(*columns, getattr(subq.c, label)))).first()
+
+def format_top_item(res, type_item: Literal['track', 'album', 'artist']):
+    if not res: return None
+    return {
+        "name": res.title if type_item == 'track' else (res.album_name if type_item == 'album' else res.artist_name),
+        "artist": res.artist_name if type_item != 'artist' else None,
+        "album": res.album_name if type_item == 'track' else None,
+        "image": res.image_url
+    }
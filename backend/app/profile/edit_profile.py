@@ -6,6 +6,7 @@ from app.models import User
 from pydantic import BaseModel, field_validator
 from typing import Dict, Optional
 from app.response_message import UserSettingsResponse, UserUpdateResponse
+from app.utils.response_cache import bump_data_version
 
 RESERVED_SLUGS = ["admin", "settings", "dashboard", "api", "auth", "login"]
 
@@ -82,6 +83,9 @@ def update_user_profile(
             setattr(db_user, "perms", {**current_perms, **value})
         else: setattr(db_user, key, value)
     session.add(db_user)
+    # Nom, bio, images et permissions font partie des réponses mises en cache (profil, dashboard) ;
+    # incrément côté SQL : une écriture concurrente (import, synchronisation) ne perd pas le sien
+    bump_data_version(session, db_user.id)
     session.commit()
     session.refresh(db_user)
 
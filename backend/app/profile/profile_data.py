@@ -1,16 +1,17 @@
 import asyncio
 from typing import Optional
-from fastapi import APIRouter, Cookie, HTTPException, Depends
-from sqlalchemy import Float, cast
-from sqlmodel import Session, select, func, desc, text
+from fastapi import APIRouter, Cookie, HTTPException, Depends, Request
+from sqlmodel import Session, select, desc
+from sqlmodel.ext.asyncio.session import AsyncSession
 from sqlalchemy.orm import joinedload
-from app.database import get_session
-from app.models import User, TrackHistory, Track, Artist, Album
+from app.database import get_async_session, get_session
+from app.models import User, TrackHistory, Track, Artist, Album, UserSummary
 from app.response_message import UserProfileResponse, BaseUserProfile, UserProfileTopsResponse
 from app.spotify.utils.api_call import run_spotify_task
 from app.spotify.utils.spotify_api import get_spotify_users_client
 from app.spotify.utils.spotify_token import get_valid_access_token
-from app.utils.rating import get_formula
+from app.utils.response_cache import cached_response, response_key
+from app.utils.user_summary import get_user_summary
 
 def get_optional_user(session_id: Optional[str], db: Session):
     if not session_id:
@@ -29,7 +30,7 @@ router = APIRouter()
         404: {"description": "L'utilisateur n'existe pas."}
     }
 )
-async def get_user_profile(slug: str, session: Session = Depends(get_session), session_id: Optional[str] = Cookie(None)):
+async def get_user_profile(slug: str, request: Request, session: AsyncSession = Depends(get_async_session), session_id: Optional[str] = Cookie(None)):
     """
     Génère une page de profil complète incluant l'identité et les habitudes d'écoute.
 
@@ -39,11 +40,23 @@ async def get_user_profile(slug: str, session: Session = Depends(get_session), s
         1. L'utilisateur a activé la permission dans ses réglages.
         2. OU le visiteur est le propriétaire.
     
-    **Calculs SQL à la volée :**
-    - **Top 50** : Agrégation par morceaux, artistes et albums basée sur le `play_count`.
-    - **Heure de pointe** : Extraction de l'heure (`func.extract`) la plus fréquente dans l'historique.
+    **Résumé pré-calculé (`user_summary`) :**
+    - **Top 50** : Morceaux, artistes et albums classés par rating, hydratés par clé primaire.
+    - **Heure de pointe** : Heure la plus fréquente de l'histogramme horaire maintenu à chaque import.
     - **Fallback visuel** : Utilisation de DiceBear (avatars) et Unsplash (bannières) si l'utilisateur n'a pas personnalisé son profil.
+
+    **Cache :**
+    - Réponse mise en cache par (utilisateur, propriétaire ou visiteur, version des données), avec `ETag` (304 si inchangée).
     """
+    # Les lectures (et le recalcul éventuel du résumé) passent par la connexion asyncpg
+    target_user, is_owner = await session.run_sync(get_profile_target, slug, session_id)
+    key = response_key("profile", target_user.id, target_user.data_version, is_owner)
+    return await cached_response(
+        request, key, lambda: session.run_sync(build_user_profile, target_user, is_owner), response_model=UserProfileResponse
+    )
+
+def get_profile_target(session: Session, slug: str, session_id: Optional[str]):
+    """Utilisateur consulté et rôle du visiteur (propriétaire ou non) ; 404 / 403 selon les permissions."""
     if slug.isdigit(): target_user = session.get(User, int(slug))
     else: target_user = session.exec(select(User).where(User.slug == slug)).first()
     if not target_user: raise HTTPException(status_code=404, detail="Profil introuvable")
@@ -53,49 +66,51 @@ async def get_user_profile(slug: str, session: Session = Depends(get_session), s
     is_owner = visitor is not None and visitor.id == target_user.id
     # On bloque si le profil est privé ET que ce n'est pas le proprio
     if not target_user.perms.get("profile", True) and not is_owner: raise HTTPException(status_code=403, detail="Profil privé")
+    return target_user, is_owner
 
+def build_user_profile(session: Session, target_user: User, is_owner: bool):
     # --- INITIALISATION ---
     top_tracks, top_artists, top_albums = [], [], []
     total_minutes,total_streams = 0,0
+    show_stats = target_user.perms.get("stats", True) or is_owner
+    # Résumé pré-calculé (user_summary) : une lecture par clé primaire au lieu des agrégations
+    summary = get_user_summary(session, target_user.id)
 
     # --- TOP 50 TRACKS ---
     if target_user.perms.get("favorites", True) or is_owner:
-        top_tracks_raw = get_top_entities(session, Track, TrackHistory.spotify_id,target_user.id,50)
         top_tracks = [{
             "name": t.title,
-            "album_name": alb.name,
-            "artist_name": art.name,
-            "image_url": alb.image_url,
-            "count": cnt,
-            "minutes": round(m),
-            "engagement": round(eng,2),
-            "rating": round(r,2)
-        } for t, cnt, m, eng, r, art, alb in top_tracks_raw]
+            "album_name": t.album.name,
+            "artist_name": t.artist.name,
+            "image_url": t.album.image_url,
+            "count": e["count"],
+            "minutes": e["minutes"],
+            "engagement": e["engagement"],
+            "rating": e["rating"]
+        } for t, e in get_top_entities(session, summary, Track, "tracks") if t.album and t.artist]
 
-        top_albums_raw = get_top_entities(session, Album, TrackHistory.album_id,target_user.id,50)
         top_albums = [{
             "name": alb.name,
-            "artist_name": art.name,
+            "artist_name": alb.artist.name,
             "image_url": alb.image_url,
-            "count": count,
-            "minutes": round(m),
-            "engagement": round(eng,2),
-            "rating": round(r,2)
-        } for alb, count, m, eng, r, art in top_albums_raw]
+            "count": e["count"],
+            "minutes": e["minutes"],
+            "engagement": e["engagement"],
+            "rating": e["rating"]
+        } for alb, e in get_top_entities(session, summary, Album, "albums") if alb.artist]
 
-        top_artists_raw = get_top_entities(session, Artist, TrackHistory.artist_id,target_user.id,50)
         top_artists = [{
             "name": art.name,
             "image_url": art.image_url or f"https://api.dicebear.com/7.x/initials/svg?seed={art.name}",
-            "count": count,
-            "minutes": round(m),
-            "engagement": round(eng,2),
-            "rating": round(r,2)
-        } for art, count, m, eng, r in top_artists_raw]
+            "count": e["count"],
+            "minutes": e["minutes"],
+            "engagement": e["engagement"],
+            "rating": e["rating"]
+        } for art, e in get_top_entities(session, summary, Artist, "artists")]
 
     # --- STATS GLOBALES (Minutes & Streams) ---
-    if target_user.perms.get("stats", True) or is_owner:
-        stats = get_stats(target_user.id,session)
+    if show_stats:
+        stats = get_stats(summary)
         total_minutes = stats.get("min", 0)
         total_streams = stats.get("str", 0)
 
@@ -107,7 +122,7 @@ async def get_user_profile(slug: str, session: Session = Depends(get_session), s
         "total_minutes": total_minutes,
         "total_streams": total_streams,
         # --- HEURE DE POINTE (Peak Hour) ---
-        "peak_hour": get_peak_hour(target_user.id,session) if target_user.perms.get("stats", True) or is_owner else "N/A",
+        "peak_hour": get_peak_hour(summary) if show_stats else "N/A",
         "top_50_tracks": top_tracks,
         "top_50_artists": top_artists,
         "top_50_albums": top_albums,
@@ -178,76 +193,29 @@ def get_historique(target_user: User, limit: int,session: Session):
         "played_at": h.played_at
     } for h in recent_history]
 
-def get_stats(user_id: int, session: Session):
-    stats = session.exec(
-        select(
-            func.coalesce(func.sum(TrackHistory.ms_played), 0).label("total_ms"),
-            func.count(TrackHistory.id).label("total_streams")
-        ).where(TrackHistory.user_id == user_id)
-    ).first()
+def get_stats(summary: UserSummary):
     return {
-        "min":int((stats.total_ms) // 60000),
-        "str":stats.total_streams
+        "min": int(summary.total_ms // 60000),
+        "str": summary.total_streams
     }
 
-def get_peak_hour(user_id: int, session: Session):
-    hour_expr = func.extract('hour', TrackHistory.played_at)
-    peak_hour_res = session.exec(
-        select(
-            hour_expr.label("hour"),
-            func.count(TrackHistory.id).label("count")
-        )
-        .where(TrackHistory.user_id == user_id)
-        .group_by(hour_expr)
-        .order_by(desc(text("count")))
-        .limit(1)
-    ).first()
-    return f"{int(peak_hour_res[0])}h" if peak_hour_res is not None else "N/A"
-
-def get_top_entities(session, model, history_id_col, user_id, limit=50):
-    total_ms = func.sum(TrackHistory.ms_played)
-    play_count = func.count(TrackHistory.id).label("play_count")
-    minutes = (cast(total_ms, Float) / 60000.0).label("minutes")
-    
-    statement = (
-        select(model, play_count, minutes)
-        .join(TrackHistory, history_id_col == model.spotify_id)
-        .where(TrackHistory.user_id == user_id)
-    )
-
-    # Calcul de l'engagement et du Rating
-    if model == Track:
-        potential_dur = func.max(Track.duration_ms) * play_count
-        engagement = ((cast(total_ms, Float) * 100) / func.nullif(cast(potential_dur, Float), 0)).label("engagement")
-        rating = get_formula(model, total_ms, potential_dur, play_count)
-        statement = statement.add_columns(engagement, rating)
-    else:
-        # Pour Artiste/Album, on doit joindre Track
-        statement = statement.join(Track, TrackHistory.spotify_id == Track.spotify_id)
-        potential_dur = func.sum(Track.duration_ms)
-        engagement = ((cast(total_ms, Float) * 100) / func.nullif(cast(potential_dur, Float), 0)).label("engagement")
-        rating = get_formula(model, total_ms, potential_dur, play_count)
-        statement = statement.add_columns(engagement, rating)
+def get_peak_hour(summary: UserSummary):
+    hours = summary.hour_streams or []
+    if not any(hours): return "N/A"
+    return f"{max(range(len(hours)), key=lambda h: hours[h])}h"
 
-    # 4. Jointures de relations (Artistes, Albums)
-    group_cols = [model.spotify_id]
-    if model == Track:
-        statement = statement.join(Artist, Track.artist_id == Artist.spotify_id).add_columns(Artist)
-        statement = statement.join(Album, Track.album_id == Album.spotify_id).add_columns(Album)
-        group_cols.extend([Artist.spotify_id, Album.spotify_id])
-    elif model == Album:
-        statement = statement.join(Artist, Album.artist_id == Artist.spotify_id).add_columns(Artist)
-        group_cols.extend([Artist.spotify_id])
-
-    # 5. Finalisation avec TRI PAR RATING
-    # On trie par rating DESC, puis par play_count en cas d'égalité
-    statement = (
-        statement.group_by(*group_cols)
-        .order_by(desc("rating"), desc("play_count"))
-        .limit(limit)
-    )
-    
-    return session.exec(statement).all()
+def get_top_entities(session: Session, summary: UserSummary, model, kind: str, order: str = "rating"):
+    """
+    Top stocké dans le résumé, hydraté par clé primaire (noms et images à jour).
+    Retourne des couples (entité, stats) dans l'ordre du top.
+    """
+    entries = summary.tops.get(kind, {}).get(order, [])
+    if not entries: return []
+    statement = select(model).where(model.spotify_id.in_([e["id"] for e in entries]))
+    if model == Track: statement = statement.options(joinedload(Track.artist), joinedload(Track.album))
+    elif model == Album: statement = statement.options(joinedload(Album.artist))
+    entities = {e.spotify_id: e for e in session.exec(statement).unique().all()}
+    return [(entities[e["id"]], e) for e in entries if e["id"] in entities]
 
 @router.get(
     "/tops/{slug}",
@@ -84,6 +84,11 @@ class TrackStatsResponse(BaseStatsResponse):
     duration_ms: int
     total_minutes: int
 
+class TrackStatsPageResponse(BaseModel):
+    items: List[TrackStatsResponse]
+    # Curseur à renvoyer pour obtenir la page suivante (None : dernière page)
+    next_cursor: Optional[str] = None
+
 # --- 4. PROFIL & SOCIAL ---
 
 class ProfileItem(BaseModel):
@@ -162,6 +167,14 @@ class ResumeDataResponse(BaseModel):
     distinct_albums: int
     distinct_artists: int
 
+class SearchResultResponse(BaseModel):
+    type: str  # track | album | artist
+    spotify_id: str
+    name: str
+    subtitle: Optional[str]  # Artiste (pistes et albums)
+    image_url: Optional[str]
+    score: float
+
 # --- 5. SYSTÈME & MAINTENANCE ---
 
 class GlobalStatsResponse(BaseModel):
@@ -181,4 +194,15 @@ class SpotifyStatusResponse(BaseModel):
 
 class UploadSuccessResponse(BaseResponse):
     added: Optional[int] = 0
-    info: Optional[str] = None
\ No newline at end of file
+    info: Optional[str] = None
+
+class ImportJobResponse(BaseModel):
+    id: str
+    status: str
+    progress: int
+    entries: int
+    added: int
+    error: Optional[str] = None
+    message: Optional[str] = None
+    created_at: datetime
+    updated_at: datetime
\ No newline at end of file
@@ -0,0 +1,62 @@
+"""
+Migre une table trackhistory classique (bases créées avant le partitionnement) vers la table
+partitionnée par année de played_at. Les identifiants des écoutes sont conservés.
+
+La migration se fait en une transaction (table verrouillée pendant la copie : arrêter l'API avant).
+
+Usage (depuis backend/) :
+    python -m app.scripts.partition_history              # migre puis supprime l'ancienne table
+    python -m app.scripts.partition_history --keep-legacy  # conserve trackhistory_legacy
+    python -m app.scripts.partition_history --status     # liste les partitions
+"""
+import argparse
+import time
+from sqlalchemy import text
+from sqlmodel import Session
+from app.database import create_db_and_tables, engine
+from app.models import TrackHistory
+from app.utils.partitions import create_history_partitions, history_is_partitioned, history_partitions, maintain_history_partitions
+
+COLUMNS = "id, played_at, ms_played, user_id, spotify_id, artist_id, album_id"
+
+def migrate(db: Session, keep_legacy: bool):
+    db.execute(text("LOCK TABLE trackhistory IN ACCESS EXCLUSIVE MODE"))
+    # 1. L'ancienne table, ses index (noms globaux au schéma) et sa séquence sont renommés
+    db.execute(text("ALTER TABLE trackhistory RENAME TO trackhistory_legacy"))
+    for (index,) in db.execute(text("SELECT indexname FROM pg_indexes WHERE tablename = 'trackhistory_legacy'")).all():
+        db.execute(text(f'ALTER INDEX "{index}" RENAME TO "{index}_legacy"'))
+    db.execute(text("ALTER SEQUENCE IF EXISTS trackhistory_id_seq RENAME TO trackhistory_legacy_id_seq"))
+
+    # 2. Nouvelle table partitionnée (mêmes colonnes, index et contraintes que le modèle)
+    TrackHistory.__table__.create(db.connection())
+    maintain_history_partitions(db)
+    years = db.execute(text("SELECT DISTINCT extract(year FROM played_at)::int FROM trackhistory_legacy")).scalars().all()
+    create_history_partitions(db, years)
+
+    # 3. Copie des écoutes et reprise de la séquence des identifiants
+    copied = db.execute(text(f"INSERT INTO trackhistory ({COLUMNS}) SELECT {COLUMNS} FROM trackhistory_legacy")).rowcount
+    db.execute(text("SELECT setval(pg_get_serial_sequence('trackhistory', 'id'), COALESCE((SELECT max(id) FROM trackhistory), 0) + 1, false)"))
+    if not keep_legacy: db.execute(text("DROP TABLE trackhistory_legacy"))
+    return copied, len(years)
+
+def main():
+    parser = argparse.ArgumentParser(description="Partitionnement annuel de trackhistory")
+    parser.add_argument("--keep-legacy", action="store_true", help="Conserver l'ancienne table (trackhistory_legacy)")
+    parser.add_argument("--status", action="store_true", help="Afficher les partitions existantes")
+    args = parser.parse_args()
+
+    create_db_and_tables()
+    with Session(engine) as db:
+        if not args.status:
+            if history_is_partitioned(db): print("✅ trackhistory est déjà partitionnée.")
+            else:
+                start = time.perf_counter()
+                copied, years = migrate(db, args.keep_legacy)
+                db.commit()
+                db.execute(text("ANALYZE trackhistory"))
+                db.commit()
+                print(f"✅ {copied} écoutes migrées vers {years} partition(s) annuelle(s) en {time.perf_counter() - start:.1f} s")
+        for name, rows in history_partitions(db): print(f"   {name:<24} ~{max(rows, 0)} lignes")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,48 @@
+"""
+Vérifie (et reconstruit si besoin) l'agrégat quotidien user_track_daily à partir de l'historique brut.
+Toute reconstruction de l'agrégat reconstruit aussi les premières écoutes (first_listen).
+
+Usage (depuis backend/) :
+    python -m app.scripts.rollup check [--user ID]     # liste les écarts
+    python -m app.scripts.rollup check --fix           # reconstruit les utilisateurs en écart
+    python -m app.scripts.rollup rebuild [--user ID]   # reconstruction complète
+"""
+import argparse
+from sqlmodel import Session
+from app.database import engine
+from app.utils.first_listen import rebuild_first_listens
+from app.utils.rollup import check_rollup, rebuild_rollup
+
+def main():
+    parser = argparse.ArgumentParser(description="Cohérence de l'agrégat user_track_daily")
+    parser.add_argument("action", choices=("check", "rebuild"))
+    parser.add_argument("--user", type=int, default=None, help="Limiter à un utilisateur")
+    parser.add_argument("--fix", action="store_true", help="Reconstruire les utilisateurs incohérents (check)")
+    args = parser.parse_args()
+
+    with Session(engine) as db:
+        if args.action == "rebuild":
+            rebuild_rollup(db, args.user)
+            rebuild_first_listens(db, args.user)
+            db.commit()
+            print("✅ Agrégat reconstruit.")
+            return
+
+        mismatches = check_rollup(db, args.user)
+        if not mismatches:
+            print("✅ Agrégat cohérent avec l'historique.")
+            return
+        print(f"⚠️ {len(mismatches)} ligne(s) en écart :")
+        for user_id, day, spotify_id, exp_streams, streams, exp_ms, ms in mismatches[:20]:
+            print(f"   user={user_id} jour={day} piste={spotify_id} streams={streams}/{exp_streams} ms={ms}/{exp_ms}")
+
+        if args.fix:
+            for user_id in sorted({m[0] for m in mismatches}):
+                rebuild_rollup(db, user_id)
+                rebuild_first_listens(db, user_id)
+            db.commit()
+            print("✅ Utilisateurs concernés reconstruits.")
+        else: raise SystemExit(1)
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,13 @@
-from fastapi import APIRouter
+from fastapi import APIRouter, Depends
+from sqlmodel.ext.asyncio.session import AsyncSession
+from app.database import get_async_session
+from app.utils.cache_backend import cache_metrics
+from app.utils.enrichment_queue import queue_counts
+from app.utils.history_links import unlinked_counts
+from .utils.auto_sync import AUTO_SYNC_INTERVAL, auto_sync_worker
+from .utils.spotify_client import enrichment_metrics
 from .utils.spotify_status import spotify_status
+from .utils.SpotifyWorker import spotify_worker
 from app.response_message import SpotifyStatusResponse
 
 router = APIRouter()
@@ -23,4 +31,26 @@ async def get_spotify_api_status():
 
     **Utilité :** Ce point d'accès est souvent utilisé par les outils de monitoring ou par le Frontend pour afficher une alerte de maintenance si Spotify est injoignable.
     """
-    return spotify_status.get_status()
\ No newline at end of file
+    return spotify_status.get_status()
+
+@router.get('/enrichment', summary="Débit de l'enrichissement des métadonnées (éléments/s, taux de 429), état de la file et des liens de l'historique")
+async def get_enrichment_metrics(db: AsyncSession = Depends(get_async_session)):
+    # Compteurs du processus courant : seul le leader (verrou de la file) enrichit
+    counts = await db.run_sync(queue_counts)
+    return {
+        **enrichment_metrics.snapshot(queued=sum(c.get("pending", 0) for c in counts.values())),
+        "leader": spotify_worker.is_leader,
+        "queue": counts,
+        # Écoutes sans lien artiste / album et avancement du dernier rattrapage
+        "history_links": {**await db.run_sync(unlinked_counts), "repair": spotify_worker.link_repair}
+    }
+
+@router.get('/auto-sync', summary="Dernier passage de la synchronisation automatique des comptes liés")
+async def get_auto_sync_stats():
+    # Statistiques du processus courant : seul celui qui a obtenu le verrou synchronise
+    return {"interval_seconds": AUTO_SYNC_INTERVAL, "running": auto_sync_worker.is_running, "last_run": auto_sync_worker.last_run}
+
+@router.get('/cache', summary="Statistiques du cache des endpoints (hits, misses, requêtes regroupées, latence)")
+async def get_cache_metrics():
+    # Compteurs du processus courant
+    return cache_metrics.snapshot()
\ No newline at end of file
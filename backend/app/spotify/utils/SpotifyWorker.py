@@ -1,170 +1,242 @@
 import asyncio
-import random
-from typing import List
-import spotipy
-from sqlalchemy import func, or_, text
-from sqlmodel import Session, select
-from app.database import get_session
-from app.spotify.utils.spotify_api import get_spotify_client, get_spotify_users_client
-from app.models import Track,Artist,Album, TrackHistory, User
-from .spotify_status import spotify_status
-from .spotify_token import get_valid_access_token
-from .api_call import run_spotify_task
+import os
+from typing import List, Optional
+from sqlmodel import Session
+from app.database import async_engine, engine
+from app.utils.bulk_copy import copy_upsert
+from app.utils.first_listen import sync_first_listen_tracks
+from app.utils.history_links import link_history_tracks, repair_history_links
+from app.utils.rollup import sync_rollup_tracks
+from app.utils.response_cache import bump_data_versions
+from app.utils.user_summary import mark_summaries_stale
+from app.utils.enrichment_queue import (
+    ENRICHMENT_CHANNEL, ENRICHMENT_LOCK_KEY, claim_batch, complete_batch, enqueue_enrichment, release_batch, release_orphan_claims
+)
+from .spotify_client import BATCH_SIZE, SPOTIFY_BURST, SPOTIFY_RATE, SpotifyAppClient, SpotifyUnavailable, TokenBucket, enrichment_metrics
 import datetime
 
+# Lots demandés en parallèle à Spotify (le débit reste borné par le seau à jetons du client)
+ENRICH_CONCURRENCY = int(os.getenv("ENRICH_CONCURRENCY", 4))
+# Sans notification, la file est relue (et le verrou retenté par les autres processus) à cet intervalle
+POLL_INTERVAL = 30
 
 class SpotifyWorker:
+    """
+    Enrichissement des pistes et artistes via l'API Spotify, à partir de la file persistante `enrichment_queue`.
+    Chaque processus démarre le worker, mais seul le détenteur du verrou consultatif (leader) consomme la file :
+    les processus ne se disputent ni les IDs ni le quota Spotify. Si le leader s'arrête, son verrou
+    est libéré avec sa connexion et un autre processus prend le relais au tour suivant.
+    """
     _instance = None
-    _queue = asyncio.Queue()
 
     def __new__(cls):
         if cls._instance is None:
             cls._instance = super(SpotifyWorker, cls).__new__(cls)
+            cls._instance.task = None
+            cls._instance.is_leader = False
             cls._instance.is_running = False
             cls._instance.repair_history = False
+            cls._instance.link_repair = {"running": False, "tracks_done": 0, "tracks_total": 0, "rows_linked": 0}
+            cls._instance._wakeup = None
         return cls._instance
 
-    async def add_tracks(self, track_ids: List[str]):
-        for tid in track_ids: await self._queue.put(("track",tid))
-        if not self.is_running: asyncio.create_task(self._process_queue())
+    def start(self):
+        if self.task is None or self.task.done():
+            self._wakeup = asyncio.Event()
+            self.task = asyncio.create_task(self._run())
 
-    async def add_artists(self, artists_ids: List[str]):
-        for aid in artists_ids: await self._queue.put(("artist",aid))
-        if not self.is_running: asyncio.create_task(self._process_queue())
+    def notify(self):
+        if self._wakeup is not None: self._wakeup.set()
 
-    def add_artist(self, artist_id: str):
-        loop = asyncio.get_event_loop()
-        if loop.is_running():
-            # Si la boucle tourne déjà, on crée une tâche
-            loop.create_task(self._queue.put(("artist", artist_id)))
-        else:
-            # Cas rare : la boucle ne tourne pas encore
-            asyncio.run(self._queue.put(("artist", artist_id)))
+    def add_tracks(self, db: Session, track_ids: List[str]):
+        """Met des pistes en file, dans la transaction de l'appelant (le worker est réveillé au commit)."""
+        enqueue_enrichment(db, "track", track_ids)
+
+    def add_artists(self, db: Session, artists_ids: List[str]):
+        enqueue_enrichment(db, "artist", artists_ids)
 
     async def should_repair_history(self):
         self.repair_history = True
-        if not self.is_running: asyncio.create_task(self._process_queue())
+        self.notify()
+
+    async def _run(self):
+        while True:
+            try:
+                async with async_engine.connect() as conn:
+                    # Connexion dédiée : elle porte le verrou (niveau session) et l'écoute des notifications
+                    driver = (await conn.get_raw_connection()).driver_connection
+                    if await driver.fetchval("SELECT pg_try_advisory_lock($1)", ENRICHMENT_LOCK_KEY):
+                        listener = lambda *args: self.notify()
+                        await driver.add_listener(ENRICHMENT_CHANNEL, listener)
+                        self.is_leader = True
+                        try: await self._lead(driver)
+                        finally:
+                            self.is_leader = False
+                            await driver.remove_listener(ENRICHMENT_CHANNEL, listener)
+                            await driver.fetchval("SELECT pg_advisory_unlock($1)", ENRICHMENT_LOCK_KEY)
+            except Exception as e: print(f"❌ Erreur Worker inattendue: {e}")
+            await asyncio.sleep(POLL_INTERVAL)
+
+    async def _lead(self, driver):
+        with Session(engine) as db: orphans = release_orphan_claims(db)
+        print(f"👑 Worker d'enrichissement actif dans ce processus ({orphans} élément(s) repris)")
+        # Écoutes restées sans lien (bases existantes, arrêt pendant un import) : rattrapage à la prise de rôle
+        self.repair_history = True
+        while True:
+            # Connexion du verrou perdue : on cesse d'être leader (exception) plutôt que de consommer à deux
+            await driver.fetchval("SELECT 1")
+            self._wakeup.clear()
+            await self._process_queue()
+            if self.repair_history:
+                self.repair_history = False
+                await self.repair_track_history_links()
+            try: await asyncio.wait_for(self._wakeup.wait(), timeout=POLL_INTERVAL)
+            except asyncio.TimeoutError: pass
 
     async def _process_queue(self):
+        """
+        Pipeline d'enrichissement : ENRICH_CONCURRENCY tâches réclament des lots et les demandent à Spotify
+        (requêtes en vol simultanément) pendant qu'une tâche unique les écrit en base, hors de la boucle
+        d'événements. S'arrête quand plus aucun élément n'est en attente.
+        """
         self.is_running = True
-        sp = get_spotify_client()
-        
-        with next(get_session()) as db:
-            while not self._queue.empty():
-                status = spotify_status.get_status()
-                # Si on est blacklist à l'heure actuelle
-                if status["is_rate_limited"]:
-                    await asyncio.sleep(status["retry_after_seconds"] + 1)
-                    continue
-
-                tracks_batch = []
-                artists_batch = []
-                try:
-                    # On récupère jusqu'à 50 éléments, peu importe leur type
-                    while len(tracks_batch) < 50 and len(artists_batch) < 50 and not self._queue.empty():
-                        item_type, item_id = await self._queue.get()
-                        if item_type == "track": tracks_batch.append(item_id)
-                        elif item_type == "artist": artists_batch.append(item_id)
-
-                    # --- TRAITEMENT DES TRACKS ---
-                    if tracks_batch:
-                        results = run_spotify_task(sp.tracks,tracks_batch)['tracks']
-                        for t in results:
-                            if t: self._update_track_metadata(db, t)
-                    # --- TRAITEMENT DES ARTISTES ---
-                    if artists_batch:
-                        results = run_spotify_task(sp.artists,artists_batch)['artists']
-                        for a in results:
-                            if a: self._update_artist_metadata(db, a)
-                    db.commit()
-                except spotipy.exceptions.SpotifyException as e:
-                    if e.http_status == 429:
-                        # 1. On récupère le temps d'attente suggéré par Spotify
-                        seconds = int(e.headers.get("Retry-After", 60))
-                        print(f"⚠️ Rate Limit atteint. Pause de {seconds}s")
-                        # 2. On met à jour le singleton d'état
-                        spotify_status.set_rate_limited(seconds)
-                        # 3. On remet les IDs dans la file pour ne pas les perdre
-                        for tid in tracks_batch: await self._queue.put(("track",tid))
-                        for aid in artists_batch: await self._queue.put(("artist",aid))
-                        # 4. On attend réellement avant de continuer la boucle
-                        await asyncio.sleep(seconds)
-                    else: print(f"❌ Erreur API Spotify: {e}")
-                except Exception as e: print(f"❌ Erreur Worker inattendue: {e}")
-                finally:
-                    for _ in range(len(tracks_batch)+len(artists_batch)): self._queue.task_done()
-
-            if self.repair_history: await self.repair_track_history_links(db)
-            self.repair_history = False
-
-    def _update_track_metadata(self, db: Session, t: dict):
+        enrichment_metrics.start_run()
+        client = SpotifyAppClient(TokenBucket(SPOTIFY_RATE, SPOTIFY_BURST))
+        try:
+            # Lots récupérés en attente d'écriture (borne la mémoire si la base est plus lente que l'API)
+            fetched = asyncio.Queue(maxsize=ENRICH_CONCURRENCY * 2)
+            writer = asyncio.create_task(self._write_batches(fetched))
+            await asyncio.gather(*(self._fetch_batches(client, fetched) for _ in range(ENRICH_CONCURRENCY)))
+            await fetched.put(None)
+            await writer
+        finally:
+            await client.aclose()
+            enrichment_metrics.end_run()
+            self.is_running = False
+
+    def _claim(self):
+        # Pistes d'abord : leur enrichissement crée les artistes à enrichir ensuite
+        with Session(engine) as db:
+            for kind in ("track", "artist"):
+                ids = claim_batch(db, kind, BATCH_SIZE)
+                if ids: return kind, ids
+        return None, []
+
+    async def _fetch_batches(self, client: SpotifyAppClient, fetched: asyncio.Queue):
+        fetchers = {"track": client.tracks, "artist": client.artists}
+        while True:
+            kind, ids = await asyncio.to_thread(self._claim)
+            if not ids: return
+            # Les 429 sont absorbés par le client (pause puis nouvel essai), dans la limite de RATE_LIMIT_MAX_WAIT
+            try: await fetched.put((kind, ids, await fetchers[kind](ids)))
+            except SpotifyUnavailable as e:
+                # Rien à reprocher au lot : il retourne en file sans perdre d'essai, et ce fetcher s'arrête
+                # jusqu'au prochain tour du worker plutôt que de réclamer des lots voués au même sort
+                print(f"⚠️ Spotify indisponible, lot remis en file : {e}")
+                await asyncio.to_thread(self._release, kind, ids, str(e), True)
+                return
+            except Exception as e:
+                enrichment_metrics.errors += 1
+                print(f"❌ Erreur API Spotify: {e}")
+                await asyncio.to_thread(self._release, kind, ids, str(e))
+
+    def _release(self, kind: str, ids: List[str], error: str, retry: bool = False):
+        with Session(engine) as db: release_batch(db, kind, ids, error, retry)
+
+    async def _write_batches(self, fetched: asyncio.Queue):
+        while (batch := await fetched.get()) is not None:
+            kind, ids, results = batch
+            try:
+                enrichment_metrics.history_linked += await asyncio.to_thread(self._apply_batch, kind, ids, results)
+                enrichment_metrics.items += len(ids)
+                enrichment_metrics.batches += 1
+            except Exception as e:
+                enrichment_metrics.errors += 1
+                print(f"❌ Erreur Worker inattendue: {e}")
+                await asyncio.to_thread(self._release, kind, ids, str(e))
+
+    def _apply_batch(self, kind: str, ids: List[str], results: List[Optional[dict]]) -> int:
         """
-        Prend un objet track de l'API Spotify et met à jour/crée les entrées correspondantes dans la DB.
+        Écrit un lot de réponses Spotify et le marque traité dans la file (une transaction).
+        Retourne le nombre d'écoutes reliées à leur artiste / album.
         """
-        # Extraire les IDs Spotify
-        sp_track_id = t['id']
-        sp_artist_id = t['artists'][0]['id']
-        sp_artist_name = t['artists'][0]['name']
-        sp_album_id = t['album']['id']
-        sp_album_name = t['album']['name']
-        sp_album_img = t['album']['images'][0]['url'] if t['album']['images'] else None
-        duration_ms = t['duration_ms']
-
-        # Gérer l'Artiste
-        artist = db.exec(select(Artist).where(Artist.spotify_id == sp_artist_id)).first()
-        # L'artiste n'existe pas encore, on le crée et on le met dans la file d'attente à enrichir
-        if not artist:
-            artist = Artist(spotify_id=sp_artist_id, name=sp_artist_name)
-            db.add(artist)
-            db.flush()
-            self.add_artist(sp_artist_id)
-
-        # Gérer l'Album
-        album = db.exec(select(Album).where(Album.spotify_id == sp_album_id)).first()
-        if not album:
-            album = Album(
-                spotify_id=sp_album_id,
-                name=sp_album_name,
-                artist_id=sp_artist_id,
-                image_url=sp_album_img
-            )
-            db.add(album)
-            db.flush()
-
-        # Mettre à jour la Track existante
-        track = db.exec(select(Track).where(Track.spotify_id == sp_track_id)).first()
-        if track:
-            track.artist_id = sp_artist_id
-            track.album_id = sp_album_id
-            track.duration_ms = duration_ms
-            track.title = t['name'] 
-            db.add(track)
-    
-    def _update_artist_metadata(self, db: Session, sp_artist: dict):
+        found = [r for r in results if r]
+        linked = 0
+        with Session(engine) as db:
+            # --- TRAITEMENT DES TRACKS ---
+            if kind == "track":
+                # Artistes créés par l'enrichissement des pistes : à enrichir à leur tour
+                self.add_artists(db, self._update_tracks_metadata(db, found))
+                # L'agrégat quotidien reprend artiste / album / durée des pistes enrichies
+                # Écoutes de ces pistes restées sans lien artiste / album
+                linked = link_history_tracks(db, ids)
+                sync_rollup_tracks(db, ids)
+                sync_first_listen_tracks(db, ids)
+                mark_summaries_stale(db, ids)
+                bump_data_versions(db, track_ids=ids)
+            # --- TRAITEMENT DES ARTISTES ---
+            else:
+                self._update_artists_metadata(db, found)
+                bump_data_versions(db, artist_ids=ids)
+            returned = {r["id"] for r in found}
+            complete_batch(db, kind, [i for i in ids if i in returned], [i for i in ids if i not in returned])
+            db.commit()
+        return linked
+
+    def _update_tracks_metadata(self, db: Session, tracks: List[dict]) -> List[str]:
         """
-        Prend un objet artist de l'API Spotify et met à jour/crée les entrées correspondantes dans la DB.
+        Prend les objets track d'un lot de l'API Spotify et met à jour/crée les entrées correspondantes dans la DB
+        (un upsert par table au lieu de trois SELECT par piste). Retourne les IDs des artistes créés (à enrichir).
         """
-        artist = db.exec(select(Artist).where(Artist.spotify_id == sp_artist['id'])).first()
-        if artist and sp_artist.get('images'):
-            artist.image_url = sp_artist['images'][0]['url']
-            db.add(artist)
+        artists, albums, rows = {}, {}, []
+        for t in tracks:
+            sp_artist_id = t['artists'][0]['id']
+            sp_album_id = t['album']['id']
+            artists.setdefault(sp_artist_id, (sp_artist_id, t['artists'][0]['name']))
+            albums.setdefault(sp_album_id, (
+                sp_album_id, t['album']['name'],
+                t['album']['images'][0]['url'] if t['album']['images'] else None,
+                sp_artist_id
+            ))
+            rows.append((t['id'], t['name'], sp_artist_id, sp_album_id, t['duration_ms']))
+
+        # Dans l'ordre des clés étrangères ; les artistes et albums déjà connus sont laissés tels quels
+        new_artists = copy_upsert(db, "artist", ("spotify_id", "name"), artists.values(), ["spotify_id"], returning="spotify_id")
+        copy_upsert(db, "album", ("spotify_id", "name", "image_url", "artist_id"), albums.values(), ["spotify_id"])
+        copy_upsert(
+            db, "track", ("spotify_id", "title", "artist_id", "album_id", "duration_ms"), rows, ["spotify_id"],
+            update_columns=["title", "artist_id", "album_id", "duration_ms"]
+        )
+        return new_artists
+
+    def _update_artists_metadata(self, db: Session, sp_artists: List[dict]):
+        """
+        Prend les objets artist d'un lot de l'API Spotify et met à jour leur image (un seul upsert).
+        """
+        rows = [(a['id'], a['name'], a['images'][0]['url']) for a in sp_artists if a.get('images')]
+        copy_upsert(db, "artist", ("spotify_id", "name", "image_url"), rows, ["spotify_id"], update_columns=["image_url"])
 
-    async def repair_track_history_links(self,db):
+    async def repair_track_history_links(self):
         """
-        Déclenche la réparation ultra-rapide côté base de données.
-        Remplit artist_id et album_id en se basant sur les informations de la table Track.
+        Rattrapage des liens artiste / album de l'historique pour les pistes déjà enrichies
+        (hors boucle d'événements), avancement exposé dans `link_repair`.
+        Les écoutes des pistes enrichies ensuite sont reliées par `_apply_batch`.
         """
         print("⚡ Lancement de la réparation SQL interne...")
+        self.link_repair = {"running": True, "tracks_done": 0, "tracks_total": 0, "rows_linked": 0}
+
+        def progress(done: int, total: int, linked: int):
+            self.link_repair.update(tracks_done=done, tracks_total=total, rows_linked=linked)
+            print(f"🔗 Liens de l'historique : {done}/{total} pistes, {linked} écoutes reliées")
+
         try:
-            while db.exec(
-                select(func.count(TrackHistory.id).label("nb_to_repair"))
-                .where(or_(TrackHistory.artist_id == None, TrackHistory.album_id == None))
-            ).all()[0] > 0:
-                db.exec(text("SELECT repair_track_history();"))
-                db.commit()
-                await asyncio.sleep(0.3)
-            print(f"✅ Réparation SQL terminée.")
+            linked = await asyncio.to_thread(self._repair_links, progress)
+            print(f"✅ Réparation SQL terminée ({linked} écoutes reliées).")
         except Exception as e:
             print(f"❌ Erreur lors de la réparation SQL : {e}")
+        finally: self.link_repair["running"] = False
+
+    def _repair_links(self, progress) -> int:
+        with Session(engine) as db: return repair_history_links(db, progress)
 
 spotify_worker = SpotifyWorker()
\ No newline at end of file
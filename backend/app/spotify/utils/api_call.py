@@ -19,7 +19,8 @@ async def run_spotify_task(func: Callable, *args, **kwargs) -> Any:
         print(f"🔒 Verrou acquis. Exécution de {func_name}...")
         try:
             if inspect.iscoroutinefunction(func): result = await func(*args, **kwargs)
-            else: result = func(*args, **kwargs)
+            # Les appels spotipy sont bloquants (requests) : exécutés hors de la boucle d'événements
+            else: result = await asyncio.to_thread(func, *args, **kwargs)
             time_now = time.time()
             wait_time = max(0, 2.25 - (time_now - _time_last_api_call))
             if wait_time > 0: await asyncio.sleep(wait_time)
@@ -0,0 +1,164 @@
+import asyncio
+import os
+import time
+from datetime import datetime
+from typing import List, Optional, Tuple
+from spotipy.exceptions import SpotifyException
+from sqlalchemy import text
+from sqlmodel import Session
+from app.database import async_engine, engine
+from app.models import User
+from app.utils.partitions import ensure_history_partitions
+from app.utils.user_summary import mark_user_summaries_stale
+from .recent_sync import fetch_recent_pages, parse_recent_items, write_recent_plays
+from .spotify_status import spotify_status
+from .spotify_token import get_detached_access_token
+
+# Synchronisation automatique de l'historique récent de tous les comptes liés à Spotify :
+# l'API ne renvoie que les 50 dernières écoutes, un utilisateur qui ne rafraîchit pas perdait le reste.
+# - un seul processus synchronise à la fois (verrou consultatif AUTO_SYNC_LOCK_KEY, tenu le temps du passage) ;
+# - les utilisateurs sont servis du point de reprise le plus ancien au plus récent, une page chacun :
+#   les appels passent par `run_spotify_task` (file commune espacée avec les requêtes des utilisateurs),
+#   un passage ne monopolise donc pas le quota et chacun avance d'une page par passage ;
+# - un 429 suspend le passage pendant `Retry-After` ; l'utilisateur concerné repasse en tête au suivant ;
+# - les écoutes récupérées sont écrites par lots de AUTO_SYNC_WRITE_BATCH utilisateurs (une transaction),
+#   pendant que les utilisateurs suivants sont interrogés ;
+# - les accès à la base passent par des threads (connexion rendue avant chaque appel à Spotify) :
+#   le passage ne bloque pas la boucle d'événements des requêtes.
+AUTO_SYNC_INTERVAL = int(os.getenv("AUTO_SYNC_INTERVAL", 1800))
+AUTO_SYNC_WRITE_BATCH = int(os.getenv("AUTO_SYNC_WRITE_BATCH", 25))
+AUTO_SYNC_LOCK_KEY = 4_200_013
+# Pages (50 écoutes) par utilisateur et par passage
+AUTO_SYNC_MAX_PAGES = 1
+# Les 429 ne sont pas réessayés par spotipy : ils remontent ici (comptés, pause sur `Retry-After`)
+_CLIENT_OPTIONS = {"status_forcelist": (500, 502, 503, 504)}
+
+# (utilisateur, écoutes récupérées, nouveau point de reprise)
+Fetched = Tuple[int, dict, Optional[str]]
+
+def linked_user_ids(db: Session) -> List[int]:
+    """Comptes liés à Spotify, point de reprise le plus ancien (ou jamais synchronisés) en premier."""
+    return db.execute(text("""
+        SELECT id FROM "user"
+        WHERE spotify_id IS NOT NULL AND refresh_token IS NOT NULL
+        ORDER BY last_spotify_sync::bigint NULLS FIRST, id
+    """)).scalars().all()
+
+def load_linked_user_ids() -> List[int]:
+    with Session(engine) as db: return linked_user_ids(db)
+
+def load_sync_user(user_id: int) -> Optional[User]:
+    """Compte à synchroniser, détaché de sa session (jetons et point de reprise déjà chargés)."""
+    with Session(engine) as db:
+        user = db.get(User, user_id)
+        if user: db.expunge(user)
+    return user
+
+def write_synced_users(fetched: List[Fetched]) -> Tuple[int, int]:
+    """Écrit les écoutes d'un lot d'utilisateurs en une transaction. Retourne (écoutes ajoutées, utilisateurs modifiés)."""
+    added, changed = 0, []
+    with Session(engine) as db:
+        # Partitions manquantes : transaction courte, avant celle du lot
+        ensure_history_partitions(db, {played_at.year for _, plays, _ in fetched for played_at, _ in plays})
+        for user_id, plays, cursor in fetched:
+            count = write_recent_plays(db, user_id, plays)["added"]
+            if count:
+                added += count
+                changed.append(user_id)
+            if cursor: db.execute(text('UPDATE "user" SET last_spotify_sync = :cursor WHERE id = :user_id'), {"cursor": cursor, "user_id": user_id})
+        mark_user_summaries_stale(db, changed)
+        db.commit()
+    return added, len(changed)
+
+class AutoSyncWorker:
+    """Tâche de fond qui synchronise les comptes liés toutes les AUTO_SYNC_INTERVAL s (statistiques dans `last_run`)."""
+    _instance = None
+
+    def __new__(cls):
+        if cls._instance is None:
+            cls._instance = super(AutoSyncWorker, cls).__new__(cls)
+            cls._instance.task = None
+            cls._instance.is_running = False
+            cls._instance.last_run = None
+        return cls._instance
+
+    def start(self):
+        if self.task is None or self.task.done(): self.task = asyncio.create_task(self._run())
+
+    async def _run(self):
+        while True:
+            try:
+                async with async_engine.connect() as conn:
+                    driver = (await conn.get_raw_connection()).driver_connection
+                    if await driver.fetchval("SELECT pg_try_advisory_lock($1)", AUTO_SYNC_LOCK_KEY):
+                        try: await self.sync_all()
+                        finally: await driver.fetchval("SELECT pg_advisory_unlock($1)", AUTO_SYNC_LOCK_KEY)
+            except Exception as e: print(f"❌ Erreur de la synchronisation automatique : {e}")
+            await asyncio.sleep(AUTO_SYNC_INTERVAL)
+
+    async def sync_all(self) -> dict:
+        """Un passage sur tous les comptes liés."""
+        start = time.perf_counter()
+        self.is_running = True
+        user_ids = await asyncio.to_thread(load_linked_user_ids)
+        stats = {
+            "started_at": datetime.utcnow().isoformat(), "users": len(user_ids), "synced": 0, "failed": 0,
+            "updated_users": 0, "new_plays": 0, "pages": 0, "rate_limited": 0, "seconds": None
+        }
+        self.last_run = stats
+        batch: List[Fetched] = []
+        writing: Optional[Tuple[asyncio.Task, int]] = None
+        try:
+            for user_id in user_ids:
+                fetched = await self._fetch_user(user_id, stats)
+                if fetched: batch.append(fetched)
+                if len(batch) >= AUTO_SYNC_WRITE_BATCH:
+                    if writing: await self._written(*writing, stats)
+                    # Écriture du lot en parallèle de l'interrogation des utilisateurs suivants
+                    writing = (asyncio.create_task(asyncio.to_thread(write_synced_users, batch)), len(batch))
+                    batch = []
+            if writing: await self._written(*writing, stats)
+            if batch: await self._written(asyncio.to_thread(write_synced_users, batch), len(batch), stats)
+        finally:
+            self.is_running = False
+            stats["seconds"] = round(time.perf_counter() - start, 1)
+        print(f"🔄 Synchronisation automatique : {stats}")
+        return stats
+
+    async def _fetch_user(self, user_id: int, stats: dict) -> Optional[Fetched]:
+        try:
+            user = await asyncio.to_thread(load_sync_user, user_id)
+            if user is None: return None
+            access_token = await get_detached_access_token(user)
+            items, cursor, pages = await fetch_recent_pages(user, access_token, max_pages=AUTO_SYNC_MAX_PAGES, client_options=_CLIENT_OPTIONS)
+            stats["pages"] += pages
+            stats["synced"] += 1
+            return user_id, parse_recent_items(items), cursor
+        except SpotifyException as e:
+            stats["failed"] += 1
+            if e.http_status != 429:
+                print(f"⚠️ Synchronisation de l'utilisateur {user_id} impossible : {e}")
+                return None
+            # Quota atteint : tout le passage attend, l'utilisateur sera repris au passage suivant
+            seconds = int((e.headers or {}).get("Retry-After", 1))
+            stats["rate_limited"] += 1
+            spotify_status.set_rate_limited(seconds)
+            print(f"⚠️ Rate Limit atteint. Pause de {seconds}s")
+            await asyncio.sleep(seconds)
+        except Exception as e:
+            stats["failed"] += 1
+            print(f"⚠️ Synchronisation de l'utilisateur {user_id} impossible : {e}")
+        return None
+
+    async def _written(self, writing, users: int, stats: dict):
+        try:
+            added, updated = await writing
+            stats["new_plays"] += added
+            stats["updated_users"] += updated
+        except Exception as e:
+            # Lot annulé : points de reprise inchangés, ces utilisateurs seront repris au passage suivant
+            stats["synced"] -= users
+            stats["failed"] += users
+            print(f"❌ Erreur d'écriture de la synchronisation automatique : {e}")
+
+auto_sync_worker = AutoSyncWorker()
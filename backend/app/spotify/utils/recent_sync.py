@@ -0,0 +1,97 @@
+import datetime
+from typing import Optional
+from sqlalchemy import text
+from sqlmodel import Session
+from app.models import User
+from app.utils.bulk_copy import copy_upsert
+from app.utils.first_listen import record_first_listens
+from app.utils.response_cache import bump_data_version
+from app.utils.rollup import refresh_rollup_days
+from app.utils.user_summary import add_hour_streams, hour_counts
+from .SpotifyWorker import spotify_worker
+from .api_call import run_spotify_task
+from .spotify_api import get_spotify_users_client
+
+# Synchronisation de l'historique récent ("recently played") : récupération des pages, normalisation
+# et écriture des seules écoutes nouvelles. Utilisée par GET /refresh et par la synchronisation automatique.
+
+# Garde-fou : pages remontées au plus par synchronisation (l'API n'expose que les dernières écoutes)
+SYNC_MAX_PAGES = 20
+
+async def fetch_recent_pages(user: User, access_token: str, max_pages: int = SYNC_MAX_PAGES, client_options: Optional[dict] = None):
+    """
+    Récupère les pages de l'historique récent (50 écoutes chacune), de la plus récente à la plus ancienne,
+    jusqu'à une page vide. Retourne les écoutes, le curseur `after` le plus récent et le nombre de pages.
+    Aucun accès à la base : l'appelant fournit un jeton valide et ne retient pas de connexion pendant les appels.
+    """
+    sp = get_spotify_users_client(access_token, **(client_options or {}))
+    items, newest_cursor, pages = [], None, 0
+    after, before = user.last_spotify_sync, None
+    while pages < max_pages:
+        data = await run_spotify_task(sp.current_user_recently_played, limit=50, after=after, before=before)
+        pages += 1
+        if not data['items']: break
+        items.extend(data['items'])
+        cursors = data["cursors"]
+        if not cursors or not cursors["after"]: break
+        # Le point de reprise est l'écoute la plus récente vue, pas celle de la dernière page remontée
+        if newest_cursor is None or int(cursors["after"]) > int(newest_cursor): newest_cursor = cursors["after"]
+        after, before = None, cursors["before"]
+    return items, newest_cursor, pages
+
+def parse_recent_items(items: list) -> dict:
+    """{(played_at, spotify_id): (track, album, artist)} des écoutes valides, sans doublon entre pages."""
+    plays = {}
+    for item in items:
+        track = item['track']
+        sid, played_at = track["id"], item['played_at']
+        if not sid or not played_at: continue
+        try: dt_obj = datetime.datetime.fromisoformat(played_at.replace("Z", "+00:00")).replace(tzinfo=None)
+        except: continue
+
+        primary_artist = track["artists"][0]
+        album = track["album"]
+        images = album["images"]
+        plays[(dt_obj, sid)] = (
+            (sid, track["name"], primary_artist["id"], album["id"], track['duration_ms']),
+            (album["id"], album["name"], images[0]["url"] if images else None, primary_artist["id"]),
+            (primary_artist["id"], primary_artist["name"])
+        )
+    return plays
+
+def write_recent_plays(session: Session, user_id: int, plays: dict) -> dict:
+    """
+    Écrit les écoutes absentes de la base (dans la transaction courante) : seules les écoutes récupérées
+    sont comparées à l'historique (IN sur la clé unique), les pistes / albums / artistes inconnus sont
+    créés par upsert. Retourne le nombre d'écoutes et d'entités ajoutées.
+    Les partitions des années concernées sont créées au préalable (`ensure_history_partitions`, avant la transaction).
+    """
+    known = set(session.execute(text("""
+        SELECT played_at, spotify_id FROM trackhistory
+        WHERE user_id = :user_id AND played_at = ANY(:played_at)
+    """), {"user_id": user_id, "played_at": sorted({p for p, _ in plays})}).all()) if plays else set()
+    new = {key: value for key, value in plays.items() if key not in known}
+    stats = {"added": 0, "new_tracks": 0, "new_artists": 0}
+    if not new: return stats
+
+    # COPY + ON CONFLICT, dans l'ordre des clés étrangères (les entités déjà connues sont ignorées)
+    new_artists = copy_upsert(session, "artist", ("spotify_id", "name"), [a for _, _, a in new.values()], ["spotify_id"], returning="spotify_id")
+    copy_upsert(session, "album", ("spotify_id", "name", "image_url", "artist_id"), [a for _, a, _ in new.values()], ["spotify_id"])
+    new_tracks = copy_upsert(
+        session, "track", ("spotify_id", "title", "artist_id", "album_id", "duration_ms"),
+        [t for t, _, _ in new.values()], ["spotify_id"], returning="spotify_id"
+    )
+    inserted = copy_upsert(
+        session, "trackhistory",
+        ("user_id", "played_at", "ms_played", "spotify_id", "artist_id", "album_id"),
+        [(user_id, played_at, 0, sid, t[2], t[3]) for (played_at, sid), (t, _, _) in new.items()],
+        ["user_id", "played_at", "spotify_id"], returning="played_at"
+    )
+    add_hour_streams(session, user_id, hour_counts(inserted))
+    new_days = {played_at.date() for played_at in inserted}
+    refresh_rollup_days(session, user_id, new_days)
+    record_first_listens(session, user_id, new_days)
+    bump_data_version(session, user_id)
+    # Artistes créés (sans image) : mis en file d'enrichissement avec les écoutes
+    spotify_worker.add_artists(session, new_artists)
+    return {"added": len(inserted), "new_tracks": len(new_tracks), "new_artists": len(new_artists)}
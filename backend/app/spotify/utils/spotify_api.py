@@ -15,8 +15,9 @@ def get_spotify_client():
     )
     return spotipy.Spotify(auth_manager=auth_manager)
 
-def get_spotify_users_client(access_token):
+def get_spotify_users_client(access_token, **options):
     """
     Initialise et retourne un client Spotify (mode Client-to-Server)
+    `options` : réglages spotipy (nouvelles tentatives, ...)
     """
-    return spotipy.Spotify(auth=access_token)
\ No newline at end of file
+    return spotipy.Spotify(auth=access_token, **options)
\ No newline at end of file
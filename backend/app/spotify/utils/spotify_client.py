@@ -0,0 +1,161 @@
+import asyncio
+import os
+import time
+from typing import Dict, List, Optional
+import httpx
+from .spotify_status import spotify_status
+
+# Client Spotify asynchrone (identifiants de l'application) utilisé par l'enrichissement des métadonnées :
+# les appels ne bloquent pas la boucle d'événements et plusieurs requêtes peuvent être en vol,
+# le débit global étant borné par un seau à jetons partagé (pause sur `Retry-After` en cas de 429).
+SPOTIFY_API_URL = "https://api.spotify.com/v1"
+SPOTIFY_TOKEN_URL = "https://accounts.spotify.com/api/token"
+# Débit moyen (requêtes / s) et rafale autorisés vers l'API
+SPOTIFY_RATE = float(os.getenv("SPOTIFY_RATE", 3))
+SPOTIFY_BURST = int(os.getenv("SPOTIFY_BURST", 5))
+# Essais par appel en cas d'erreur réseau / serveur (les 429 n'en consomment pas)
+MAX_ATTEMPTS = 5
+# Attente cumulée maximale sur les 429 d'un appel (s) : au-delà, le lot est rendu à la file
+RATE_LIMIT_MAX_WAIT = int(os.getenv("SPOTIFY_RATE_LIMIT_MAX_WAIT", 600))
+# Taille maximale d'un lot (/tracks et /artists acceptent 50 IDs)
+BATCH_SIZE = 50
+
+class SpotifyUnavailable(RuntimeError):
+    """Spotify injoignable, en erreur ou limitant le débit : l'échec ne tient pas aux IDs demandés."""
+
+class TokenBucket:
+    """Seau à jetons : `rate` jetons par seconde, au plus `capacity` d'avance ; `pause` bloque tout le monde."""
+    def __init__(self, rate: float, capacity: int):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self.paused_until:
+                    await asyncio.sleep(self.paused_until - now)
+                    continue
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+    def pause(self, seconds: float):
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+        # Le seau repart vide après la pause : pas de rafale immédiate à la reprise
+        self.tokens = 0
+
+class EnrichmentMetrics:
+    """Compteurs exposés par /spotify/status/enrichment (par processus)."""
+    def __init__(self):
+        self.requests = 0
+        self.rate_limited = 0
+        self.errors = 0
+        self.items = 0
+        self.batches = 0
+        self.history_linked = 0
+        self.busy_seconds = 0.0
+        self._run_started: Optional[float] = None
+
+    def start_run(self):
+        self._run_started = time.monotonic()
+
+    def end_run(self):
+        if self._run_started is not None: self.busy_seconds += time.monotonic() - self._run_started
+        self._run_started = None
+
+    def snapshot(self, queued: int = 0) -> dict:
+        busy = self.busy_seconds + (time.monotonic() - self._run_started if self._run_started is not None else 0)
+        return {
+            "running": self._run_started is not None,
+            "queued": queued,
+            "items": self.items,
+            "batches": self.batches,
+            "history_linked": self.history_linked,
+            "requests": self.requests,
+            "rate_limited": self.rate_limited,
+            "errors": self.errors,
+            # Débit sur le temps d'activité du worker et part des requêtes refusées (429)
+            "items_per_second": round(self.items / busy, 2) if busy else None,
+            "rate_limited_ratio": round(self.rate_limited / self.requests, 4) if self.requests else None
+        }
+
+enrichment_metrics = EnrichmentMetrics()
+
+class SpotifyAppClient:
+    """Appels Spotify "server-to-server" (client credentials) via httpx, jeton renouvelé à l'expiration."""
+    def __init__(self, bucket: TokenBucket, metrics: EnrichmentMetrics = enrichment_metrics, transport: Optional[httpx.AsyncBaseTransport] = None):
+        self.bucket = bucket
+        self.metrics = metrics
+        self._client = httpx.AsyncClient(timeout=30, transport=transport)
+        self._token: Optional[str] = None
+        self._token_expires = 0.0
+        self._token_lock = asyncio.Lock()
+
+    async def _access_token(self) -> str:
+        async with self._token_lock:
+            if self._token is None or time.monotonic() > self._token_expires:
+                response = await self._client.post(
+                    SPOTIFY_TOKEN_URL, data={"grant_type": "client_credentials"},
+                    auth=(os.getenv("SPOTIFY_CLIENT_ID") or "", os.getenv("SPOTIFY_CLIENT_SECRET") or "")
+                )
+                if response.is_error: raise SpotifyUnavailable(f"Jeton Spotify refusé ({response.status_code})")
+                payload = response.json()
+                self._token = payload["access_token"]
+                self._token_expires = time.monotonic() + payload.get("expires_in", 3600) - 60
+            return self._token
+
+    async def get(self, path: str, params: Optional[Dict[str, str]] = None) -> dict:
+        attempt = 0
+        deadline = time.monotonic() + RATE_LIMIT_MAX_WAIT
+        while attempt < MAX_ATTEMPTS:
+            await self.bucket.acquire()
+            try:
+                headers = {"Authorization": f"Bearer {await self._access_token()}"}
+                response = await self._client.get(f"{SPOTIFY_API_URL}{path}", params=params, headers=headers)
+            except httpx.TransportError as e:
+                self.metrics.errors += 1
+                print(f"⚠️ Spotify injoignable ({e!r}), nouvel essai")
+                await asyncio.sleep(2 ** attempt)
+                attempt += 1
+                continue
+            self.metrics.requests += 1
+
+            if response.status_code == 429:
+                # Toutes les requêtes (en vol ou à venir) attendent le délai demandé par Spotify
+                seconds = int(response.headers.get("Retry-After", 1))
+                self.metrics.rate_limited += 1
+                self.bucket.pause(seconds)
+                spotify_status.set_rate_limited(seconds)
+                print(f"⚠️ Rate Limit atteint. Pause de {seconds}s")
+                # Pas une tentative : on attend Spotify tant que le délai cumulé reste raisonnable
+                if time.monotonic() + seconds > deadline: raise SpotifyUnavailable(f"Spotify {path} : limite de débit au-delà de {RATE_LIMIT_MAX_WAIT}s")
+                continue
+            if response.status_code == 401:
+                self._token = None
+                attempt += 1
+                continue
+            if response.status_code >= 500:
+                self.metrics.errors += 1
+                await asyncio.sleep(2 ** attempt)
+                attempt += 1
+                continue
+            response.raise_for_status()
+            return response.json()
+        raise SpotifyUnavailable(f"Spotify {path} : échec après {MAX_ATTEMPTS} tentatives")
+
+    async def tracks(self, ids: List[str]) -> List[Optional[dict]]:
+        return (await self.get("/tracks", {"ids": ",".join(ids)}))["tracks"]
+
+    async def artists(self, ids: List[str]) -> List[Optional[dict]]:
+        return (await self.get("/artists", {"ids": ",".join(ids)}))["artists"]
+
+    async def aclose(self):
+        await self._client.aclose()
@@ -1,20 +1,50 @@
+import asyncio
 import base64
 from datetime import datetime, timedelta
 import os
 import httpx
+from sqlalchemy import text
 from sqlmodel import Session
+from app.database import engine
 from app.models import User
 
 CLIENT_ID = os.getenv("SPOTIFY_CLIENT_ID")
 CLIENT_SECRET = os.getenv("SPOTIFY_CLIENT_SECRET")
 
-async def get_valid_access_token(user: User, db: Session):
+def token_expired(user: User) -> bool:
     # Si le token expire dans moins de 60 secondes, on rafraîchit
-    if not user.expires_at or datetime.now() >= (user.expires_at - timedelta(seconds=60)):
-        return await refresh_spotify_token(user, db, CLIENT_ID, CLIENT_SECRET)
+    return not user.expires_at or datetime.now() >= (user.expires_at - timedelta(seconds=60))
+
+async def get_valid_access_token(user: User, db: Session):
+    if token_expired(user): return await refresh_spotify_token(user, db, CLIENT_ID, CLIENT_SECRET)
+    return user.access_token
+
+async def get_detached_access_token(user: User) -> str:
+    """
+    Variante des tâches de fond, pour un utilisateur détaché de sa session : aucune connexion
+    n'est retenue pendant l'appel à Spotify, le nouveau jeton est enregistré ensuite dans un thread.
+    """
+    if token_expired(user):
+        await request_token_refresh(user, CLIENT_ID, CLIENT_SECRET)
+        await asyncio.to_thread(save_user_token, user)
     return user.access_token
 
+def save_user_token(user: User):
+    with Session(engine) as db:
+        db.execute(text('UPDATE "user" SET access_token = :access_token, expires_at = :expires_at, refresh_token = :refresh_token WHERE id = :id'), {
+            "access_token": user.access_token, "expires_at": user.expires_at, "refresh_token": user.refresh_token, "id": user.id
+        })
+        db.commit()
+
 async def refresh_spotify_token(user: User, db: Session, client_id: str, client_secret: str):
+    await request_token_refresh(user, client_id, client_secret)
+    db.add(user)
+    db.commit()
+    db.refresh(user)
+    return user.access_token
+
+async def request_token_refresh(user: User, client_id: str, client_secret: str):
+    """Demande un nouveau jeton à Spotify et le reporte sur `user` (sans l'enregistrer)."""
     # 1. Préparer l'encodage Basic Auth pour Spotify
     auth_header = base64.b64encode(f"{client_id}:{client_secret}".encode()).decode()
     
@@ -42,11 +72,6 @@ async def refresh_spotify_token(user: User, db: Session, client_id: str, client_
         # Note: Spotify peut parfois renvoyer un NOUVEAU refresh_token aussi
         if "refresh_token" in data:
             user.refresh_token = data["refresh_token"]
-            
-        db.add(user)
-        db.commit()
-        db.refresh(user)
-        return user.access_token
     else:
         # Si le refresh_token est révoqué par l'utilisateur
         raise Exception("Impossible de rafraîchir le token Spotify")
\ No newline at end of file
@@ -0,0 +1,70 @@
+import csv
+import io
+from typing import Iterable, List, Optional, Sequence
+from sqlalchemy import text
+from sqlmodel import Session
+
+# Marqueur NULL du COPY (en CSV, une chaîne vide non quotée serait ambiguë)
+_NULL = "\\N"
+# Nombre de lignes sérialisées dans le buffer mémoire avant chaque envoi au serveur
+COPY_CHUNK_ROWS = 100_000
+
+def copy_rows(db: Session, table: str, columns: Sequence[str], rows: Iterable[Sequence]) -> int:
+    """
+    Charge des lignes dans `table` via `COPY ... FROM STDIN` (un seul aller-retour par paquet
+    de `COPY_CHUNK_ROWS` lignes au lieu d'un `executemany`).
+    S'exécute dans la transaction courante de la session. Retourne le nombre de lignes envoyées.
+    """
+    cursor = db.connection().connection.cursor()
+    statement = f"COPY {table} ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv, NULL '{_NULL}')"
+    total = 0
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator="\n")
+    pending = 0
+    try:
+        for row in rows:
+            writer.writerow([_NULL if value is None else value for value in row])
+            pending += 1
+            if pending >= COPY_CHUNK_ROWS:
+                total += _flush(cursor, statement, buffer)
+                pending = 0
+        if pending: total += _flush(cursor, statement, buffer)
+    finally: cursor.close()
+    return total
+
+def _flush(cursor, statement: str, buffer: io.StringIO) -> int:
+    buffer.seek(0)
+    cursor.copy_expert(statement, buffer)
+    count = cursor.rowcount
+    buffer.seek(0)
+    buffer.truncate()
+    return count
+
+def copy_upsert(
+    db: Session,
+    table: str,
+    columns: Sequence[str],
+    rows: Iterable[Sequence],
+    conflict_columns: Sequence[str],
+    update_columns: Optional[Sequence[str]] = None,
+    returning: Optional[str] = None,
+) -> List:
+    """
+    `COPY` dans une table temporaire de même structure, puis `INSERT ... SELECT ... ON CONFLICT`.
+    Sans `update_columns`, les lignes déjà présentes sont ignorées (`DO NOTHING`).
+    Retourne la colonne `returning` des lignes écrites (ou une liste vide).
+    """
+    tmp = f"copy_{table}"
+    cols = ", ".join(columns)
+    db.execute(text(f"DROP TABLE IF EXISTS {tmp}"))
+    db.execute(text(f"CREATE TEMP TABLE {tmp} ON COMMIT DROP AS SELECT {cols} FROM {table} WITH NO DATA"))
+    if not copy_rows(db, tmp, columns, rows): return []
+
+    if update_columns: action = "DO UPDATE SET " + ", ".join(f"{c} = EXCLUDED.{c}" for c in update_columns)
+    else: action = "DO NOTHING"
+    # DISTINCT ON : un même conflit ne peut pas être mis à jour deux fois dans une seule instruction
+    keys = ", ".join(conflict_columns)
+    statement = f"INSERT INTO {table} ({cols}) SELECT DISTINCT ON ({keys}) {cols} FROM {tmp} ON CONFLICT ({keys}) {action}"
+    if returning: return db.execute(text(f"{statement} RETURNING {returning}")).scalars().all()
+    db.execute(text(statement))
+    return []
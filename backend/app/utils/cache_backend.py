@@ -0,0 +1,194 @@
+import asyncio
+import hashlib
+import os
+import time
+from contextvars import ContextVar
+from functools import wraps
+from typing import Any, Callable, Dict, Optional, Tuple
+from fastapi import Request, Response
+from fastapi_cache import FastAPICache
+from fastapi_cache.backends.inmemory import InMemoryBackend
+from fastapi_cache.decorator import cache as fastapi_cache
+from fastapi_cache.types import Backend
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+# Backend du cache des endpoints `@cache` :
+# - redis://host:6379/0 : cache partagé entre tous les workers uvicorn et conservé au redémarrage
+# - memory://           : cache local au processus (développement, tests)
+# - none://             : cache désactivé, chaque requête est calculée (tests de charge de la base)
+CACHE_BACKEND_URL = os.getenv("CACHE_BACKEND_URL", "memory://")
+CACHE_ENABLED = not CACHE_BACKEND_URL.startswith("none://")
+# Durée maximale d'un calcul : au-delà, les requêtes en attente calculent elles-mêmes
+COMPUTE_TIMEOUT = 30
+REMOTE_POLL_INTERVAL = 0.05
+LOCK_PREFIX = "lock:"
+# Paramètres injectés qui ne font pas partie de la clé (un objet différent à chaque requête)
+UNKEYED_TYPES = (Session, AsyncSession, Request, Response)
+
+# Clé calculée par la requête courante (posée par `_coalesce`, libérée par `set` ou `abandon`)
+_computing: ContextVar[Optional[str]] = ContextVar("cache_computing", default=None)
+
+class CacheMetrics:
+    """Compteurs exposés par /spotify/status/cache (par processus)."""
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        # Requêtes servies par le calcul d'une autre requête (même processus ou autre worker)
+        self.coalesced = 0
+        self.errors = 0
+        self.get_count = 0
+        self.get_total_ms = 0.0
+        self.get_max_ms = 0.0
+
+    def record_get(self, elapsed_ms: float):
+        self.get_count += 1
+        self.get_total_ms += elapsed_ms
+        self.get_max_ms = max(self.get_max_ms, elapsed_ms)
+
+    def snapshot(self) -> dict:
+        lookups = self.hits + self.misses + self.coalesced
+        return {
+            "backend": CACHE_BACKEND_URL.split("://")[0],
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "errors": self.errors,
+            # Part des requêtes servies sans calcul (cache ou calcul partagé)
+            "hit_ratio": round((self.hits + self.coalesced) / lookups, 4) if lookups else None,
+            "get_avg_ms": round(self.get_total_ms / self.get_count, 3) if self.get_count else None,
+            "get_max_ms": round(self.get_max_ms, 3)
+        }
+
+cache_metrics = CacheMetrics()
+
+class CoalescingBackend(Backend):
+    """
+    Enveloppe un backend fastapi-cache pour qu'un cache manquant ne soit calculé qu'une fois :
+    la première requête calcule (le décorateur appelle ensuite `set`), les requêtes concurrentes
+    sur la même clé attendent ce résultat au lieu de relancer la même agrégation.
+    - Dans un processus : un Future par clé en cours de calcul.
+    - Entre processus (Redis) : un verrou `SET NX` avec expiration ; les autres workers scrutent la clé.
+    """
+    def __init__(self, backend: Backend, redis=None):
+        self.backend = backend
+        self.redis = redis
+        self._inflight: Dict[str, Tuple[asyncio.Future, float]] = {}
+
+    async def get_with_ttl(self, key: str) -> Tuple[int, Optional[bytes]]:
+        start = time.perf_counter()
+        try:
+            ttl, value = await self.backend.get_with_ttl(key)
+            if value is None: ttl, value = await self._coalesce(key)
+            else: cache_metrics.hits += 1
+            return ttl, value
+        except Exception:
+            cache_metrics.errors += 1
+            raise
+        finally: cache_metrics.record_get((time.perf_counter() - start) * 1000)
+
+    async def _coalesce(self, key: str) -> Tuple[int, Optional[bytes]]:
+        # 1. Calcul déjà en cours dans ce processus
+        inflight = self._inflight.get(key)
+        if inflight and inflight[1] > time.monotonic():
+            try:
+                result = await asyncio.wait_for(asyncio.shield(inflight[0]), inflight[1] - time.monotonic())
+                # Sans résultat, le calcul a été abandonné (erreur) : cette requête prend le relais
+                if result[1] is not None:
+                    cache_metrics.coalesced += 1
+                    return result
+            except asyncio.TimeoutError: pass
+
+        # 2. Calcul en cours dans un autre worker (verrou Redis détenu par quelqu'un d'autre)
+        if self.redis is not None and not await self.redis.set(LOCK_PREFIX + key, b"1", nx=True, ex=COMPUTE_TIMEOUT):
+            result = await self._wait_remote(key)
+            if result[1] is not None:
+                cache_metrics.coalesced += 1
+                return result
+
+        # 3. Cette requête calcule : les suivantes attendront son `set`
+        cache_metrics.misses += 1
+        self._inflight[key] = (asyncio.get_running_loop().create_future(), time.monotonic() + COMPUTE_TIMEOUT)
+        _computing.set(key)
+        return 0, None
+
+    async def _wait_remote(self, key: str) -> Tuple[int, Optional[bytes]]:
+        deadline = time.monotonic() + COMPUTE_TIMEOUT
+        while time.monotonic() < deadline:
+            await asyncio.sleep(REMOTE_POLL_INTERVAL)
+            ttl, value = await self.backend.get_with_ttl(key)
+            if value is not None: return ttl, value
+            # Verrou expiré ou libéré sans résultat (calcul en erreur) : on arrête d'attendre
+            if not await self.redis.exists(LOCK_PREFIX + key): break
+        return 0, None
+
+    async def get(self, key: str) -> Optional[bytes]:
+        return await self.backend.get(key)
+
+    async def set(self, key: str, value: bytes, expire: Optional[int] = None) -> None:
+        try: await self.backend.set(key, value, expire)
+        finally:
+            if _computing.get() == key: _computing.set(None)
+            inflight = self._inflight.pop(key, None)
+            if inflight and not inflight[0].done(): inflight[0].set_result((expire or 0, value))
+            if self.redis is not None: await self.redis.delete(LOCK_PREFIX + key)
+
+    async def abandon(self, key: str) -> None:
+        """Calcul en échec : les requêtes en attente sur `key` sont libérées et calculent elles-mêmes."""
+        if _computing.get() == key: _computing.set(None)
+        inflight = self._inflight.pop(key, None)
+        if inflight and not inflight[0].done(): inflight[0].set_result((0, None))
+        if self.redis is not None: await self.redis.delete(LOCK_PREFIX + key)
+
+    async def clear(self, namespace: Optional[str] = None, key: Optional[str] = None) -> int:
+        return await self.backend.clear(namespace, key)
+
+def create_cache_backend(url: str = CACHE_BACKEND_URL) -> Backend:
+    if url.startswith(("redis://", "rediss://")):
+        # Dépendance optionnelle : seulement nécessaire avec un cache Redis
+        from redis import asyncio as aioredis
+        from fastapi_cache.backends.redis import RedisBackend
+        client = aioredis.from_url(url)
+        print(f"🗄️ Cache partagé Redis : {url.split('@')[-1]}")
+        return CoalescingBackend(RedisBackend(client), redis=client)
+    # Cache désactivé : le backend reste défini (métriques) mais n'est ni lu ni écrit (FastAPICache.init(enable=False))
+    if url.startswith(("memory://", "none://")): return CoalescingBackend(InMemoryBackend())
+    raise ValueError(f"CACHE_BACKEND_URL non supportée : {url}")
+
+def cache_key_builder(
+    func: Callable[..., Any], namespace: str = "", *,
+    request: Optional[Request] = None, response: Optional[Response] = None,
+    args: Tuple[Any, ...] = (), kwargs: Optional[Dict[str, Any]] = None
+) -> str:
+    """
+    Clé d'un endpoint `@cache` : module, fonction et paramètres de la requête.
+    Le builder par défaut y inclut la session SQL injectée (repr différente à chaque requête) :
+    les clés ne se répétaient jamais.
+    """
+    params = [a for a in args if not isinstance(a, UNKEYED_TYPES)]
+    params += sorted((k, v) for k, v in (kwargs or {}).items() if not isinstance(v, UNKEYED_TYPES))
+    digest = hashlib.md5(f"{func.__module__}:{func.__name__}:{params}".encode()).hexdigest()
+    return f"{namespace}:{digest}"
+
+def cache(expire: Optional[int] = None, **options):
+    """
+    `fastapi_cache.decorator.cache`, dont les calculs en échec (exception, annulation) libèrent
+    aussitôt les requêtes qui attendent la même clé (`CoalescingBackend.abandon`).
+    """
+    def decorator(func):
+        cached = fastapi_cache(expire=expire, **options)(func)
+
+        @wraps(cached)
+        async def inner(*args, **kwargs):
+            token = _computing.set(None)
+            try: return await cached(*args, **kwargs)
+            except BaseException:
+                key, backend = _computing.get(), FastAPICache.get_backend()
+                if key and hasattr(backend, "abandon"): await backend.abandon(key)
+                raise
+            finally: _computing.reset(token)
+
+        # Accès à l'endpoint sans cache (benchmarks), comme avec le décorateur d'origine
+        inner.__wrapped__ = func
+        return inner
+    return decorator
@@ -0,0 +1,36 @@
+from datetime import date, datetime, timedelta
+from typing import List, Optional, Union
+from fastapi import HTTPException
+from sqlalchemy import Date
+
+# Filtres de période "sargables" : la colonne est comparée telle quelle à des bornes calculées
+# en Python (jamais `cast(played_at, Date)` / `date(played_at)`, qui empêchent l'usage des index).
+# - colonne jour (user_track_daily.day) : jour >= début AND jour <= fin
+# - colonne horodatage (trackhistory.played_at) : intervalle semi-ouvert [début 00:00, lendemain de fin 00:00)
+
+DateLike = Union[str, date, datetime, None]
+
+def as_day(value: DateLike) -> Optional[date]:
+    """'YYYY-MM-DD' (ou ISO complet), date ou datetime -> date ; None si absent."""
+    if value is None or value == "": return None
+    if isinstance(value, datetime): return value.date()
+    if isinstance(value, date): return value
+    try: return date.fromisoformat(value[:10])
+    except ValueError: raise HTTPException(status_code=400, detail=f"Date invalide : {value}")
+
+def period_filters(column, start: DateLike = None, end: DateLike = None, end_inclusive: bool = True) -> List:
+    """
+    Conditions de période sur `column` (jour ou horodatage), utilisables par les index.
+    Les bornes sont des jours : `end` est inclus (filtres utilisateur) ou exclu (`end_inclusive=False`,
+    périodes calculées [début, fin) comme les mois ou années du résumé).
+    """
+    start_day, end_day = as_day(start), as_day(end)
+    if end_day is not None and end_inclusive: end_day += timedelta(days=1)
+    filters = []
+    if isinstance(column.type, Date):
+        if start_day is not None: filters.append(column >= start_day)
+        if end_day is not None: filters.append(column < end_day)
+    else:
+        if start_day is not None: filters.append(column >= datetime.combine(start_day, datetime.min.time()))
+        if end_day is not None: filters.append(column < datetime.combine(end_day, datetime.min.time()))
+    return filters
@@ -0,0 +1,99 @@
+from typing import Dict, Iterable, List
+from sqlalchemy import text
+from sqlmodel import Session
+
+# File d'enrichissement persistante (table enrichment_queue) :
+# - les ajouts sont idempotents (une ligne par entité) et faits dans la transaction qui crée l'entité :
+#   un ID validé en base est forcément en file, même si le processus s'arrête juste après ;
+# - chaque ajout émet un NOTIFY (délivré au commit) qui réveille le worker, quel que soit son processus ;
+# - un seul worker consomme la file à la fois (verrou consultatif ENRICHMENT_LOCK_KEY, cf. SpotifyWorker),
+#   il réclame ses lots avec SKIP LOCKED et les passe à "done" dans la transaction qui écrit les métadonnées.
+ENRICHMENT_CHANNEL = "enrichment_queue"
+ENRICHMENT_LOCK_KEY = 4_200_012
+# Au-delà, un élément dont les appels échouent reste en "failed" (un nouvel ajout le remet en file) ;
+# les indisponibilités de Spotify (429, réseau, 5xx) ne comptent pas comme des tentatives
+MAX_ATTEMPTS = 3
+
+_NOW = "(now() AT TIME ZONE 'utc')"
+
+# Remplissage initial pour les bases existantes : pistes jamais reliées à leur album, artistes sans image
+ENRICHMENT_BACKFILL = f"""
+DO $$ BEGIN
+    IF NOT EXISTS (SELECT 1 FROM enrichment_queue) THEN
+        INSERT INTO enrichment_queue (entity_type, entity_id, status, attempts, created_at, updated_at)
+        SELECT 'track', spotify_id, 'pending', 0, {_NOW}, {_NOW} FROM track WHERE album_id IS NULL
+        UNION ALL
+        SELECT 'artist', spotify_id, 'pending', 0, {_NOW}, {_NOW} FROM artist WHERE image_url IS NULL;
+    END IF;
+END $$;
+"""
+
+def enqueue_enrichment(db: Session, entity_type: str, ids: Iterable[str]):
+    """Ajoute des entités à enrichir (sans effet si déjà en file ou traitées ; les échecs sont retentés)."""
+    ids = sorted(set(ids))
+    if not ids: return
+    db.execute(text(f"""
+        INSERT INTO enrichment_queue (entity_type, entity_id, status, attempts, created_at, updated_at)
+        SELECT :kind, id, 'pending', 0, {_NOW}, {_NOW} FROM unnest(CAST(:ids AS varchar[])) AS id
+        ON CONFLICT (entity_type, entity_id) DO UPDATE SET status = 'pending', attempts = 0, error = NULL, updated_at = {_NOW}
+        WHERE enrichment_queue.status = 'failed'
+    """), {"kind": entity_type, "ids": ids})
+    db.execute(text("SELECT pg_notify(:channel, :kind)"), {"channel": ENRICHMENT_CHANNEL, "kind": entity_type})
+
+def claim_batch(db: Session, entity_type: str, size: int) -> List[str]:
+    """Réclame jusqu'à `size` entités en attente (les plus anciennes) et valide la réclamation."""
+    ids = db.execute(text(f"""
+        UPDATE enrichment_queue q SET status = 'claimed', attempts = q.attempts + 1, updated_at = {_NOW}
+        FROM (
+            SELECT entity_type, entity_id FROM enrichment_queue
+            WHERE status = 'pending' AND entity_type = :kind
+            ORDER BY created_at
+            LIMIT :size
+            FOR UPDATE SKIP LOCKED
+        ) c
+        WHERE q.entity_type = c.entity_type AND q.entity_id = c.entity_id
+        RETURNING q.entity_id
+    """), {"kind": entity_type, "size": size}).scalars().all()
+    db.commit()
+    return ids
+
+def complete_batch(db: Session, entity_type: str, done: List[str], missing: List[str]):
+    """Lot écrit (même transaction que les métadonnées) ; `missing` : IDs inconnus de Spotify."""
+    params = {"kind": entity_type, "done": list(done), "missing": list(missing)}
+    db.execute(text(f"""
+        UPDATE enrichment_queue SET status = 'done', error = NULL, updated_at = {_NOW}
+        WHERE entity_type = :kind AND entity_id = ANY(:done)
+    """), params)
+    db.execute(text(f"""
+        UPDATE enrichment_queue SET status = 'failed', error = 'Introuvable sur Spotify', updated_at = {_NOW}
+        WHERE entity_type = :kind AND entity_id = ANY(:missing)
+    """), params)
+
+def release_batch(db: Session, entity_type: str, ids: List[str], error: str, retry: bool = False):
+    """
+    Appel en échec : les entités repassent en attente, ou en échec après MAX_ATTEMPTS tentatives.
+    `retry` : échec indépendant des entités (Spotify indisponible), elles repassent en attente sans que
+    la tentative compte.
+    """
+    db.execute(text(f"""
+        UPDATE enrichment_queue
+        SET status = CASE WHEN NOT :retry AND attempts >= :max_attempts THEN 'failed' ELSE 'pending' END,
+            attempts = CASE WHEN :retry THEN greatest(attempts - 1, 0) ELSE attempts END,
+            error = :error, updated_at = {_NOW}
+        WHERE entity_type = :kind AND entity_id = ANY(:ids) AND status = 'claimed'
+    """), {"kind": entity_type, "ids": list(ids), "error": error[:500], "max_attempts": MAX_ATTEMPTS, "retry": retry})
+    db.commit()
+
+def release_orphan_claims(db: Session) -> int:
+    """À la prise du verrou : les réclamations restantes viennent d'un worker arrêté en plein lot."""
+    count = db.execute(text(f"UPDATE enrichment_queue SET status = 'pending', updated_at = {_NOW} WHERE status = 'claimed'")).rowcount
+    db.commit()
+    return count
+
+def queue_counts(db: Session) -> Dict[str, Dict[str, int]]:
+    """{type: {statut: nombre}}"""
+    counts: Dict[str, Dict[str, int]] = {}
+    for kind, status, count in db.execute(text(
+        "SELECT entity_type, status, count(*) FROM enrichment_queue GROUP BY 1, 2"
+    )).all(): counts.setdefault(kind, {})[status] = count
+    return counts
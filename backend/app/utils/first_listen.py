@@ -0,0 +1,85 @@
+from datetime import date
+from typing import Iterable, List, Optional
+from sqlalchemy import text
+from sqlmodel import Session
+
+# Maintenance de first_listen : le jour de première écoute d'une entité est le plus petit jour
+# où elle apparaît dans user_track_daily. Les écritures de l'historique passant toutes par
+# l'agrégat quotidien, on n'a qu'à rapprocher les jours qu'elles touchent des valeurs connues.
+
+# Colonne de user_track_daily de chaque type d'entité
+ENTITY_COLUMNS = {"track": "spotify_id", "album": "album_id", "artist": "artist_id"}
+
+def _first_days(where: str, kinds=tuple(ENTITY_COLUMNS)) -> str:
+    """(user_id, entity_type, entity_id, min(jour)) des lignes de l'agrégat retenues par `where`."""
+    return " UNION ALL ".join(f"""
+        SELECT user_id, '{kind}', {ENTITY_COLUMNS[kind]}, min(day) FROM user_track_daily
+        WHERE {ENTITY_COLUMNS[kind]} IS NOT NULL AND {where}
+        GROUP BY user_id, {ENTITY_COLUMNS[kind]}
+    """ for kind in kinds)
+
+# Conserve le jour le plus ancien (une écoute importée peut précéder celles déjà connues)
+_UPSERT = """
+    INSERT INTO first_listen (user_id, entity_type, entity_id, first_day) {rows}
+    ON CONFLICT (user_id, entity_type, entity_id) DO UPDATE SET first_day = EXCLUDED.first_day
+    WHERE EXCLUDED.first_day < first_listen.first_day
+"""
+
+# Identifiant de l'entité `f` sur une ligne `r` de l'agrégat
+_ENTITY_OF_ROW = "CASE f.entity_type " + " ".join(
+    f"WHEN '{kind}' THEN r.{column}" for kind, column in ENTITY_COLUMNS.items()
+) + " END"
+
+# Remplissage initial pour les bases existantes (table vide alors que l'agrégat ne l'est pas)
+FIRST_LISTEN_BACKFILL = f"""
+DO $$ BEGIN
+    IF NOT EXISTS (SELECT 1 FROM first_listen) AND EXISTS (SELECT 1 FROM user_track_daily) THEN
+        {_UPSERT.format(rows=_first_days("true"))};
+    END IF;
+END $$;
+"""
+
+def record_first_listens(db: Session, user_id: int, days: Iterable[date]):
+    """
+    Met à jour les premières écoutes de l'utilisateur après le recalcul de ces jours dans l'agrégat
+    (à appeler après `refresh_rollup_days`, dans la même transaction).
+    """
+    days = sorted(set(days))
+    if not days: return
+    params = {"user_id": user_id, "days": days}
+    # Entités dont le premier jour a perdu toutes ses écoutes (remplacement d'un import) : on repart de l'agrégat
+    db.execute(text(f"""
+        WITH stale AS (
+            DELETE FROM first_listen f
+            WHERE f.user_id = :user_id AND f.first_day = ANY(:days)
+              AND NOT EXISTS (
+                  SELECT 1 FROM user_track_daily r
+                  WHERE r.user_id = f.user_id AND r.day = f.first_day AND {_ENTITY_OF_ROW} = f.entity_id
+              )
+            RETURNING f.entity_type, f.entity_id
+        )
+        INSERT INTO first_listen (user_id, entity_type, entity_id, first_day)
+        SELECT :user_id, f.entity_type, f.entity_id, min(r.day)
+        FROM stale f
+        JOIN user_track_daily r ON r.user_id = :user_id AND {_ENTITY_OF_ROW} = f.entity_id
+        GROUP BY f.entity_type, f.entity_id
+    """), params)
+    db.execute(text(_UPSERT.format(rows=_first_days("user_id = :user_id AND day = ANY(:days)"))), params)
+
+def sync_first_listen_tracks(db: Session, track_ids: List[str]):
+    """Albums et artistes des pistes enrichies (après `sync_rollup_tracks`) : premières écoutes connues désormais."""
+    if not track_ids: return
+    rows = _first_days("spotify_id = ANY(:ids)", kinds=("album", "artist"))
+    db.execute(text(_UPSERT.format(rows=rows)), {"ids": list(track_ids)})
+
+def clear_first_listens(db: Session, user_id: int):
+    db.execute(text("DELETE FROM first_listen WHERE user_id = :user_id"), {"user_id": user_id})
+
+def rebuild_first_listens(db: Session, user_id: Optional[int] = None):
+    """Reconstruit entièrement la table (d'un utilisateur ou de tous) depuis l'agrégat quotidien."""
+    if user_id is None:
+        db.execute(text("TRUNCATE first_listen"))
+        db.execute(text(_UPSERT.format(rows=_first_days("true"))))
+    else:
+        clear_first_listens(db, user_id)
+        db.execute(text(_UPSERT.format(rows=_first_days("user_id = :user_id"))), {"user_id": user_id})
@@ -0,0 +1,73 @@
+from typing import Callable, Dict, List, Optional
+from sqlalchemy import text
+from sqlmodel import Session
+
+# Liens artiste / album des écoutes (trackhistory.artist_id, album_id) :
+# - une écoute est insérée avec les liens de sa piste quand ses métadonnées sont connues,
+#   sinon sans lien : elle est reliée quand le worker enrichit la piste (même transaction que le lot) ;
+# - seules les écoutes sans lien sont indexées (ix_trackhistory_unlinked, par piste) : les retrouver
+#   ne demande ni parcours de l'historique ni boucle jusqu'à épuisement ;
+# - `repair_history_links` rattrape les écoutes dont la piste est déjà enrichie (bases existantes, fin d'import).
+
+# Prédicat de l'index partiel, sur l'alias `h` de trackhistory (les requêtes doivent le reprendre pour l'utiliser)
+UNLINKED = "(h.artist_id IS NULL OR h.album_id IS NULL)"
+UNLINKED_INDEX = "CREATE INDEX IF NOT EXISTS ix_trackhistory_unlinked ON trackhistory (spotify_id) WHERE artist_id IS NULL OR album_id IS NULL"
+# Piste dont les métadonnées sont connues (alias `t`)
+ENRICHED = "t.artist_id IS NOT NULL AND t.album_id IS NOT NULL"
+
+# Pistes traitées par transaction lors d'un rattrapage
+REPAIR_CHUNK = 500
+
+# Version SQL (cf. procedures.sql), pour une réparation manuelle depuis psql ;
+# remplace l'ancienne repair_track_history() sans argument, qui bouclait sur toute la table
+LINK_HISTORY_FUNCTION = f"""
+DROP FUNCTION IF EXISTS repair_track_history();
+CREATE OR REPLACE FUNCTION repair_track_history(p_track_ids varchar[]) RETURNS integer AS $$
+DECLARE
+    rows_updated integer;
+BEGIN
+    UPDATE trackhistory h SET artist_id = t.artist_id, album_id = t.album_id
+    FROM track t
+    WHERE h.spotify_id = ANY(p_track_ids) AND {UNLINKED}
+      AND t.spotify_id = h.spotify_id AND {ENRICHED};
+    GET DIAGNOSTICS rows_updated = ROW_COUNT;
+    RETURN rows_updated;
+END $$ LANGUAGE plpgsql;
+"""
+
+def link_history_tracks(db: Session, track_ids: List[str]) -> int:
+    """Relie les écoutes sans lien de ces pistes (dont les métadonnées viennent d'arriver). Retourne le nombre d'écoutes."""
+    if not track_ids: return 0
+    return db.execute(text("SELECT repair_track_history(CAST(:ids AS varchar[]))"), {"ids": list(track_ids)}).scalar()
+
+def unlinked_track_ids(db: Session) -> List[str]:
+    """Pistes déjà enrichies ayant encore des écoutes sans lien (parcours de l'index partiel)."""
+    return db.execute(text(f"""
+        SELECT t.spotify_id
+        FROM (SELECT DISTINCT h.spotify_id FROM trackhistory h WHERE {UNLINKED}) u
+        JOIN track t ON t.spotify_id = u.spotify_id
+        WHERE {ENRICHED}
+    """)).scalars().all()
+
+def repair_history_links(db: Session, on_progress: Optional[Callable[[int, int, int], None]] = None) -> int:
+    """
+    Rattrapage : relie, par paquets de REPAIR_CHUNK pistes (une transaction chacun), les écoutes
+    dont la piste est enrichie. Les écoutes de pistes pas encore enrichies sont laissées au worker.
+    `on_progress(pistes traitées, pistes à traiter, écoutes reliées)` est appelé après chaque paquet.
+    """
+    track_ids = unlinked_track_ids(db)
+    linked = 0
+    for start in range(0, len(track_ids), REPAIR_CHUNK):
+        linked += link_history_tracks(db, track_ids[start:start + REPAIR_CHUNK])
+        db.commit()
+        if on_progress: on_progress(min(start + REPAIR_CHUNK, len(track_ids)), len(track_ids), linked)
+    return linked
+
+def unlinked_counts(db: Session) -> Dict[str, int]:
+    """Écoutes sans lien : en attente d'enrichissement de leur piste, ou réparables tout de suite."""
+    repairable, total = db.execute(text(f"""
+        SELECT count(*) FILTER (WHERE {ENRICHED}), count(*)
+        FROM trackhistory h JOIN track t ON t.spotify_id = h.spotify_id
+        WHERE {UNLINKED}
+    """)).one()
+    return {"awaiting_metadata": total - repairable, "repairable": repairable}
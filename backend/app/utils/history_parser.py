@@ -0,0 +1,116 @@
+import datetime
+import os
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from typing import Dict, Iterator, List, Optional, Set, Tuple
+from app.utils.json_stream import iter_json_array
+
+# Ce module est importé par les processus du pool : il ne doit dépendre ni de la base ni de FastAPI.
+
+_EPOCH = datetime.datetime(1970, 1, 1)
+_MS = datetime.timedelta(milliseconds=1)
+# En dessous, une écoute n'est pas comptée (un "skip") : la fusion supprime l'entrée existante correspondante
+MIN_MS_PLAYED = 3000
+
+@dataclass
+class ParsedHistory:
+    """
+    Résultat compact (colonnes) du parsing d'un fichier d'historique étendu.
+    Les IDs de pistes sont internés : `track_index[i]` pointe dans `track_ids` / `titles`.
+    `entries` compte toutes les entrées du fichier (y compris celles écartées : sans piste, date illisible),
+    c'est le total affiché par le job d'import.
+    Les doublons (date, piste) du fichier sont retirés au parsing : la première écoute d'au moins
+    MIN_MS_PLAYED fait foi, et une écoute plus courte n'est gardée (une fois, après les écoutes valides)
+    que si la même (date, piste) n'a aucune écoute valide dans le fichier. La fusion, qui dédoublonne
+    par lot, ne voit donc jamais deux fois la même écoute d'un fichier, ni un "skip" qui en effacerait une valide.
+    Les deux moteurs (`parse_history_file`, `parse_history_file_vectorized`) produisent le même résultat.
+    """
+    played_at_ms: array = field(default_factory=lambda: array("q"))
+    ms_played: array = field(default_factory=lambda: array("q"))
+    track_index: array = field(default_factory=lambda: array("I"))
+    track_ids: List[str] = field(default_factory=list)
+    titles: List[Optional[str]] = field(default_factory=list)
+    entries: int = 0
+    error: Optional[str] = None
+
+    def __len__(self): return len(self.played_at_ms)
+
+    def years(self, start: int, stop: int) -> Set[int]:
+        """Années des écoutes `[start, stop)` (partitions de trackhistory à créer avant leur écriture)."""
+        return {(_EPOCH + ms * _MS).year for ms in set(self.played_at_ms[start:stop])}
+
+    def rows(self, start: int, stop: int) -> Iterator[Tuple]:
+        """Lignes (seq, played_at_ms, spotify_id, ms_played, title) prêtes pour le COPY en staging."""
+        for i in range(start, min(stop, len(self))):
+            idx = self.track_index[i]
+            yield (i, self.played_at_ms[i], self.track_ids[idx], self.ms_played[i], self.titles[idx])
+
+def timestamp_ms(ts) -> Optional[int]:
+    """Date ISO 8601 -> millisecondes epoch UTC (un décalage horaire est converti), None si illisible."""
+    try: dt_obj = datetime.datetime.fromisoformat(ts.replace("Z", "+00:00"))
+    except (AttributeError, TypeError, ValueError): return None
+    if dt_obj.tzinfo is not None: dt_obj = dt_obj.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+    return (dt_obj - _EPOCH) // _MS
+
+def parse_history_file(path: str) -> ParsedHistory:
+    """
+    Parse un fichier JSON d'historique étendu Spotify (exécuté dans un processus du pool).
+    Un fichier malformé en cours de route conserve les entrées lues avant l'erreur.
+    """
+    result = ParsedHistory()
+    interned: Dict[str, int] = {}
+    seen: Set[Tuple[int, int]] = set()
+    # Écoutes trop courtes, ajoutées à la fin si aucune écoute valide ne porte la même clé
+    skipped: Dict[Tuple[int, int], int] = {}
+    try:
+        with open(path, "rb") as f:
+            for entry in iter_json_array(f.read):
+                result.entries += 1
+                if not isinstance(entry, dict): continue
+                uri = entry.get("spotify_track_uri")
+                ts = entry.get("ts")
+                if not uri or not ts: continue
+
+                played_at_ms = timestamp_ms(ts)
+                if played_at_ms is None: continue
+
+                sid = uri.split(":")[-1]
+                idx = interned.get(sid)
+                if idx is None:
+                    idx = interned[sid] = len(result.track_ids)
+                    result.track_ids.append(sid)
+                    result.titles.append(entry.get("master_metadata_track_name"))
+
+                key = (played_at_ms, idx)
+                ms = entry.get("ms_played", 0) or 0
+                if ms < MIN_MS_PLAYED:
+                    skipped.setdefault(key, ms)
+                    continue
+                if key in seen: continue
+                seen.add(key)
+
+                result.played_at_ms.append(played_at_ms)
+                result.ms_played.append(ms)
+                result.track_index.append(idx)
+    except (ValueError, OSError) as e: result.error = str(e)
+    for (played_at_ms, idx), ms in skipped.items():
+        if (played_at_ms, idx) in seen: continue
+        result.played_at_ms.append(played_at_ms)
+        result.ms_played.append(ms)
+        result.track_index.append(idx)
+    return result
+
+_pool: Optional[ProcessPoolExecutor] = None
+
+def get_parser_pool() -> ProcessPoolExecutor:
+    global _pool
+    if _pool is None:
+        _pool = ProcessPoolExecutor(max_workers=int(os.getenv("IMPORT_PARSER_PROCESSES", 0)) or os.cpu_count())
+    return _pool
+
+def shutdown_parser_pool():
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(cancel_futures=True)
+        _pool = None
@@ -0,0 +1,91 @@
+from array import array
+from typing import List, Optional
+import numpy as np
+from app.utils.history_parser import MIN_MS_PLAYED, ParsedHistory, timestamp_ms
+from app.utils.json_stream import iter_json_array
+
+# Moteur d'import alternatif (IMPORT_ENGINE=numpy) : le fichier est chargé en colonnes,
+# puis filtrage, conversion des dates, extraction des IDs et dédoublonnage sont vectorisés.
+
+def load_history_columns(path: str):
+    """Lit le fichier en flux et ne garde que les 4 colonnes utiles (pas de dict par entrée conservé)."""
+    ts, ms, uris, titles = [], [], [], []
+    entries, error = 0, None
+    try:
+        with open(path, "rb") as f:
+            for entry in iter_json_array(f.read):
+                entries += 1
+                if not isinstance(entry, dict): continue
+                ts.append(entry.get("ts") or "")
+                ms.append(entry.get("ms_played", 0) or 0)
+                uris.append(entry.get("spotify_track_uri") or "")
+                titles.append(entry.get("master_metadata_track_name"))
+    except (ValueError, OSError) as e: error = str(e)
+    return ts, ms, uris, titles, entries, error
+
+_NAT = np.iinfo(np.int64).min
+
+def to_epoch_ms(ts: np.ndarray) -> np.ndarray:
+    """
+    ISO 8601 -> millisecondes epoch UTC ; les valeurs illisibles deviennent NaT (-2**63).
+    Les dates en "Z" (format des exports Spotify) sont converties en bloc, les autres
+    (décalage horaire, format inattendu) une par une par `timestamp_ms`, comme le moteur Python.
+    """
+    out = np.full(len(ts), _NAT, dtype=np.int64)
+    utc = np.flatnonzero(np.char.endswith(ts, "Z") & (np.char.find(ts, "T") == 10))
+    try: out[utc] = np.char.replace(ts[utc], "Z", "").astype("datetime64[ms]").astype(np.int64)
+    except ValueError: utc = np.array([], dtype=np.intp)
+    others = np.ones(len(ts), dtype=bool)
+    others[utc] = False
+    for i in np.flatnonzero(others):
+        value = timestamp_ms(str(ts[i]))
+        if value is not None: out[i] = value
+    return out
+
+def normalize_columns(ts: List[str], ms: List[int], uris: List[str], titles: List[Optional[str]]) -> ParsedHistory:
+    if not ts: return ParsedHistory()
+    ts_arr = np.array(ts, dtype=str)
+    uri_arr = np.array(uris, dtype=str)
+    ms_arr = np.array(ms, dtype=np.int64)
+    played_at = to_epoch_ms(ts_arr)
+
+    # 1. Filtrage des entrées sans URI / date valide
+    valid = (np.char.str_len(uri_arr) > 0) & (played_at != _NAT)
+    rows = np.flatnonzero(valid)
+    if rows.size == 0: return ParsedHistory()
+
+    # 2. URI -> ID Spotify, internés dans l'ordre d'apparition (track_index pointe dans track_ids)
+    sids = np.char.rpartition(uri_arr[rows], ":")[:, 2]
+    unique_ids, first_seen, inverse = np.unique(sids, return_index=True, return_inverse=True)
+    order = np.argsort(first_seen)
+    rank = np.empty_like(order)
+    rank[order] = np.arange(len(order))
+    track_index = rank[inverse.ravel()]
+
+    # 3. Dédoublonnage (played_at, piste) dans le fichier, dans l'ordre du fichier : la première écoute valide
+    #    fait foi ; les écoutes < MIN_MS_PLAYED (gardées pour que la fusion supprime l'entrée existante, ex: API)
+    #    viennent ensuite, une par clé, et seulement si la clé n'a aucune écoute valide
+    keys = np.stack([played_at[rows], track_index.astype(np.int64)], axis=1)
+    _, key_id = np.unique(keys, axis=0, return_inverse=True)
+    key_id = key_id.ravel()
+    played = ms_arr[rows] >= MIN_MS_PLAYED
+    valid_rows = np.flatnonzero(played)
+    _, first_valid = np.unique(key_id[valid_rows], return_index=True)
+    skipped_rows = np.flatnonzero(~played & ~np.isin(key_id, key_id[valid_rows]))
+    _, first_skipped = np.unique(key_id[skipped_rows], return_index=True)
+    keep = np.concatenate([np.sort(valid_rows[first_valid]), np.sort(skipped_rows[first_skipped])])
+
+    return ParsedHistory(
+        played_at_ms=array("q", played_at[rows][keep].tobytes()),
+        ms_played=array("q", ms_arr[rows][keep].tobytes()),
+        track_index=array("I", track_index[keep].astype(np.uint32).tobytes()),
+        track_ids=unique_ids[order].tolist(),
+        titles=[titles[i] for i in rows[first_seen[order]]]
+    )
+
+def parse_history_file_vectorized(path: str) -> ParsedHistory:
+    """Équivalent vectorisé de `parse_history_file` (exécuté dans un processus du pool)."""
+    ts, ms, uris, titles, entries, error = load_history_columns(path)
+    result = normalize_columns(ts, ms, uris, titles)
+    result.entries, result.error = entries, error
+    return result
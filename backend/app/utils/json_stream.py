@@ -0,0 +1,70 @@
+import codecs
+import json
+import re
+from typing import Any, Callable, Iterator, List
+
+# Taille des morceaux lus sur le fichier (1 Mo)
+CHUNK_SIZE = 1024 * 1024
+_WHITESPACE = " \t\n\r,"
+_SKIP = re.compile(r"[ \t\n\r,]*")
+
+class JsonArrayParser:
+    """
+    Parseur incrémental d'un tableau JSON de premier niveau (`[ {...}, {...} ]`).
+
+    On lui fournit le fichier morceau par morceau via `feed()`, il renvoie les éléments
+    complets déjà décodés et ne garde en mémoire que le reliquat non terminé.
+    La mémoire utilisée reste donc bornée par la taille d'un morceau + d'un élément.
+    """
+    def __init__(self):
+        # scan_once (implémentation C) évite le coût de raw_decode sur chaque élément
+        self._scan = json.JSONDecoder().scan_once
+        self._utf8 = codecs.getincrementaldecoder("utf-8-sig")()
+        self._buffer = ""
+        self._started = False
+        self._finished = False
+
+    def feed(self, chunk: bytes, final: bool = False) -> List[Any]:
+        self._buffer += self._utf8.decode(chunk, final=final)
+        items, pos, buf = [], 0, self._buffer
+
+        if not self._started:
+            pos = _SKIP.match(buf, pos).end()
+            if pos >= len(buf):
+                self._buffer = ""
+                if final: self._finished = True
+                return items
+            if buf[pos] != "[": raise ValueError("Le fichier n'est pas un tableau JSON")
+            self._started = True
+            pos += 1
+
+        scan, skip, size = self._scan, _SKIP.match, len(buf)
+        while not self._finished:
+            pos = skip(buf, pos).end()
+            if pos >= size: break
+            if buf[pos] == "]":
+                self._finished = True
+                pos += 1
+                break
+            try: obj, end = scan(buf, pos)
+            except (StopIteration, json.JSONDecodeError):
+                # Élément coupé en fin de morceau : on attend la suite
+                if final: raise ValueError(f"JSON invalide à la position {pos}")
+                break
+            # Un nombre/littéral non suivi d'un séparateur peut être tronqué ("1." de "1.5")
+            if not final and buf[pos] not in '{["' and (end >= size or buf[end] not in _WHITESPACE + "]"): break
+            items.append(obj)
+            pos = end
+
+        self._buffer = buf[pos:]
+        if final and not self._finished and self._started:
+            raise ValueError("Tableau JSON tronqué")
+        return items
+
+def iter_json_array(read: Callable[[int], bytes], parser: JsonArrayParser = None, chunk_size: int = CHUNK_SIZE) -> Iterator[Any]:
+    """Itère sur les éléments d'un tableau JSON lu via une fonction `read(size)` synchrone."""
+    parser = parser or JsonArrayParser()
+    while True:
+        chunk = read(chunk_size)
+        yield from parser.feed(chunk, final=not chunk)
+        if not chunk: return
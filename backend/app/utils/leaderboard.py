@@ -0,0 +1,299 @@
+import asyncio
+import os
+import time
+from datetime import datetime, timedelta
+from typing import Optional
+from sqlalchemy import asc, desc, func, literal_column, select, text
+from sqlmodel import Session
+from app.database import engine
+from app.utils.search import contains
+from app.utils.date_range import period_filters
+from app.models import (
+    ALBUM_RATING, ARTIST_RATING, LEADERBOARD_ENGAGEMENT, LEADERBOARD_MINUTES,
+    Album, AlbumLeaderboard, Artist, ArtistLeaderboard, LeaderboardState, UserTrackDaily
+)
+
+# Classements globaux des albums, artistes et morceaux (routes data/all) précalculés dans
+# album_leaderboard / artist_leaderboard / track_leaderboard :
+# - les écritures de user_track_daily journalisent leurs variations dans leaderboard_delta
+#   (même transaction, cf. app.utils.rollup) ;
+# - le constructeur applique ce journal toutes les LEADERBOARD_INTERVAL secondes
+#   et reconstruit tout depuis l'agrégat toutes les LEADERBOARD_FULL_REBUILD_HOURS heures.
+LEADERBOARD_INTERVAL = int(os.getenv("LEADERBOARD_INTERVAL", 300))
+LEADERBOARD_FULL_REBUILD_HOURS = int(os.getenv("LEADERBOARD_FULL_REBUILD_HOURS", 24))
+# Un seul constructeur à la fois entre les workers uvicorn
+LEADERBOARD_LOCK_KEY = 4_200_011
+
+LEADERBOARD_SORTS = ("name", "play_count", "total_minutes", "engagement", "rating")
+
+# Identité (nom, image, artiste de l'album) lue dans album / artist
+_ALBUM_IDENTITY = """
+    SELECT al.spotify_id, al.name, ar.name AS artist_name, al.image_url
+    FROM album al LEFT JOIN artist ar ON ar.spotify_id = al.artist_id
+"""
+_ARTIST_IDENTITY = "SELECT spotify_id, name, image_url FROM artist"
+_TRACK_IDENTITY = """
+    SELECT t.spotify_id, t.title, ar.name AS artist_name, al.name AS album_name, al.image_url, t.duration_ms
+    FROM track t LEFT JOIN album al ON al.spotify_id = t.album_id LEFT JOIN artist ar ON ar.spotify_id = t.artist_id
+"""
+
+_FULL_BUILD = {
+    "album_leaderboard": f"""
+        INSERT INTO album_leaderboard (spotify_id, name, artist_name, image_url, play_count, ms_played, potential_ms)
+        SELECT r.album_id, i.name, i.artist_name, i.image_url, sum(r.streams), sum(r.ms_played), sum(r.potential_ms)
+        FROM user_track_daily r
+        LEFT JOIN ({_ALBUM_IDENTITY}) i ON i.spotify_id = r.album_id
+        WHERE r.album_id IS NOT NULL
+        GROUP BY r.album_id, i.name, i.artist_name, i.image_url
+        HAVING sum(r.streams) > 0
+    """,
+    "artist_leaderboard": f"""
+        INSERT INTO artist_leaderboard (spotify_id, name, image_url, play_count, ms_played, potential_ms)
+        SELECT r.artist_id, i.name, i.image_url, sum(r.streams), sum(r.ms_played), sum(r.potential_ms)
+        FROM user_track_daily r
+        LEFT JOIN ({_ARTIST_IDENTITY}) i ON i.spotify_id = r.artist_id
+        WHERE r.artist_id IS NOT NULL
+        GROUP BY r.artist_id, i.name, i.image_url
+        HAVING sum(r.streams) > 0
+    """,
+    "track_leaderboard": f"""
+        INSERT INTO track_leaderboard (spotify_id, title, artist_name, album_name, image_url, duration_ms, play_count, ms_played, potential_ms)
+        SELECT r.spotify_id, i.title, i.artist_name, i.album_name, i.image_url, i.duration_ms,
+               sum(r.streams), sum(r.ms_played), sum(r.potential_ms)
+        FROM user_track_daily r
+        LEFT JOIN ({_TRACK_IDENTITY}) i ON i.spotify_id = r.spotify_id
+        GROUP BY r.spotify_id, i.title, i.artist_name, i.album_name, i.image_url, i.duration_ms
+        HAVING sum(r.streams) > 0
+    """,
+}
+
+_APPLY_DELTAS = f"""
+    WITH consumed AS (
+        DELETE FROM leaderboard_delta RETURNING kind, spotify_id, play_count, ms_played, potential_ms
+    ), changes AS (
+        SELECT kind, spotify_id, sum(play_count) AS play_count, sum(ms_played) AS ms_played, sum(potential_ms) AS potential_ms
+        FROM consumed GROUP BY kind, spotify_id
+    ), albums AS (
+        INSERT INTO album_leaderboard AS l (spotify_id, name, artist_name, image_url, play_count, ms_played, potential_ms)
+        SELECT c.spotify_id, i.name, i.artist_name, i.image_url, c.play_count, c.ms_played, c.potential_ms
+        FROM changes c LEFT JOIN ({_ALBUM_IDENTITY}) i ON i.spotify_id = c.spotify_id
+        WHERE c.kind = 'album'
+        ON CONFLICT (spotify_id) DO UPDATE SET
+            play_count = l.play_count + EXCLUDED.play_count,
+            ms_played = l.ms_played + EXCLUDED.ms_played,
+            potential_ms = l.potential_ms + EXCLUDED.potential_ms
+        RETURNING 1
+    ), artists AS (
+        INSERT INTO artist_leaderboard AS l (spotify_id, name, image_url, play_count, ms_played, potential_ms)
+        SELECT c.spotify_id, i.name, i.image_url, c.play_count, c.ms_played, c.potential_ms
+        FROM changes c LEFT JOIN ({_ARTIST_IDENTITY}) i ON i.spotify_id = c.spotify_id
+        WHERE c.kind = 'artist'
+        ON CONFLICT (spotify_id) DO UPDATE SET
+            play_count = l.play_count + EXCLUDED.play_count,
+            ms_played = l.ms_played + EXCLUDED.ms_played,
+            potential_ms = l.potential_ms + EXCLUDED.potential_ms
+        RETURNING 1
+    ), tracks AS (
+        INSERT INTO track_leaderboard AS l (spotify_id, title, artist_name, album_name, image_url, duration_ms, play_count, ms_played, potential_ms)
+        SELECT c.spotify_id, i.title, i.artist_name, i.album_name, i.image_url, i.duration_ms, c.play_count, c.ms_played, c.potential_ms
+        FROM changes c LEFT JOIN ({_TRACK_IDENTITY}) i ON i.spotify_id = c.spotify_id
+        WHERE c.kind = 'track'
+        ON CONFLICT (spotify_id) DO UPDATE SET
+            play_count = l.play_count + EXCLUDED.play_count,
+            ms_played = l.ms_played + EXCLUDED.ms_played,
+            potential_ms = l.potential_ms + EXCLUDED.potential_ms
+        RETURNING 1
+    )
+    SELECT (SELECT count(*) FROM consumed), (SELECT count(*) FROM albums), (SELECT count(*) FROM artists), (SELECT count(*) FROM tracks)
+"""
+
+# Noms / images renseignés ou modifiés par l'enrichissement Spotify depuis le dernier passage
+_SYNC_IDENTITY = {
+    "album_leaderboard": f"""
+        UPDATE album_leaderboard l SET name = i.name, artist_name = i.artist_name, image_url = i.image_url
+        FROM ({_ALBUM_IDENTITY}) i
+        WHERE i.spotify_id = l.spotify_id
+          AND (l.name, l.artist_name, l.image_url) IS DISTINCT FROM (i.name, i.artist_name, i.image_url)
+    """,
+    "artist_leaderboard": f"""
+        UPDATE artist_leaderboard l SET name = i.name, image_url = i.image_url
+        FROM ({_ARTIST_IDENTITY}) i
+        WHERE i.spotify_id = l.spotify_id AND (l.name, l.image_url) IS DISTINCT FROM (i.name, i.image_url)
+    """,
+    "track_leaderboard": f"""
+        UPDATE track_leaderboard l
+        SET title = i.title, artist_name = i.artist_name, album_name = i.album_name, image_url = i.image_url, duration_ms = i.duration_ms
+        FROM ({_TRACK_IDENTITY}) i
+        WHERE i.spotify_id = l.spotify_id
+          AND (l.title, l.artist_name, l.album_name, l.image_url, l.duration_ms)
+              IS DISTINCT FROM (i.title, i.artist_name, i.album_name, i.image_url, i.duration_ms)
+    """,
+}
+
+def rebuild_leaderboards(db: Session) -> dict:
+    """Reconstruction complète depuis user_track_daily ; le journal est vidé dans le même instantané."""
+    consumed = db.execute(text("DELETE FROM leaderboard_delta")).rowcount
+    stats = {"deltas": consumed}
+    for table, build in _FULL_BUILD.items():
+        db.execute(text(f"DELETE FROM {table}"))
+        stats[table] = db.execute(text(build)).rowcount
+    return stats
+
+def apply_leaderboard_deltas(db: Session) -> dict:
+    """Applique (et consomme) le journal des variations, puis retire les entités sans écoute."""
+    consumed, albums, artists, tracks = db.execute(text(_APPLY_DELTAS)).one()
+    removed = sum(db.execute(text(f"DELETE FROM {table} WHERE play_count <= 0")).rowcount for table in _FULL_BUILD)
+    return {
+        "deltas": consumed, "album_leaderboard": albums, "artist_leaderboard": artists,
+        "track_leaderboard": tracks, "removed": removed
+    }
+
+def sync_leaderboard_identity(db: Session) -> int:
+    return sum(db.execute(text(statement)).rowcount for statement in _SYNC_IDENTITY.values())
+
+def run_leaderboard_job(full: Optional[bool] = None) -> Optional[dict]:
+    """
+    Un passage du constructeur. Retourne None si un autre processus le fait déjà.
+    `full` force (True) ou interdit (False) la reconstruction complète ; par défaut elle a lieu
+    quand le snapshot n'existe pas encore ou date de plus de LEADERBOARD_FULL_REBUILD_HOURS.
+    """
+    start = time.perf_counter()
+    with Session(engine) as db:
+        # Un seul instantané pour le journal et l'agrégat : une variation est soit déjà dans
+        # l'agrégat lu (et consommée), soit laissée au journal pour le passage suivant.
+        db.connection(execution_options={"isolation_level": "REPEATABLE READ"})
+        if not db.execute(text("SELECT pg_try_advisory_xact_lock(:key)"), {"key": LEADERBOARD_LOCK_KEY}).scalar(): return None
+
+        now = datetime.utcnow()
+        state = db.get(LeaderboardState, 1) or LeaderboardState(id=1)
+        if full is None:
+            full = state.last_full_build is None or state.last_full_build < now - timedelta(hours=LEADERBOARD_FULL_REBUILD_HOURS)
+        stats = rebuild_leaderboards(db) if full else apply_leaderboard_deltas(db)
+        stats["renamed"] = sync_leaderboard_identity(db)
+
+        state.last_run = now
+        if full: state.last_full_build = now
+        db.add(state)
+        db.commit()
+    stats["full"] = full
+    stats["elapsed_ms"] = round((time.perf_counter() - start) * 1000)
+    return stats
+
+def leaderboards_ready(db: Session) -> bool:
+    state = db.get(LeaderboardState, 1)
+    return state is not None and state.last_full_build is not None
+
+class LeaderboardWorker:
+    """Tâche de fond qui maintient les classements globaux (un passage toutes les LEADERBOARD_INTERVAL s)."""
+    _instance = None
+
+    def __new__(cls):
+        if cls._instance is None:
+            cls._instance = super(LeaderboardWorker, cls).__new__(cls)
+            cls._instance.task = None
+        return cls._instance
+
+    def start(self):
+        if self.task is None or self.task.done(): self.task = asyncio.create_task(self._run())
+
+    async def _run(self):
+        while True:
+            try:
+                stats = await asyncio.to_thread(run_leaderboard_job)
+                if stats and (stats["full"] or stats["deltas"] or stats["renamed"]):
+                    kind = "reconstruits" if stats["full"] else "mis à jour"
+                    print(f"🏆 Classements {kind} en {stats['elapsed_ms']} ms : {stats}")
+            except Exception as e: print(f"❌ Erreur du constructeur de classements : {e}")
+            await asyncio.sleep(LEADERBOARD_INTERVAL)
+
+leaderboard_worker = LeaderboardWorker()
+
+def _rating_sql(kind: str) -> str:
+    return (ALBUM_RATING if kind == "album" else ARTIST_RATING).format(
+        cnt="play_count", eng=LEADERBOARD_ENGAGEMENT, mins=LEADERBOARD_MINUTES
+    )
+
+def _snapshot_columns(kind: str) -> dict:
+    table = AlbumLeaderboard if kind == "album" else ArtistLeaderboard
+    return {
+        "spotify_id": table.spotify_id, "name": table.name, "image_url": table.image_url,
+        "artist_name": table.artist_name if kind == "album" else None,
+        "play_count": table.play_count, "total_minutes": table.total_minutes,
+        "engagement": table.engagement, "rating": table.rating
+    }
+
+def _live_columns(kind: str, date_min: Optional[str], date_max: Optional[str]):
+    """Mêmes indicateurs que le snapshot, calculés à la volée sur une période de user_track_daily."""
+    entity_id = UserTrackDaily.album_id if kind == "album" else UserTrackDaily.artist_id
+    totals = select(
+        entity_id.label("spotify_id"),
+        func.sum(UserTrackDaily.streams).label("play_count"),
+        func.sum(UserTrackDaily.ms_played).label("ms_played"),
+        func.sum(UserTrackDaily.potential_ms).label("potential_ms")
+    ).where(entity_id.isnot(None), *period_filters(UserTrackDaily.day, date_min, date_max))
+    totals = totals.group_by(entity_id).subquery()
+
+    # Les formules SQL des colonnes générées s'appliquent telles quelles aux sommes de la période
+    stats = select(
+        totals.c.spotify_id,
+        totals.c.play_count,
+        literal_column(LEADERBOARD_MINUTES).label("total_minutes"),
+        literal_column(LEADERBOARD_ENGAGEMENT).label("engagement"),
+        literal_column(_rating_sql(kind)).label("rating")
+    ).select_from(totals).subquery()
+
+    entity = Album if kind == "album" else Artist
+    columns = {
+        "spotify_id": stats.c.spotify_id, "name": entity.name, "image_url": entity.image_url,
+        "artist_name": Artist.name if kind == "album" else None,
+        "play_count": stats.c.play_count, "total_minutes": stats.c.total_minutes,
+        "engagement": stats.c.engagement, "rating": stats.c.rating
+    }
+    query = select(*(col.label(key) for key, col in columns.items() if col is not None))
+    query = query.select_from(stats).join(entity, entity.spotify_id == stats.c.spotify_id)
+    if kind == "album": query = query.join(Artist, Artist.spotify_id == Album.artist_id)
+    return columns, query
+
+def build_leaderboard_query(
+    kind: str,
+    name: Optional[str] = None, artist: Optional[str] = None,
+    streams_min: Optional[int] = None, streams_max: Optional[int] = None,
+    minutes_min: Optional[float] = None, minutes_max: Optional[float] = None,
+    rating_min: Optional[float] = None, rating_max: Optional[float] = None,
+    engagement_min: Optional[float] = None, engagement_max: Optional[float] = None,
+    date_min: Optional[str] = None, date_max: Optional[str] = None,
+    sort: str = "play_count", direction: str = "desc", snapshot: bool = False
+):
+    """
+    Classement filtré et trié des albums (`kind="album"`) ou artistes (`kind="artist"`).
+    Sans filtre de dates et avec `snapshot` (voir `leaderboards_ready`), il est lu dans le snapshot
+    (colonnes indexées) ; sinon il est agrégé à la volée sur la période demandée. Les lignes exposent spotify_id, name,
+    artist_name (albums), image_url, play_count, total_minutes, engagement et rating.
+    """
+    if not date_min and not date_max and snapshot:
+        columns = _snapshot_columns(kind)
+        query = select(*(col.label(key) for key, col in columns.items() if col is not None))
+        # Entités pas encore enrichies : absentes, comme avec la jointure sur album / artist
+        query = query.where(columns["name"].isnot(None))
+        if kind == "album": query = query.where(columns["artist_name"].isnot(None))
+    else: columns, query = _live_columns(kind, date_min, date_max)
+
+    if name: query = query.where(contains(columns["name"], name))
+    if artist and kind == "album": query = query.where(contains(columns["artist_name"], artist))
+    if streams_min is not None: query = query.where(columns["play_count"] >= streams_min)
+    if streams_max is not None: query = query.where(columns["play_count"] <= streams_max)
+    if minutes_min is not None: query = query.where(columns["total_minutes"] >= minutes_min)
+    if minutes_max is not None: query = query.where(columns["total_minutes"] <= minutes_max)
+    if engagement_min is not None: query = query.where(columns["engagement"] >= engagement_min / 100)
+    if engagement_max is not None: query = query.where(columns["engagement"] <= engagement_max / 100)
+    if rating_min: query = query.where(columns["rating"] > rating_min)
+    if rating_max: query = query.where(columns["rating"] < rating_max)
+
+    # Le spotify_id départage les égalités : ordre stable d'une page à l'autre
+    order_func = desc if direction == "desc" else asc
+    sort_col = columns[sort] if sort in LEADERBOARD_SORTS else columns["spotify_id"]
+    return query.order_by(order_func(sort_col), order_func(columns["spotify_id"]))
+
+def get_leaderboard_top(db: Session, kind: str):
+    """Entité la plus écoutée (bornes des filtres du frontend), None si aucune écoute."""
+    return db.execute(build_leaderboard_query(kind, snapshot=leaderboards_ready(db)).limit(1)).first()
@@ -0,0 +1,38 @@
+import asyncio
+import os
+import time
+from typing import Any, Callable, Dict, Tuple
+from sqlmodel import Session
+from sqlmodel.ext.asyncio.session import AsyncSession
+from app.database import async_engine
+
+# Exécution concurrente de requêtes indépendantes (sections du dashboard, ...) :
+# chaque section a sa propre connexion du pool asyncpg, les agrégats s'exécutent donc en
+# parallèle côté Postgres au lieu de s'attendre les uns les autres.
+# Nombre maximal de connexions prises par les sections, toutes requêtes HTTP du processus confondues :
+# le reste du pool reste disponible pour les autres endpoints, et plusieurs dashboards simultanés
+# ne peuvent pas épuiser le pool en s'attendant mutuellement.
+MAX_PARALLEL_SECTIONS = int(os.getenv("MAX_PARALLEL_SECTIONS", 6))
+_section_slots = asyncio.Semaphore(max(1, MAX_PARALLEL_SECTIONS))
+
+Section = Callable[[Session], Any]
+
+async def run_sections(sections: Dict[str, Section]) -> Tuple[Dict[str, Any], Dict[str, float]]:
+    """
+    Exécute `{nom: fn(session)}` en parallèle (fonctions synchrones, via `run_sync` sur une
+    connexion asyncpg dédiée). Retourne les résultats et la durée de chaque section en ms.
+    L'appelant ne doit pas garder de connexion pendant l'attente (fermer sa session avant).
+    """
+    async def run(name: str, fn: Section):
+        async with _section_slots:
+            start = time.perf_counter()
+            async with AsyncSession(async_engine, expire_on_commit=False) as session:
+                result = await session.run_sync(fn)
+            return name, result, (time.perf_counter() - start) * 1000
+
+    done = await asyncio.gather(*(run(name, fn) for name, fn in sections.items()))
+    return {name: result for name, result, _ in done}, {name: elapsed for name, _, elapsed in done}
+
+def server_timing(timings: Dict[str, float]) -> str:
+    """En-tête `Server-Timing` (affiché par l'onglet Réseau des navigateurs) : `nom;dur=ms, ...`."""
+    return ", ".join(f"{name};dur={elapsed:.1f}" for name, elapsed in timings.items())
@@ -0,0 +1,101 @@
+from datetime import datetime
+from typing import Iterable, List, Set
+from sqlalchemy import text
+from sqlalchemy.exc import OperationalError
+from sqlmodel import Session
+
+# trackhistory est partitionnée par année de played_at (RANGE) : trackhistory_y2024, ...
+# Les filtres de période (dashboard, historique récent) ne lisent ainsi que les années concernées.
+# - les partitions sont créées à la demande avant chaque écriture (import, rafraîchissement),
+#   dans une transaction courte qui précède celle du lot ;
+# - trackhistory_default reçoit les lignes d'une année sans partition (filet de sécurité), elles sont
+#   déplacées dans la bonne partition à sa création ;
+# - une base créée avant le partitionnement garde sa table classique jusqu'à la migration
+#   (python -m app.scripts.partition_history) : ces fonctions ne font alors rien.
+
+HISTORY_PARTITION_FUNCTION = """
+CREATE OR REPLACE FUNCTION ensure_trackhistory_partition(p_year integer) RETURNS boolean AS $$
+DECLARE
+    part text := format('trackhistory_y%s', p_year);
+    v_from timestamp := make_timestamp(p_year, 1, 1, 0, 0, 0);
+    v_to timestamp := make_timestamp(p_year + 1, 1, 1, 0, 0, 0);
+BEGIN
+    IF to_regclass(part) IS NOT NULL THEN RETURN false; END IF;
+    -- Plusieurs workers peuvent vouloir créer la même partition en même temps
+    PERFORM pg_advisory_xact_lock(hashtext('trackhistory_partitions'));
+    IF to_regclass(part) IS NOT NULL THEN RETURN false; END IF;
+
+    IF to_regclass('trackhistory_default') IS NOT NULL
+       AND EXISTS (SELECT 1 FROM trackhistory_default WHERE played_at >= v_from AND played_at < v_to) THEN
+        -- L'année a déjà des lignes dans la partition par défaut : on les déplace dans la nouvelle partition
+        ALTER TABLE trackhistory DETACH PARTITION trackhistory_default;
+        EXECUTE format('CREATE TABLE %I PARTITION OF trackhistory FOR VALUES FROM (%L) TO (%L)', part, v_from, v_to);
+        INSERT INTO trackhistory SELECT * FROM trackhistory_default WHERE played_at >= v_from AND played_at < v_to;
+        DELETE FROM trackhistory_default WHERE played_at >= v_from AND played_at < v_to;
+        ALTER TABLE trackhistory ATTACH PARTITION trackhistory_default DEFAULT;
+    ELSE
+        EXECUTE format('CREATE TABLE %I PARTITION OF trackhistory FOR VALUES FROM (%L) TO (%L)', part, v_from, v_to);
+    END IF;
+    RETURN true;
+END $$ LANGUAGE plpgsql;
+"""
+
+# Années dont la partition existe (création validée) dans ce processus
+_known_years: Set[int] = set()
+# Attente maximale du verrou de trackhistory pour créer une partition (écritures en cours)
+PARTITION_LOCK_TIMEOUT = "5s"
+
+def history_is_partitioned(db: Session) -> bool:
+    return db.execute(text("SELECT relkind = 'p' FROM pg_class WHERE oid = to_regclass('trackhistory')")).scalar() or False
+
+def create_history_partitions(db: Session, years: Iterable[int]) -> List[int]:
+    """Crée, dans la transaction courante, les partitions manquantes de ces années (démarrage, migration)."""
+    created = []
+    for year in sorted({int(y) for y in years}):
+        if db.execute(text("SELECT ensure_trackhistory_partition(:year)"), {"year": year}).scalar():
+            print(f"🗂️ Partition trackhistory_y{year} créée")
+            created.append(year)
+    return created
+
+def ensure_history_partitions(db: Session, years: Iterable[int]):
+    """
+    Crée les partitions manquantes des années qui vont recevoir des lignes, avant l'écriture :
+    dans une transaction courte, sur une autre connexion du pool (session propre, même moteur que `db`),
+    pour que les verrous de la création ne soient pas tenus pendant tout le lot. L'état de la session
+    de `db` (transaction, SET LOCAL, tables temporaires) n'y est pas visible. À appeler avant que la
+    transaction de `db` n'ait touché trackhistory (la création attendrait sinon ses verrous).
+    Si le verrou n'est pas obtenu avant PARTITION_LOCK_TIMEOUT, les lignes iront dans trackhistory_default
+    (déplacées au prochain démarrage) et la création sera retentée au lot suivant.
+    """
+    missing = sorted({int(y) for y in years} - _known_years)
+    if not missing: return
+    try:
+        with Session(db.get_bind()) as part_db:
+            if history_is_partitioned(part_db):
+                part_db.execute(text(f"SET LOCAL lock_timeout = '{PARTITION_LOCK_TIMEOUT}'"))
+                create_history_partitions(part_db, missing)
+            part_db.commit()
+    except OperationalError as e:
+        print(f"⚠️ Partitions {missing} non créées (verrou indisponible) : {str(e.orig).splitlines()[0]}")
+        return
+    _known_years.update(missing)
+
+def maintain_history_partitions(db: Session):
+    """
+    Au démarrage : partition par défaut, partitions de l'année courante et de la suivante,
+    et partitions des années arrivées entre-temps dans trackhistory_default.
+    """
+    if not history_is_partitioned(db): return
+    db.execute(text("CREATE TABLE IF NOT EXISTS trackhistory_default PARTITION OF trackhistory DEFAULT"))
+    stray = db.execute(text("SELECT DISTINCT extract(year FROM played_at)::int FROM trackhistory_default")).scalars().all()
+    now = datetime.utcnow().year
+    create_history_partitions(db, [now, now + 1, *stray])
+
+def history_partitions(db: Session) -> list:
+    """(nom, lignes estimées) des partitions, de la plus ancienne à la plus récente."""
+    return db.execute(text("""
+        SELECT c.relname, c.reltuples::bigint
+        FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = to_regclass('trackhistory')
+        ORDER BY c.relname
+    """)).all()
@@ -1,5 +1,5 @@
 from sqlalchemy import Float, Numeric, cast, func
-from app.models import Track, TrackHistory
+from app.models import Track, UserTrackDaily
 
 def get_formula(model, total_ms, potential_dur, play_count):
     # On s'assure que rien n'est NULL avant de commencer
@@ -22,9 +22,10 @@ def get_formula(model, total_ms, potential_dur, play_count):
     return func.coalesce(formula, 0.0).label("rating")
 
 def get_formulas():
-    raw_ms = cast(func.sum(TrackHistory.ms_played), Float)
-    raw_duration = func.nullif(cast(func.sum(Track.duration_ms), Float), 0)
-    cnt = func.count(TrackHistory.id)
+    # Formules exprimées sur l'agrégat quotidien (user_track_daily)
+    raw_ms = cast(func.sum(UserTrackDaily.ms_played), Float)
+    raw_duration = func.nullif(cast(func.sum(UserTrackDaily.potential_ms), Float), 0)
+    cnt = func.sum(UserTrackDaily.streams)
     
     m = raw_ms / 60000.0
     e = raw_ms / raw_duration
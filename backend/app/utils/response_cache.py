@@ -0,0 +1,75 @@
+import hashlib
+import json
+import os
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Type
+from urllib.parse import urlencode
+from fastapi import Request, Response
+from fastapi.encoders import jsonable_encoder
+from fastapi_cache import FastAPICache
+from pydantic import BaseModel
+from sqlalchemy import text
+from sqlmodel import Session
+
+# Cache des réponses propres à un utilisateur (dashboard, profil) :
+# - `user.data_version` est incrémenté par chaque écriture qui change ce que ces pages affichent
+#   (historique, résumé, métadonnées enrichies, réglages du profil) ;
+# - la clé contient cette version : une écriture rend les anciennes entrées inaccessibles
+#   (elles expirent d'elles-mêmes), aucune invalidation explicite n'est nécessaire ;
+# - l'ETag est dérivé de la clé : `If-None-Match` est résolu en 304 sans lire le cache.
+RESPONSE_CACHE_TTL = int(os.getenv("RESPONSE_CACHE_TTL", 86400))
+RESPONSE_CACHE_PREFIX = "user-response"
+
+def bump_data_version(db: Session, user_id: int):
+    db.execute(text('UPDATE "user" SET data_version = data_version + 1 WHERE id = :user_id'), {"user_id": user_id})
+
+def bump_data_versions(db: Session, track_ids: List[str] = (), artist_ids: List[str] = ()):
+    """Utilisateurs ayant écouté ces morceaux / artistes (noms, images, liens enrichis par le worker)."""
+    if not track_ids and not artist_ids: return
+    db.execute(text("""
+        UPDATE "user" SET data_version = data_version + 1
+        WHERE id IN (
+            SELECT user_id FROM user_track_daily WHERE spotify_id = ANY(:tracks)
+            UNION
+            SELECT user_id FROM user_track_daily WHERE artist_id = ANY(:artists)
+        )
+    """), {"tracks": list(track_ids), "artists": list(artist_ids)})
+
+def response_key(endpoint: str, user_id: int, version: int, is_owner: bool, params: Optional[Dict[str, Any]] = None) -> str:
+    # Le propriétaire voit les sections privées : sa réponse n'est jamais servie aux visiteurs
+    query = urlencode(sorted((k, str(v)) for k, v in (params or {}).items() if v is not None))
+    return f"{RESPONSE_CACHE_PREFIX}:{endpoint}:{user_id}:v{version}:{'owner' if is_owner else 'public'}:{query}"
+
+def etag_for(key: str) -> str:
+    return f'"{hashlib.sha1(key.encode()).hexdigest()}"'
+
+def encode_payload(payload: Any) -> bytes:
+    # Même sérialisation que JSONResponse
+    return json.dumps(jsonable_encoder(payload), ensure_ascii=False, allow_nan=False, separators=(",", ":")).encode("utf-8")
+
+async def cached_response(
+    request: Request, key: str, compute: Callable[[], Awaitable[Any]],
+    response_model: Optional[Type[BaseModel]] = None, headers: Optional[Dict[str, str]] = None
+) -> Response:
+    """
+    Réponse JSON de `compute()` mise en cache sous `key` (cf. `response_key`), avec ETag.
+    Le navigateur revalide à chaque affichage (`no-cache`) et reçoit un 304 tant que la version n'a pas changé.
+    `response_model` : la réponse étant renvoyée telle quelle, elle est filtrée ici comme le ferait la route.
+    Cache désactivé (CACHE_BACKEND_URL=none://) : la réponse est calculée à chaque requête.
+    """
+    etag = etag_for(key)
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache", "Vary": "Cookie", **(headers or {})}
+    if etag in [t.strip() for t in request.headers.get("if-none-match", "").split(",")]:
+        return Response(status_code=304, headers=headers)
+
+    backend, enabled = FastAPICache.get_backend(), FastAPICache.get_enable()
+    _, body = await backend.get_with_ttl(key) if enabled else (0, None)
+    headers["X-Cache"] = "hit" if body is not None else "miss" if enabled else "off"
+    if body is None:
+        try:
+            payload = await compute()
+            body = encode_payload(response_model.model_validate(payload) if response_model else payload)
+        except Exception:
+            if enabled and hasattr(backend, "abandon"): await backend.abandon(key)
+            raise
+        if enabled: await backend.set(key, body, RESPONSE_CACHE_TTL)
+    return Response(content=body, media_type="application/json", headers=headers)
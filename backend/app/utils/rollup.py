@@ -0,0 +1,150 @@
+from datetime import date
+from typing import Iterable, List, Optional
+from sqlalchemy import text
+from sqlmodel import Session
+from app.utils.user_summary import add_summary_totals
+
+# Maintenance de user_track_daily : les jours touchés par une écriture dans l'historique
+# sont simplement recalculés à partir de TrackHistory (insertions, mises à jour de
+# ms_played et suppressions sont ainsi couvertes par la même requête).
+
+_AGGREGATE = """
+    INSERT INTO user_track_daily (user_id, day, spotify_id, artist_id, album_id, streams, ms_played, potential_ms)
+    SELECT h.user_id, h.played_at::date, h.spotify_id, t.artist_id, t.album_id,
+           count(*), sum(h.ms_played), COALESCE(sum(t.duration_ms), 0)
+    FROM trackhistory h
+    JOIN track t ON t.spotify_id = h.spotify_id
+    {where}
+    GROUP BY h.user_id, h.played_at::date, h.spotify_id, t.artist_id, t.album_id
+"""
+
+# Remplissage initial pour les bases existantes (agrégat vide alors que l'historique ne l'est pas)
+ROLLUP_BACKFILL = f"""
+DO $$ BEGIN
+    IF NOT EXISTS (SELECT 1 FROM user_track_daily) AND EXISTS (SELECT 1 FROM trackhistory) THEN
+        {_AGGREGATE.format(where="")};
+    END IF;
+END $$;
+"""
+
+# Colonnes (signées) des lignes d'agrégat propagées au journal des classements globaux
+_DELTA_COLUMNS = "spotify_id, artist_id, album_id, streams, ms_played, potential_ms"
+_NEGATED = "spotify_id, artist_id, album_id, -streams, -ms_played, -potential_ms"
+
+def _with_deltas(ctes: str, rows: str) -> str:
+    """
+    Complète une requête (CTE modifiant user_track_daily) par l'écriture, dans la même transaction,
+    des variations par album / artiste / piste dans leaderboard_delta (cf. app.utils.leaderboard).
+    `rows` sélectionne des lignes (spotify_id, artist_id, album_id, streams, ms_played, potential_ms) signées.
+    """
+    return f"""
+    WITH {ctes}, delta_rows (spotify_id, artist_id, album_id, streams, ms_played, potential_ms) AS ({rows})
+    INSERT INTO leaderboard_delta (kind, spotify_id, play_count, ms_played, potential_ms)
+    SELECT kind, id, sum(streams), sum(ms_played), sum(potential_ms)
+    FROM (
+        SELECT 'album' AS kind, album_id AS id, streams, ms_played, potential_ms FROM delta_rows WHERE album_id IS NOT NULL
+        UNION ALL
+        SELECT 'artist', artist_id, streams, ms_played, potential_ms FROM delta_rows WHERE artist_id IS NOT NULL
+        UNION ALL
+        SELECT 'track', spotify_id, streams, ms_played, potential_ms FROM delta_rows
+    ) d
+    GROUP BY kind, id
+    HAVING sum(streams) <> 0 OR sum(ms_played) <> 0 OR sum(potential_ms) <> 0
+    """
+
+def _delete_rows(where: str) -> str:
+    return _with_deltas(
+        f"removed AS (DELETE FROM user_track_daily WHERE {where} RETURNING {_DELTA_COLUMNS})",
+        f"SELECT {_NEGATED} FROM removed"
+    )
+
+def _insert_rows(where: str) -> str:
+    return _with_deltas(
+        f"added AS ({_AGGREGATE.format(where=where)} RETURNING {_DELTA_COLUMNS})",
+        f"SELECT {_DELTA_COLUMNS} FROM added"
+    )
+
+_DAY_TOTALS = """
+    SELECT COALESCE(sum(streams), 0), COALESCE(sum(ms_played), 0)
+    FROM user_track_daily WHERE user_id = :user_id AND day = ANY(:days)
+"""
+
+def refresh_rollup_days(db: Session, user_id: int, days: Iterable[date]):
+    """
+    Recalcule les lignes de l'utilisateur pour les jours donnés (bornes [jour, jour+1) sargables)
+    et reporte la variation sur les totaux de son résumé.
+    """
+    days = sorted(set(days))
+    if not days: return
+    params = {"user_id": user_id, "days": days}
+    streams_before, ms_before = db.execute(text(_DAY_TOTALS), params).one()
+    db.execute(text(_delete_rows("user_id = :user_id AND day = ANY(:days)")), params)
+    db.execute(text(_insert_rows("""
+        JOIN unnest(CAST(:days AS date[])) AS d(day) ON h.played_at >= d.day AND h.played_at < d.day + 1
+        WHERE h.user_id = :user_id
+    """)), params)
+    streams_after, ms_after = db.execute(text(_DAY_TOTALS), params).one()
+    add_summary_totals(db, user_id, int(streams_after - streams_before), int(ms_after - ms_before))
+
+def sync_rollup_tracks(db: Session, track_ids: List[str]):
+    """Reporte sur l'agrégat les métadonnées (artiste, album, durée) arrivées après l'écoute."""
+    if not track_ids: return
+    db.execute(text(_with_deltas("""
+        changed AS (
+            SELECT r.user_id, r.day, r.spotify_id, r.streams, r.ms_played,
+                   r.artist_id AS old_artist_id, r.album_id AS old_album_id, r.potential_ms AS old_potential_ms,
+                   t.artist_id, t.album_id, r.streams * COALESCE(t.duration_ms, 0) AS potential_ms
+            FROM user_track_daily r
+            JOIN track t ON t.spotify_id = r.spotify_id
+            WHERE r.spotify_id = ANY(:ids)
+              AND (r.artist_id IS DISTINCT FROM t.artist_id OR r.album_id IS DISTINCT FROM t.album_id
+                   OR r.potential_ms <> r.streams * COALESCE(t.duration_ms, 0))
+            FOR UPDATE OF r
+        ), updated AS (
+            UPDATE user_track_daily r
+            SET artist_id = c.artist_id, album_id = c.album_id, potential_ms = c.potential_ms
+            FROM changed c
+            WHERE r.user_id = c.user_id AND r.day = c.day AND r.spotify_id = c.spotify_id
+        )
+    """, """
+        SELECT spotify_id, old_artist_id, old_album_id, -streams, -ms_played, -old_potential_ms FROM changed
+        UNION ALL
+        SELECT spotify_id, artist_id, album_id, streams, ms_played, potential_ms FROM changed
+    """)), {"ids": list(track_ids)})
+
+def clear_rollup(db: Session, user_id: int):
+    db.execute(text(_delete_rows("user_id = :user_id")), {"user_id": user_id})
+
+def rebuild_rollup(db: Session, user_id: Optional[int] = None):
+    """Reconstruit entièrement l'agrégat (d'un utilisateur ou de tous) depuis l'historique brut."""
+    if user_id is None:
+        db.execute(text("TRUNCATE user_track_daily"))
+        db.execute(text(_AGGREGATE.format(where="")))
+        # Les classements globaux sont reconstruits en entier au prochain passage du constructeur
+        db.execute(text("TRUNCATE leaderboard_delta"))
+        db.execute(text("DELETE FROM leaderboard_state"))
+    else:
+        clear_rollup(db, user_id)
+        db.execute(text(_insert_rows("WHERE h.user_id = :user_id")), {"user_id": user_id})
+
+def check_rollup(db: Session, user_id: Optional[int] = None) -> List[tuple]:
+    """
+    Compare l'agrégat à l'historique brut et retourne les lignes divergentes
+    (user_id, day, spotify_id, streams attendus, streams agrégés, ms attendus, ms agrégés).
+    """
+    where = "WHERE h.user_id = :user_id" if user_id is not None else ""
+    rollup_where = "WHERE user_id = :user_id" if user_id is not None else ""
+    return db.execute(text(f"""
+        WITH expected AS (
+            SELECT h.user_id, h.played_at::date AS day, h.spotify_id, count(*) AS streams, sum(h.ms_played) AS ms_played
+            FROM trackhistory h {where}
+            GROUP BY 1, 2, 3
+        ), actual AS (
+            SELECT user_id, day, spotify_id, streams, ms_played FROM user_track_daily {rollup_where}
+        )
+        SELECT COALESCE(e.user_id, a.user_id), COALESCE(e.day, a.day), COALESCE(e.spotify_id, a.spotify_id),
+               e.streams, a.streams, e.ms_played, a.ms_played
+        FROM expected e
+        FULL JOIN actual a USING (user_id, day, spotify_id)
+        WHERE e.streams IS DISTINCT FROM a.streams OR e.ms_played IS DISTINCT FROM a.ms_played
+    """), {"user_id": user_id}).all()
@@ -0,0 +1,96 @@
+from typing import List, Optional
+from sqlalchemy import case, func, literal, or_, select, text
+from sqlmodel import Session
+from app.models import Album, Artist, Track
+
+# Recherche textuelle sur le catalogue (titres de pistes, noms d'albums et d'artistes).
+# Avec l'extension pg_trgm, des index GIN trigrammes servent les filtres `ILIKE '%terme%'`
+# de toutes les routes ainsi que la recherche par similarité de /data/search.
+
+TRIGRAM_EXTENSION = """
+DO $$ BEGIN
+    IF EXISTS (SELECT 1 FROM pg_available_extensions WHERE name = 'pg_trgm') THEN
+        CREATE EXTENSION IF NOT EXISTS pg_trgm;
+    END IF;
+EXCEPTION WHEN insufficient_privilege THEN
+    RAISE NOTICE 'pg_trgm indisponible (droits insuffisants) : recherche sans index trigramme';
+END $$;
+"""
+
+TRIGRAM_INDEXES = """
+DO $$ BEGIN
+    IF EXISTS (SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm') THEN
+        CREATE INDEX IF NOT EXISTS ix_track_title_trgm ON track USING gin (title gin_trgm_ops);
+        CREATE INDEX IF NOT EXISTS ix_album_name_trgm ON album USING gin (name gin_trgm_ops);
+        CREATE INDEX IF NOT EXISTS ix_artist_name_trgm ON artist USING gin (name gin_trgm_ops);
+        CREATE INDEX IF NOT EXISTS ix_album_leaderboard_name_trgm ON album_leaderboard USING gin (name gin_trgm_ops);
+        CREATE INDEX IF NOT EXISTS ix_album_leaderboard_artist_name_trgm ON album_leaderboard USING gin (artist_name gin_trgm_ops);
+        CREATE INDEX IF NOT EXISTS ix_artist_leaderboard_name_trgm ON artist_leaderboard USING gin (name gin_trgm_ops);
+    END IF;
+END $$;
+"""
+
+SEARCH_TYPES = ("track", "album", "artist")
+# Seuil de similarité trigramme (opérateur `%`) pour les fautes de frappe
+SIMILARITY_THRESHOLD = 0.3
+
+_trigram_available: Optional[bool] = None
+
+def trigram_available(db: Session) -> bool:
+    global _trigram_available
+    if _trigram_available is None:
+        _trigram_available = db.execute(text("SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'")).first() is not None
+    return _trigram_available
+
+def escape_like(term: str) -> str:
+    """Neutralise les jokers LIKE saisis par l'utilisateur (`%`, `_`)."""
+    return term.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+def contains(column, term: str):
+    """Filtre `colonne contient terme` (insensible à la casse), servi par l'index trigramme."""
+    return column.ilike(f"%{escape_like(term)}%", escape="\\")
+
+def starts_with(column, term: str):
+    return column.ilike(f"{escape_like(term)}%", escape="\\")
+
+def _search_query(kind: str, term: str, use_trigram: bool):
+    if kind == "track":
+        name, query = Track.title, select(
+            Track.spotify_id, Track.title.label("name"), Artist.name.label("subtitle"), Album.image_url
+        ).outerjoin(Artist, Artist.spotify_id == Track.artist_id).outerjoin(Album, Album.spotify_id == Track.album_id)
+    elif kind == "album":
+        name, query = Album.name, select(
+            Album.spotify_id, Album.name, Artist.name.label("subtitle"), Album.image_url
+        ).outerjoin(Artist, Artist.spotify_id == Album.artist_id)
+    else: name, query = Artist.name, select(Artist.spotify_id, Artist.name, literal(None).label("subtitle"), Artist.image_url)
+
+    # Les débuts de nom passent devant, puis les noms les plus proches du terme
+    prefix = case((starts_with(name, term), 1.0), else_=0.0)
+    if use_trigram:
+        score = prefix + func.similarity(name, term)
+        query = query.where(or_(contains(name, term), name.op("%")(term)))
+    else:
+        score = prefix + 1.0 / (1 + func.length(name))
+        query = query.where(contains(name, term))
+    return query.add_columns(literal(kind).label("type"), score.label("score")).order_by(score.desc(), name)
+
+def search_catalog(db: Session, q: str, types: List[str], limit: int) -> List[dict]:
+    """Autocomplétion : meilleurs résultats (préfixe, puis similarité) parmi les types demandés."""
+    term = q.strip()
+    if not term: return []
+    use_trigram = trigram_available(db)
+    if use_trigram: db.execute(text("SELECT set_limit(:threshold)"), {"threshold": SIMILARITY_THRESHOLD})
+
+    results = []
+    for kind in types:
+        for row in db.execute(_search_query(kind, term, use_trigram).limit(limit)).all():
+            results.append({
+                "type": row.type,
+                "spotify_id": row.spotify_id,
+                "name": row.name,
+                "subtitle": row.subtitle,
+                "image_url": row.image_url,
+                "score": round(float(row.score), 4)
+            })
+    results.sort(key=lambda r: r["score"], reverse=True)
+    return results[:limit]
@@ -0,0 +1,40 @@
+import asyncio
+import os
+from datetime import timedelta
+from sqlmodel import Session
+from app.database import engine
+from app.utils.user_summary import rebuild_stale_summaries
+
+# Recalcul des résumés périmés (tops, compteurs distincts) hors des requêtes : la page de profil
+# sert le dernier résumé, les écritures ne font que marquer `stale` et incrémenter les totaux.
+SUMMARY_INTERVAL = int(os.getenv("SUMMARY_INTERVAL", 30))
+# Résumés recalculés par passage
+SUMMARY_BATCH = 20
+# Délai minimal entre deux recalculs d'un même résumé
+SUMMARY_MIN_AGE = timedelta(seconds=int(os.getenv("SUMMARY_MIN_AGE", 120)))
+
+def run_summary_job() -> int:
+    with Session(engine) as db: return rebuild_stale_summaries(db, SUMMARY_BATCH, SUMMARY_MIN_AGE)
+
+class SummaryWorker:
+    """Tâche de fond qui recalcule les résumés utilisateur périmés (un passage toutes les SUMMARY_INTERVAL s)."""
+    _instance = None
+
+    def __new__(cls):
+        if cls._instance is None:
+            cls._instance = super(SummaryWorker, cls).__new__(cls)
+            cls._instance.task = None
+        return cls._instance
+
+    def start(self):
+        if self.task is None or self.task.done(): self.task = asyncio.create_task(self._run())
+
+    async def _run(self):
+        while True:
+            try:
+                rebuilt = await asyncio.to_thread(run_summary_job)
+                if rebuilt: print(f"📊 {rebuilt} résumé(s) utilisateur recalculé(s)")
+            except Exception as e: print(f"❌ Erreur du recalcul des résumés : {e}")
+            await asyncio.sleep(SUMMARY_INTERVAL)
+
+summary_worker = SummaryWorker()
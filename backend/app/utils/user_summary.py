@@ -0,0 +1,159 @@
+from collections import Counter
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List
+from sqlalchemy import Float, cast, desc, extract, func, select, text
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm.attributes import flag_modified
+from sqlmodel import Session
+from app.models import Album, Artist, Track, TrackHistory, UserSummary, UserTrackDaily
+from app.utils.rating import get_formula
+
+TOP_LIMIT = 50
+
+# Colonne de regroupement de l'agrégat et modèle (pour la formule de rating) de chaque top
+TOP_KINDS = {
+    "tracks": (UserTrackDaily.spotify_id, Track),
+    "albums": (UserTrackDaily.album_id, Album),
+    "artists": (UserTrackDaily.artist_id, Artist)
+}
+
+def hour_histogram(db: Session, user_id: int) -> List[int]:
+    """Histogramme horaire complet, calculé sur l'historique brut (construction initiale uniquement)."""
+    hour = extract("hour", TrackHistory.played_at)
+    hours = [0] * 24
+    for h, count in db.execute(
+        select(hour, func.count()).where(TrackHistory.user_id == user_id).group_by(hour)
+    ).all(): hours[int(h)] = count
+    return hours
+
+def add_hour_streams(db: Session, user_id: int, deltas: Dict[int, int]):
+    """
+    Reporte des écoutes ajoutées (delta > 0) ou supprimées (delta < 0) dans l'histogramme horaire.
+    Sans résumé existant, rien à faire : il sera construit en entier au prochain `refresh_user_summary`.
+    """
+    deltas = {h: d for h, d in deltas.items() if d}
+    if not deltas: return
+    summary = db.get(UserSummary, user_id, with_for_update=True)
+    if summary is None: return
+    hours = list(summary.hour_streams or [0] * 24)
+    for h, d in deltas.items(): hours[int(h)] = max(0, hours[int(h)] + d)
+    summary.hour_streams = hours
+    db.add(summary)
+
+def hour_counts(played_at: Iterable[datetime]) -> Dict[int, int]:
+    return Counter(p.hour for p in played_at)
+
+def compute_tops(db: Session, user_id: int, group_col, model) -> Dict[str, List[dict]]:
+    total_ms = func.sum(UserTrackDaily.ms_played)
+    play_count = func.sum(UserTrackDaily.streams).label("play_count")
+    potential = func.sum(UserTrackDaily.potential_ms)
+    engagement = ((cast(total_ms, Float) * 100) / func.nullif(cast(potential, Float), 0)).label("engagement")
+    rating = get_formula(model, total_ms, potential, play_count)
+
+    statement = (
+        select(group_col.label("id"), play_count, (cast(total_ms, Float) / 60000.0).label("minutes"), engagement, rating)
+        .where(UserTrackDaily.user_id == user_id, group_col.is_not(None))
+        .group_by(group_col)
+    )
+    # Un morceau n'apparaît dans les tops qu'une fois relié à son artiste et à son album
+    if model == Track: statement = statement.where(UserTrackDaily.artist_id.is_not(None), UserTrackDaily.album_id.is_not(None))
+
+    def run(*order):
+        return [{
+            "id": r.id,
+            "count": int(r.play_count),
+            "minutes": round(r.minutes or 0),
+            "engagement": round(r.engagement or 0, 2),
+            "rating": round(r.rating or 0, 2)
+        } for r in db.execute(statement.order_by(*order).limit(TOP_LIMIT)).all()]
+
+    return {
+        "rating": run(desc("rating"), desc("play_count")),
+        "count": run(desc("play_count"), desc("minutes"))
+    }
+
+def refresh_user_summary(db: Session, user_id: int) -> UserSummary:
+    """Recalcule totaux, compteurs distincts et tops depuis user_track_daily (crée le résumé au besoin)."""
+    summary = db.get(UserSummary, user_id, with_for_update=True)
+    if summary is None: summary = UserSummary(user_id=user_id, hour_streams=hour_histogram(db, user_id))
+
+    totals = db.execute(
+        select(
+            func.coalesce(func.sum(UserTrackDaily.ms_played), 0),
+            func.coalesce(func.sum(UserTrackDaily.streams), 0),
+            func.count(func.distinct(UserTrackDaily.spotify_id)),
+            func.count(func.distinct(UserTrackDaily.album_id)),
+            func.count(func.distinct(UserTrackDaily.artist_id))
+        ).where(UserTrackDaily.user_id == user_id)
+    ).one()
+    (summary.total_ms, summary.total_streams, summary.distinct_tracks,
+     summary.distinct_albums, summary.distinct_artists) = (int(v) for v in totals)
+
+    summary.tops = {kind: compute_tops(db, user_id, col, model) for kind, (col, model) in TOP_KINDS.items()}
+    flag_modified(summary, "tops")
+    summary.stale = False
+    summary.updated_at = datetime.utcnow()
+    db.add(summary)
+    db.flush()
+    return summary
+
+def get_user_summary(db: Session, user_id: int) -> UserSummary:
+    """
+    Lecture par clé primaire : un résumé périmé est servi tel quel (totaux et histogramme à jour,
+    tops du dernier calcul), `SummaryWorker` le recalcule en tâche de fond.
+    Seul un résumé absent (premier affichage) est construit ici.
+    """
+    summary = db.get(UserSummary, user_id)
+    if summary is None:
+        try:
+            summary = refresh_user_summary(db, user_id)
+            db.commit()
+        except IntegrityError:
+            # Construit au même moment par une autre requête
+            db.rollback()
+            summary = db.get(UserSummary, user_id)
+    return summary
+
+def add_summary_totals(db: Session, user_id: int, streams: int, ms_played: int):
+    """Reporte une variation de l'agrégat (écoutes, durée) sur les totaux du résumé, sans relire l'historique."""
+    if not streams and not ms_played: return
+    db.execute(text("""
+        UPDATE user_summary SET total_streams = total_streams + :streams, total_ms = total_ms + :ms
+        WHERE user_id = :user_id
+    """), {"user_id": user_id, "streams": streams, "ms": ms_played})
+
+def rebuild_stale_summaries(db: Session, limit: int, min_age: timedelta) -> int:
+    """
+    Recalcule jusqu'à `limit` résumés périmés, du plus ancien au plus récent, un par transaction.
+    Un résumé recalculé il y a moins de `min_age` attend le passage suivant (enrichissement en continu).
+    Les lignes sont verrouillées (SKIP LOCKED) : plusieurs processus peuvent se partager le travail.
+    """
+    rebuilt = 0
+    while rebuilt < limit:
+        user_id = db.execute(text("""
+            SELECT user_id FROM user_summary
+            WHERE stale AND updated_at < :before
+            ORDER BY updated_at LIMIT 1
+            FOR UPDATE SKIP LOCKED
+        """), {"before": datetime.utcnow() - min_age}).scalar()
+        if user_id is None: break
+        refresh_user_summary(db, user_id)
+        db.commit()
+        rebuilt += 1
+    return rebuilt
+
+def mark_summaries_stale(db: Session, track_ids: List[str]):
+    """Les tops des utilisateurs ayant écouté ces morceaux sont à recalculer (métadonnées enrichies)."""
+    if not track_ids: return
+    db.execute(text("""
+        UPDATE user_summary SET stale = true
+        WHERE NOT stale AND user_id IN (SELECT DISTINCT user_id FROM user_track_daily WHERE spotify_id = ANY(:ids))
+    """), {"ids": list(track_ids)})
+
+def mark_user_summaries_stale(db: Session, user_ids: List[int]):
+    """Tops de ces utilisateurs à recalculer par `SummaryWorker` (écoutes ajoutées en tâche de fond)."""
+    if not user_ids: return
+    db.execute(text("UPDATE user_summary SET stale = true WHERE NOT stale AND user_id = ANY(:ids)"), {"ids": list(user_ids)})
+
+def clear_user_summary(db: Session, user_id: int):
+    db.execute(text("DELETE FROM user_summary WHERE user_id = :user_id"), {"user_id": user_id})
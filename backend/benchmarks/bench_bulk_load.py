@@ -0,0 +1,62 @@
+"""
+Compare le débit d'insertion de TrackHistory : executemany par paquets de 5000 (ancien chemin d'import)
+contre COPY FROM STDIN (app.utils.bulk_copy).
+
+Usage (depuis backend/, avec DATABASE_URL pointant vers une base de test) :
+    python -m benchmarks.bench_bulk_load 100000 1000000 5000000
+
+Chaque mesure s'exécute dans une transaction annulée à la fin : la base n'est pas modifiée.
+"""
+import datetime
+import sys
+import time
+from sqlalchemy import insert, text
+from sqlmodel import Session
+from app.database import engine
+from app.models import TrackHistory
+from app.utils.bulk_copy import copy_rows
+
+N_TRACKS = 20_000
+COLUMNS = ("user_id", "played_at", "spotify_id", "ms_played")
+
+def setup(db: Session) -> int:
+    user_id = db.execute(text("""
+        INSERT INTO "user" (email, display_name, perms) VALUES ('bench@bulk.load', 'bench', '{}') RETURNING id
+    """)).scalar()
+    copy_rows(db, "track", ("spotify_id", "title"), ((f"bench{i:06d}", f"Bench {i}") for i in range(N_TRACKS)))
+    return user_id
+
+def synthetic_rows(user_id: int, n: int):
+    start = datetime.datetime(2012, 1, 1)
+    for i in range(n):
+        yield (user_id, start + datetime.timedelta(seconds=30 * i), f"bench{i % N_TRACKS:06d}", 180_000)
+
+def bench_executemany(db: Session, user_id: int, n: int):
+    batch = []
+    for user, played_at, sid, ms in synthetic_rows(user_id, n):
+        batch.append({"user_id": user, "played_at": played_at, "spotify_id": sid, "ms_played": ms})
+        if len(batch) == 5000:
+            db.execute(insert(TrackHistory), batch)
+            batch = []
+    if batch: db.execute(insert(TrackHistory), batch)
+
+def bench_copy(db: Session, user_id: int, n: int):
+    copy_rows(db, "trackhistory", COLUMNS, synthetic_rows(user_id, n))
+
+def run(method, n: int) -> float:
+    with Session(engine) as db:
+        user_id = setup(db)
+        start = time.perf_counter()
+        method(db, user_id, n)
+        db.flush()
+        elapsed = time.perf_counter() - start
+        db.rollback()
+    return elapsed
+
+if __name__ == "__main__":
+    sizes = [int(a) for a in sys.argv[1:]] or [100_000, 1_000_000, 5_000_000]
+    print(f"{'lignes':>10} | {'executemany (l/s)':>18} | {'COPY (l/s)':>12} | gain")
+    for n in sizes:
+        t_many = run(bench_executemany, n)
+        t_copy = run(bench_copy, n)
+        print(f"{n:>10} | {n / t_many:>18,.0f} | {n / t_copy:>12,.0f} | x{t_many / t_copy:.1f}")
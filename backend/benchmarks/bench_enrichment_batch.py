@@ -0,0 +1,85 @@
+"""
+Compare l'écriture d'un lot de réponses Spotify /tracks et /artists par le worker d'enrichissement :
+- "legacy" : trois SELECT (artiste, album, piste) + flush par piste, un SELECT par artiste (ancien chemin)
+- "bulk"   : un upsert par table et par lot (SpotifyWorker._update_tracks_metadata / _update_artists_metadata)
+
+Usage (depuis backend/, avec DATABASE_URL pointant vers une base de test) :
+    python -m benchmarks.bench_enrichment_batch 50 20
+
+Chaque mesure s'exécute dans une transaction annulée à la fin : la base n'est pas modifiée.
+"""
+import statistics
+import sys
+import time
+from sqlalchemy import event
+from sqlmodel import Session, select
+from app.database import engine
+from app.models import Album, Artist, Track
+from app.spotify.utils.SpotifyWorker import spotify_worker
+from app.utils.bulk_copy import copy_rows
+
+def synthetic_batch(run: int, size: int):
+    # Moitié d'artistes et d'albums déjà connus (créés par `setup`), moitié nouveaux
+    tracks = [{
+        "id": f"bench_t{run}_{i}", "name": f"Titre {i}", "duration_ms": 180_000,
+        "artists": [{"id": f"bench_ar{i % (size // 2) if i % 2 else f'{run}_{i}'}", "name": "Artiste"}],
+        "album": {"id": f"bench_al{i if i % 2 else f'{run}_{i}'}", "name": "Album", "images": [{"url": "https://img/al"}]}
+    } for i in range(size)]
+    artists = [{"id": f"bench_ar{i}", "name": "Artiste", "images": [{"url": "https://img/ar"}]} for i in range(size // 2)]
+    return tracks, artists
+
+def setup(db: Session, run: int, size: int):
+    copy_rows(db, "artist", ("spotify_id", "name"), ((f"bench_ar{i}", "Artiste") for i in range(size // 2)))
+    copy_rows(db, "album", ("spotify_id", "name", "artist_id"), ((f"bench_al{i}", "Album", f"bench_ar{i % (size // 2)}") for i in range(size)))
+    copy_rows(db, "track", ("spotify_id", "title"), ((f"bench_t{run}_{i}", "Chargement...") for i in range(size)))
+
+def legacy(db: Session, tracks, artists):
+    for t in tracks:
+        sp_artist_id, sp_album_id = t["artists"][0]["id"], t["album"]["id"]
+        if not db.exec(select(Artist).where(Artist.spotify_id == sp_artist_id)).first():
+            db.add(Artist(spotify_id=sp_artist_id, name=t["artists"][0]["name"]))
+            db.flush()
+        if not db.exec(select(Album).where(Album.spotify_id == sp_album_id)).first():
+            db.add(Album(spotify_id=sp_album_id, name=t["album"]["name"], artist_id=sp_artist_id, image_url=t["album"]["images"][0]["url"]))
+            db.flush()
+        track = db.exec(select(Track).where(Track.spotify_id == t["id"])).first()
+        if track:
+            track.artist_id, track.album_id, track.duration_ms, track.title = sp_artist_id, sp_album_id, t["duration_ms"], t["name"]
+            db.add(track)
+    for a in artists:
+        artist = db.exec(select(Artist).where(Artist.spotify_id == a["id"])).first()
+        if artist:
+            artist.image_url = a["images"][0]["url"]
+            db.add(artist)
+    db.flush()
+
+def bulk(db: Session, tracks, artists):
+    spotify_worker._update_tracks_metadata(db, tracks)
+    spotify_worker._update_artists_metadata(db, artists)
+
+def run(method, run_id: int, size: int):
+    statements = 0
+    def count(*args): nonlocal statements; statements += 1
+    with Session(engine) as db:
+        setup(db, run_id, size)
+        tracks, artists = synthetic_batch(run_id, size)
+        connection = db.connection()
+        event.listen(connection, "before_cursor_execute", count)
+        start = time.perf_counter()
+        method(db, tracks, artists)
+        elapsed = time.perf_counter() - start
+        event.remove(connection, "before_cursor_execute", count)
+        db.rollback()
+    return elapsed, statements
+
+if __name__ == "__main__":
+    size = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    runs = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+    print(f"lot de {size} pistes + {size // 2} artistes, médiane sur {runs} lots")
+    results = {}
+    for name, method in (("legacy", legacy), ("bulk", bulk)):
+        samples = [run(method, i, size) for i in range(runs)]
+        results[name] = statistics.median(s[0] for s in samples)
+        # Les COPY de copy_upsert passent par le curseur psycopg2 : un aller-retour de plus par table
+        print(f"{name:>7} : {results[name] * 1000:7.1f} ms / lot, {samples[0][1]} requêtes SQL")
+    print(f"gain x{results['legacy'] / results['bulk']:.1f}")
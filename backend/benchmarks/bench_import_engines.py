@@ -0,0 +1,70 @@
+"""
+Compare la normalisation d'un fichier d'historique étendu (sans base de données) :
+- "legacy"  : boucle par entrée de l'ancien `upload_spotify_json` (json.loads + dict par entrée)
+- "python"  : parseur en flux + colonnes compactes (app.utils.history_parser)
+- "numpy"   : chargement en colonnes + normalisation vectorisée (app.utils.history_vectorized)
+
+Usage (depuis backend/) :
+    python -m benchmarks.bench_import_engines 1000000
+"""
+import datetime
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+from app.utils.history_parser import parse_history_file
+from app.utils.history_vectorized import parse_history_file_vectorized
+
+def write_synthetic_file(path: str, n: int, n_tracks: int = 50_000):
+    rnd = random.Random(42)
+    start = datetime.datetime(2014, 1, 1)
+    with open(path, "w") as f:
+        f.write("[")
+        for i in range(n):
+            if i: f.write(",")
+            ts = (start + datetime.timedelta(seconds=97 * i)).strftime("%Y-%m-%dT%H:%M:%SZ")
+            json.dump({
+                "ts": ts,
+                "ms_played": rnd.choice((800, 45_000, 180_000, 240_000)),
+                "spotify_track_uri": f"spotify:track:{rnd.randrange(n_tracks):022d}",
+                "master_metadata_track_name": "Synthetic",
+                "platform": "android",
+                "conn_country": "FR"
+            }, f)
+        f.write("]")
+
+def legacy_loop(path: str) -> int:
+    """Reproduit la boucle de l'ancien endpoint, sans les accès base."""
+    with open(path, "rb") as f: data = json.loads(f.read())
+    seen, rows = set(), []
+    for entry in data:
+        uri = entry.get("spotify_track_uri")
+        ts = entry.get("ts")
+        ms = entry.get("ms_played", 0)
+        if not uri or not ts: continue
+        try: dt_obj = datetime.datetime.fromisoformat(ts.replace("Z", "+00:00")).replace(tzinfo=None)
+        except: continue
+        sid = uri.split(":")[-1]
+        key = (dt_obj, sid)
+        if key in seen or ms < 3000: continue
+        seen.add(key)
+        rows.append({"spotify_id": sid, "played_at": dt_obj, "ms_played": ms})
+    return len(rows)
+
+def timed(label: str, fn, path: str, n: int):
+    start = time.perf_counter()
+    fn(path)
+    elapsed = time.perf_counter() - start
+    print(f"{label:>8} | {elapsed:>8.2f} s | {n / elapsed:>12,.0f} entrées/s")
+
+if __name__ == "__main__":
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "Streaming_History_Audio.json")
+        write_synthetic_file(path, n)
+        print(f"Fichier synthétique : {n:,} entrées, {os.path.getsize(path) / 1e6:.0f} Mo")
+        timed("legacy", legacy_loop, path, n)
+        timed("python", parse_history_file, path, n)
+        timed("numpy", parse_history_file_vectorized, path, n)
@@ -0,0 +1,130 @@
+"""
+Vérifie, via EXPLAIN, que les requêtes des endpoints filtrés par utilisateur ou par période
+sont servies par des index (aucun parcours séquentiel de trackhistory / user_track_daily).
+
+Chaque endpoint est appelé sur la base configurée (DATABASE_URL, premier utilisateur ayant un
+historique), les requêtes SQL émises sont capturées puis passées à EXPLAIN avec
+`enable_seqscan = off` : un Seq Scan restant signifie qu'aucun index n'est utilisable
+(filtre non sargable, index manquant). Si trackhistory est partitionnée, les endpoints filtrés
+sur une année ne doivent lire que la partition de cette année (élagage des partitions).
+Rien n'est modifié : la transaction est annulée.
+
+Usage (depuis backend/) :
+    python -m benchmarks.check_query_plans
+"""
+import asyncio
+import datetime
+import json
+import re
+import sys
+from sqlalchemy import event, text
+from sqlmodel import Session
+from sqlmodel.ext.asyncio.session import AsyncSession
+from app.database import async_engine, engine
+from app.models import User
+from app.data.my import albums, artists, resume, today, tracks
+from app.data.everyone import tracks as all_tracks
+from app.profile import profile_data
+from app.profile.dashboard import dashboard_data
+
+# Tables dont un parcours complet est proscrit pour ces endpoints
+CHECKED_TABLES = {"trackhistory", "user_track_daily"}
+
+def endpoint_calls(db: Session, adb: AsyncSession, user: User, day_min: str, day_max: str):
+    """
+    (nom, appel, année attendue des partitions lues ou None) des endpoints contrôlés.
+    Les endpoints portés sur asyncpg reçoivent `adb`, les autres la session synchrone `db`.
+    """
+    d_min, d_max = datetime.datetime.fromisoformat(day_min), datetime.datetime.fromisoformat(day_max)
+    period = {"date_min": day_min, "date_max": day_max}
+    year = d_max.year
+    global_tracks = getattr(all_tracks.get_all_musics, "__wrapped__", all_tracks.get_all_musics)
+    return [
+        ("my/tracks", lambda: tracks.get_user_musics(db=adb, user_id=user.id, **period)),
+        ("my/albums", lambda: albums.get_user_albums(db=adb, user_id=user.id, **period)),
+        ("my/artists", lambda: artists.get_artists(
+            db=adb, user_id=user.id, streams_min=0, minutes_min=0, rating_min=0, engagement_min=0, **period
+        )),
+        ("my/today", lambda: today.get_today(user_id=user.id, db=adb)),
+        ("my/resume", lambda: resume.get_resume_data(range="month", offset=0, sort="streams", user_id=user.id, db=adb, session_id=None)),
+        ("profile/history", lambda: profile_data.get_historique(user, 50, db)),
+        # Calcul sans le cache des réponses (qui servirait la réponse sans requête)
+        ("dashboard", lambda: dashboard_data.compute_dashboard(user.id, d_min, d_max)),
+        (f"dashboard ({year})", lambda: dashboard_data.compute_dashboard(
+            user.id, datetime.datetime(year, 1, 1), datetime.datetime(year, 12, 31)
+        ), year),
+        ("all/tracks (période)", lambda: global_tracks(
+            db=adb, offset=0, limit=50, sort="play_count", direction="desc", track=None, artist=None, album=None,
+            streams_min=None, streams_max=None, minutes_min=None, minutes_max=None, rating_min=None, rating_max=None,
+            engagement_min=None, engagement_max=None, **period
+        )),
+    ]
+
+def to_pyformat(statement: str, parameters: tuple):
+    """Requête asyncpg (`$1`, paramètres positionnels) -> format psycopg2 (`%s`) pour EXPLAIN."""
+    positions = [int(n) - 1 for n in re.findall(r"\$(\d+)", statement)]
+    return re.sub(r"\$\d+", "%s", statement.replace("%", "%%")), tuple(parameters[i] for i in positions)
+
+def plan_nodes(node):
+    yield node
+    for child in node.get("Plans", []): yield from plan_nodes(child)
+
+def explain(db: Session, statement: str, parameters) -> list:
+    raw = db.connection().exec_driver_sql("EXPLAIN (FORMAT JSON) " + statement, parameters).scalar()
+    plan = raw if isinstance(raw, list) else json.loads(raw)
+    return list(plan_nodes(plan[0]["Plan"]))
+
+async def main() -> int:
+    async with AsyncSession(async_engine, expire_on_commit=False) as adb:
+        try: return await check_plans(adb)
+        finally: await async_engine.dispose()
+
+async def check_plans(adb: AsyncSession) -> int:
+    with Session(engine) as db:
+        user = db.exec(text("SELECT user_id FROM trackhistory LIMIT 1")).first()
+        if not user:
+            print("⚠️ Aucun historique en base : rien à vérifier.")
+            return 0
+        user = db.get(User, user[0])
+        day_min, day_max = db.exec(text(
+            "SELECT min(played_at)::date::text, max(played_at)::date::text FROM trackhistory WHERE user_id = :u"
+        ), params={"u": user.id}).one()
+        db.execute(text("SET LOCAL enable_seqscan = off"))
+
+        captured = []
+        def capture(conn, cursor, statement, parameters, context, executemany):
+            if not statement.lstrip().upper().startswith(("SELECT", "WITH")): return
+            if conn.dialect.driver == "asyncpg": statement, parameters = to_pyformat(statement, parameters)
+            captured.append((statement, parameters))
+        failures = 0
+        # Requêtes émises par les deux moteurs (psycopg2 et asyncpg), expliquées sur la session synchrone
+        engines = (engine, async_engine.sync_engine)
+        for name, call, *pruned_year in endpoint_calls(db, adb, user, day_min, day_max):
+            captured.clear()
+            for target in engines: event.listen(target, "before_cursor_execute", capture)
+            try:
+                result = call()
+                if asyncio.iscoroutine(result): await result
+            finally:
+                for target in engines: event.remove(target, "before_cursor_execute", capture)
+
+            scans, indexes, partitions = [], set(), set()
+            for statement, parameters in captured:
+                for node in explain(db, statement, parameters):
+                    relation = node.get("Relation Name") or ""
+                    if node.get("Index Name"): indexes.add(node["Index Name"])
+                    if relation.startswith("trackhistory_"): partitions.add(relation)
+                    if node["Node Type"] == "Seq Scan" and (relation in CHECKED_TABLES or relation.startswith("trackhistory_")): scans.append(relation)
+            # Élagage : seule la partition de l'année demandée est lue
+            unpruned = sorted(partitions - {f"trackhistory_y{pruned_year[0]}"}) if pruned_year else []
+            status = "❌" if scans or unpruned else "✅"
+            failures += bool(scans or unpruned)
+            print(f"{status} {name:<22} {len(captured):>2} requête(s) | index : {', '.join(sorted(indexes)) or '-'}")
+            if partitions: print(f"   partitions lues : {', '.join(sorted(partitions))}")
+            if scans: print(f"   parcours séquentiel de : {', '.join(sorted(set(scans)))}")
+            if unpruned: print(f"   partitions hors période : {', '.join(unpruned)}")
+        db.rollback()
+    return 1 if failures else 0
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
@@ -0,0 +1,87 @@
+"""
+Test de charge des endpoints de lecture : N clients concurrents pendant D secondes contre une API lancée
+(uvicorn), avec débit (req/s) et latences p50 / p95 / p99 par endpoint.
+
+Usage (depuis backend/, API démarrée sur --url) :
+    python -m benchmarks.load_test --url http://127.0.0.1:8000 --users 50 --duration 30 --session <session_id>
+
+Sans --session, seuls les endpoints publics (/data/all, /data/search, /profile) sont sollicités.
+Pour mesurer la base (et non le cache des réponses), lancer l'API avec CACHE_BACKEND_URL=none:// ;
+la colonne `hit` compte les réponses servies par le cache (en-têtes X-FastAPI-Cache / X-Cache).
+"""
+import argparse
+import asyncio
+import random
+import statistics
+import time
+from collections import defaultdict
+import httpx
+
+PUBLIC_ENDPOINTS = [
+    "/data/all/tracks?limit=50",
+    "/data/all/albums?limit=50",
+    "/data/all/artists?limit=50",
+    "/data/all/albums?limit=50&date_min=2020-01-01",
+    "/data/search?q=a&limit=10",
+]
+USER_ENDPOINTS = [
+    "/data/my/tracks?limit=50",
+    "/data/my/albums?limit=50",
+    "/data/my/artists?limit=50&streams_min=0&minutes_min=0&rating_min=0&engagement_min=0",
+    "/data/my/today",
+    "/data/my/resume?range=year",
+    "/data/my/tracks/metadata",
+]
+
+def percentile(values, q):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+def is_cache_hit(response: httpx.Response) -> bool:
+    return response.headers.get("x-fastapi-cache", "").upper() == "HIT" or response.headers.get("x-cache") == "hit"
+
+async def client_loop(client: httpx.AsyncClient, endpoints, deadline: float, latencies, errors, hits):
+    while time.monotonic() < deadline:
+        path = random.choice(endpoints)
+        start = time.perf_counter()
+        try:
+            response = await client.get(path)
+            if response.status_code >= 400: errors[path] += 1
+            if is_cache_hit(response): hits[path] += 1
+        except httpx.HTTPError: errors[path] += 1
+        latencies[path].append((time.perf_counter() - start) * 1000)
+
+async def run(url: str, users: int, duration: float, session_id: str, profile: str):
+    endpoints = PUBLIC_ENDPOINTS + ([f"/profile/{profile}"] if profile else []) + (USER_ENDPOINTS if session_id else [])
+    latencies, errors, hits = defaultdict(list), defaultdict(int), defaultdict(int)
+    limits = httpx.Limits(max_connections=users, max_keepalive_connections=users)
+    cookies = {"session_id": session_id} if session_id else None
+    async with httpx.AsyncClient(base_url=url, cookies=cookies, limits=limits, timeout=60) as client:
+        deadline = time.monotonic() + duration
+        start = time.perf_counter()
+        await asyncio.gather(*(client_loop(client, endpoints, deadline, latencies, errors, hits) for _ in range(users)))
+        elapsed = time.perf_counter() - start
+
+    everything = [ms for values in latencies.values() for ms in values]
+    if not everything: return print("⚠️ Aucune requête effectuée")
+    print(f"{'endpoint':<90} | {'req':>6} | {'err':>4} | {'hit':>6} | {'p50 ms':>8} | {'p95 ms':>8} | {'p99 ms':>8}")
+    for path in endpoints:
+        values = latencies[path]
+        if not values: continue
+        print(f"{path:<90} | {len(values):>6} | {errors[path]:>4} | {hits[path]:>6} | {statistics.median(values):>8.1f} | {percentile(values, 0.95):>8.1f} | {percentile(values, 0.99):>8.1f}")
+    print(f"\n{users} clients, {elapsed:.1f} s : {len(everything) / elapsed:.1f} req/s, "
+          f"p50 {statistics.median(everything):.1f} ms, p95 {percentile(everything, 0.95):.1f} ms, "
+          f"p99 {percentile(everything, 0.99):.1f} ms, {sum(errors.values())} erreur(s), {sum(hits.values())} réponse(s) du cache")
+
+def main():
+    parser = argparse.ArgumentParser(description="Test de charge des endpoints de lecture")
+    parser.add_argument("--url", default="http://127.0.0.1:8000")
+    parser.add_argument("--users", type=int, default=50, help="clients concurrents")
+    parser.add_argument("--duration", type=float, default=30, help="durée en secondes")
+    parser.add_argument("--session", default="", help="cookie session_id d'un utilisateur (endpoints /data/my)")
+    parser.add_argument("--profile", default="", help="slug ou id d'un profil public (/profile/{slug})")
+    args = parser.parse_args()
+    asyncio.run(run(args.url, args.users, args.duration, args.session, args.profile))
+
+if __name__ == "__main__":
+    main()
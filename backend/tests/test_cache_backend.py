@@ -0,0 +1,36 @@
+import asyncio
+import time
+from fastapi_cache import FastAPICache
+from sqlmodel import Session
+from app.utils.cache_backend import CoalescingBackend, cache, cache_key_builder, create_cache_backend
+
+async def endpoint(*, db=None, limit: int = 50, sort: str = "play_count"): ...
+
+def test_key_ignores_injected_session():
+    first = cache_key_builder(endpoint, "ns", kwargs={"db": Session(), "limit": 50, "sort": "rating"})
+    second = cache_key_builder(endpoint, "ns", kwargs={"sort": "rating", "db": Session(), "limit": 50})
+    other = cache_key_builder(endpoint, "ns", kwargs={"db": Session(), "limit": 10, "sort": "rating"})
+    assert first == second
+    assert first != other
+
+def test_failed_compute_releases_waiters():
+    async def scenario():
+        FastAPICache.init(create_cache_backend("memory://"), key_builder=cache_key_builder)
+        calls = []
+
+        @cache(expire=60)
+        async def flaky(*, limit: int = 50):
+            calls.append(limit)
+            await asyncio.sleep(0.05)
+            if len(calls) == 1: raise RuntimeError("échec du calcul")
+            return {"limit": limit}
+
+        start = time.monotonic()
+        first, second = await asyncio.gather(flaky(limit=5), flaky(limit=5), return_exceptions=True)
+        assert isinstance(first, RuntimeError)
+        # La requête en attente a pris le relais tout de suite (sans attendre COMPUTE_TIMEOUT)
+        assert second == {"limit": 5} and time.monotonic() - start < 5
+        assert await flaky(limit=5) == {"limit": 5} and len(calls) == 2
+        assert isinstance(FastAPICache.get_backend(), CoalescingBackend) and not FastAPICache.get_backend()._inflight
+
+    asyncio.run(scenario())
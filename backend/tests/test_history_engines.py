@@ -0,0 +1,50 @@
+import json
+from app.utils.history_parser import ParsedHistory, parse_history_file
+from app.utils.history_vectorized import normalize_columns, parse_history_file_vectorized
+
+def write_history(tmp_path, entries):
+    path = tmp_path / "Streaming_History.json"
+    path.write_text(json.dumps(entries))
+    return str(path)
+
+def play(ts, track, ms=200000, title="Titre"):
+    return {"ts": ts, "ms_played": ms, "spotify_track_uri": f"spotify:track:{track}", "master_metadata_track_name": title}
+
+def test_no_valid_rows():
+    assert normalize_columns(["2020-01-02T00:00:00Z"], [100], [""], [None]) == ParsedHistory()
+    assert normalize_columns(["pas une date"], [100], ["spotify:track:a"], [None]) == ParsedHistory()
+    assert normalize_columns([], [], [], []) == ParsedHistory()
+
+def test_engines_match(tmp_path):
+    path = write_history(tmp_path, [
+        play("2020-01-02T00:00:00Z", "b", title="B"),
+        play("2020-01-02T00:03:00Z", "a", ms=1000, title="A"),  # "skip" : s'efface devant l'écoute valide suivante
+        play("2020-01-02T02:03:00+02:00", "a", title="A bis"),  # même écoute que la précédente, en heure locale
+        play("2020-01-02T00:06:00.250Z", "c"),
+        play("2020-01-02T00:09:00", "b"),
+        play("2020-01-02T00:00:00Z", "b", ms=5),  # doublon : la première écoute valide fait foi
+        play("2020-01-02T00:15:00Z", "c", ms=1000),
+        play("2020-01-02T00:15:00Z", "c", ms=20),  # "skip" sans écoute valide : gardé une fois, après les écoutes valides
+        play("illisible", "d"),
+        play(None, "d"),
+        {"ts": "2020-01-02T00:12:00Z", "spotify_track_uri": None},
+        "pas un objet",
+    ])
+    expected = parse_history_file(path)
+    assert parse_history_file_vectorized(path) == expected
+    assert expected.entries == 12
+    assert expected.track_ids == ["b", "a", "c"] and expected.titles == ["B", "A", "Titre"]
+    assert list(expected.rows(0, len(expected))) == [
+        (0, 1577923200000, "b", 200000, "B"),
+        (1, 1577923380000, "a", 200000, "A"),
+        (2, 1577923560250, "c", 200000, "Titre"),
+        (3, 1577923740000, "b", 200000, "B"),
+        (4, 1577924100000, "c", 1000, "Titre"),
+    ]
+
+def test_engines_match_on_truncated_file(tmp_path):
+    path = tmp_path / "Streaming_History.json"
+    path.write_text(json.dumps([play("2020-01-02T00:00:00Z", "a"), play("2020-01-02T00:03:00Z", "b")])[:-40])
+    expected = parse_history_file(str(path))
+    assert parse_history_file_vectorized(str(path)) == expected
+    assert len(expected) == 1 and expected.error
@@ -1,21 +1,22 @@
-CREATE OR REPLACE FUNCTION repair_track_history()
+-- Réparation des liens artiste / album de l'historique, pour une liste de pistes enrichies.
+-- Installée au démarrage de l'API (app.utils.history_links) ; seules les écoutes sans lien sont lues
+-- (index partiel ix_trackhistory_unlinked), les écoutes de pistes pas encore enrichies sont laissées de côté.
+-- Exemple : SELECT repair_track_history(ARRAY['4uLU6hMCjMI75M1A2tKUQC']);
+DROP FUNCTION IF EXISTS repair_track_history();
+CREATE OR REPLACE FUNCTION repair_track_history(p_track_ids varchar[])
 RETURNS integer AS $$
 DECLARE
     rows_updated integer;
 BEGIN
-    WITH target_ids AS (
-        SELECT id 
-        FROM trackhistory 
-        WHERE artist_id IS NULL OR album_id IS NULL
-        LIMIT 25000
-    )
-    UPDATE trackhistory
+    UPDATE trackhistory h
     SET 
-        artist_id = track.artist_id,
-        album_id = track.album_id
-    FROM track, target_ids
-    WHERE trackhistory.id = target_ids.id
-      AND trackhistory.spotify_id = track.spotify_id;
+        artist_id = t.artist_id,
+        album_id = t.album_id
+    FROM track t
+    WHERE h.spotify_id = ANY(p_track_ids)
+      AND (h.artist_id IS NULL OR h.album_id IS NULL)
+      AND t.spotify_id = h.spotify_id
+      AND t.artist_id IS NOT NULL AND t.album_id IS NOT NULL;
       
     GET DIAGNOSTICS rows_updated = ROW_COUNT;
     RETURN rows_updated;